@@ -0,0 +1,99 @@
+"""
+企业微信消息解析微基准
+对比每条消息的处理开销（不含 AES 解密本身，两种方式相同）:
+- before: 每条消息新建 WeChatCrypto，ElementTree 解析外层 XML 取 Encrypt，再解析解密后的 XML 逐个 find
+- after:  从 CryptoCache 取已初始化的实例，extract_fields 单次扫描外层和解密后的 XML
+
+用法:
+    python bench_wechat_message.py            # 默认 50000 条
+    python bench_wechat_message.py -n 200000
+"""
+
+import argparse
+import base64
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from wechat_message import CryptoCache, extract_fields
+
+try:
+    from wechat_crypto import WeChatCrypto
+except ImportError:
+    WeChatCrypto = None
+
+TOKEN = "benchtoken"
+AES_KEY = base64.b64encode(os.urandom(32)).decode().rstrip("=")
+CORP_ID = "ww0123456789abcdef"
+
+ENVELOPE = (
+    "<xml><ToUserName><![CDATA[ww0123456789abcdef]]></ToUserName>"
+    f"<Encrypt><![CDATA[{base64.b64encode(os.urandom(384)).decode()}]]></Encrypt>"
+    "<AgentID><![CDATA[1000002]]></AgentID></xml>"
+)
+MESSAGE = (
+    "<xml><ToUserName><![CDATA[ww0123456789abcdef]]></ToUserName>"
+    "<FromUserName><![CDATA[zhangsan]]></FromUserName>"
+    "<CreateTime>1700000000</CreateTime>"
+    "<MsgType><![CDATA[text]]></MsgType>"
+    "<Content><![CDATA[你好，这是一条测试消息]]></Content>"
+    "<MsgId>7300000000000000001</MsgId>"
+    "<AgentID>1000002</AgentID></xml>"
+)
+
+
+def before(body: bytes):
+    if WeChatCrypto is not None:
+        WeChatCrypto(token=TOKEN, encoding_aes_key=AES_KEY, corp_id=CORP_ID)
+    root = ET.fromstring(body.decode("utf-8", errors="replace"))
+    root.find("Encrypt").text
+    root = ET.fromstring(MESSAGE)
+    return {
+        tag: (node.text if node is not None else "")
+        for tag, node in (
+            (t, root.find(t))
+            for t in ("MsgType", "FromUserName", "ToUserName", "Content", "CreateTime", "MsgId")
+        )
+    }
+
+
+def after(cache: CryptoCache, body: bytes):
+    if WeChatCrypto is not None:
+        cache.get(TOKEN, AES_KEY, CORP_ID)
+    extract_fields(body, ("Encrypt",))["Encrypt"]
+    return extract_fields(MESSAGE)
+
+
+def run(label: str, fn, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    elapsed = time.perf_counter() - start
+    rate = n / elapsed
+    print(f"{label:<8} {n} 条, {elapsed:.3f} 秒, {rate:,.0f} 条/秒")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="企业微信消息解析微基准")
+    parser.add_argument("-n", type=int, default=50000, help="消息条数")
+    args = parser.parse_args()
+
+    if WeChatCrypto is None:
+        print("未找到 wechat_crypto，只比较 XML 解析部分")
+
+    body = ENVELOPE.encode()
+    cache = CryptoCache(WeChatCrypto) if WeChatCrypto is not None else None
+
+    # 结果一致性检查
+    expected = before(body)
+    actual = after(cache, body)
+    assert all(actual.get(k, "") == v for k, v in expected.items()), (expected, actual)
+
+    rate_before = run("before", lambda: before(body), args.n)
+    rate_after = run("after", lambda: after(cache, body), args.n)
+    print(f"提升 {rate_after / rate_before:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
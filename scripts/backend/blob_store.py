@@ -0,0 +1,316 @@
+"""
+Webhook 原始负载存储 - 按 SHA-256 内容寻址
+原始字节压缩后写入 webhook_payloads（bytea），相同负载只存一份；
+webhook_logs 只保存引用（body_ref）和原始大小（body_size）；
+不再被任何 webhook_logs 引用的负载由 PayloadCollector 定期清理
+"""
+
+import asyncio
+import gzip
+import hashlib
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text
+
+# zstd 可选，未安装时使用 gzip
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+ENCODING_ZSTD = "zstd"
+ENCODING_GZIP = "gzip"
+ENCODING_IDENTITY = "identity"
+
+# 超过该大小的负载在线程池中压缩/解压，避免阻塞事件循环
+OFFLOAD_THRESHOLD = 64 * 1024
+# 小于该大小的负载不压缩
+MIN_COMPRESS_SIZE = 256
+
+# 已有负载再次写入时，created_at 早于该间隔才刷新（减少热点负载的重复更新）
+TOUCH_INTERVAL = "1 hour"
+
+# 负载清理的 advisory lock 键，多进程同一时刻只有一个执行清理
+PAYLOAD_GC_LOCK = 0x7765626870676300
+
+# 单段字节范围 "bytes=start-end"
+_RANGE_RE = re.compile(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$", re.IGNORECASE)
+
+
+class PreparedPayload(NamedTuple):
+    """已计算摘要并压缩、待写入的负载"""
+    sha256: str
+    size: int
+    encoding: str
+    data: bytes
+
+
+def compress(body, digest: Optional[str] = None) -> PreparedPayload:
+    """body 可以是 bytes 或任意字节缓冲（memoryview / mmap），digest 为已计算的 SHA-256"""
+    digest = digest or hashlib.sha256(body).hexdigest()
+    if len(body) < MIN_COMPRESS_SIZE:
+        return PreparedPayload(digest, len(body), ENCODING_IDENTITY, bytes(body))
+    if ZSTD_AVAILABLE:
+        data = zstandard.ZstdCompressor(level=3).compress(body)
+        encoding = ENCODING_ZSTD
+    else:
+        data = gzip.compress(body, compresslevel=6)
+        encoding = ENCODING_GZIP
+    # 压缩无收益（已压缩的二进制等）时保存原文
+    if len(data) >= len(body):
+        return PreparedPayload(digest, len(body), ENCODING_IDENTITY, bytes(body))
+    return PreparedPayload(digest, len(body), encoding, data)
+
+
+def decompress(encoding: str, data: bytes) -> bytes:
+    if encoding == ENCODING_IDENTITY:
+        return data
+    if encoding == ENCODING_GZIP:
+        return gzip.decompress(data)
+    if encoding == ENCODING_ZSTD:
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("zstandard is required to read zstd payloads")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown payload encoding: {encoding}")
+
+
+async def prepare_payload(body, digest: Optional[str] = None) -> PreparedPayload:
+    """计算摘要并压缩（大负载在线程池中执行）"""
+    if len(body) > OFFLOAD_THRESHOLD:
+        return await asyncio.to_thread(compress, body, digest)
+    return compress(body, digest)
+
+
+async def write_payloads(conn, payloads):
+    """在给定连接/事务中写入负载，已存在的摘要不重写数据
+
+    已存在的行会被锁定并按需刷新 created_at，与 PayloadCollector 的删除互斥：
+    清理不会删掉本事务即将引用的负载；按摘要排序写入，避免并发事务互相死锁
+    """
+    unique = {p.sha256: p for p in payloads}
+    if not unique:
+        return
+    await conn.execute(
+        text(f"""
+            INSERT INTO webhook_payloads (sha256, size, encoding, data, created_at)
+            VALUES (:sha256, :size, :encoding, :data, NOW())
+            ON CONFLICT (sha256) DO UPDATE SET created_at = NOW()
+            WHERE webhook_payloads.created_at < NOW() - INTERVAL '{TOUCH_INTERVAL}'
+        """),
+        [unique[sha256]._asdict() for sha256 in sorted(unique)]
+    )
+
+
+async def load_payload(db, sha256: str) -> Optional[bytes]:
+    """读取并解压负载原始字节，不存在时返回 None"""
+    result = await db.execute(
+        text("SELECT encoding, data FROM webhook_payloads WHERE sha256 = :sha256"),
+        {"sha256": sha256}
+    )
+    row = result.fetchone()
+    if row is None:
+        return None
+    data = bytes(row.data)
+    if len(data) > OFFLOAD_THRESHOLD:
+        return await asyncio.to_thread(decompress, row.encoding, data)
+    return decompress(row.encoding, data)
+
+
+class PayloadCache:
+    """解压后负载的短期缓存（按摘要，内容不可变）
+
+    分段读取同一个大负载时每次 Range 请求不必重新读取和解压整个负载；
+    按总字节数限制容量，单个超过 max_entry_bytes 的负载不缓存
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: int = 16 * 1024 * 1024, ttl: float = 60.0):
+        self._max_bytes = max_bytes
+        self._max_entry_bytes = max_entry_bytes
+        self._ttl = ttl
+        # sha256 -> (过期时间, 原始字节)
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def load(self, db, sha256: str) -> Optional[bytes]:
+        """同 load_payload，命中时不访问数据库；同一摘要并发未命中时只加载一次"""
+        entry = self._entries.get(sha256)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(sha256)
+                self.hits += 1
+                return entry[1]
+            self._drop(sha256)
+
+        self.misses += 1
+        future = self._inflight.get(sha256)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[sha256] = future
+        try:
+            data = await load_payload(db, sha256)
+            if data is not None:
+                self._store(sha256, data)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._inflight[sha256]
+
+    def _store(self, sha256: str, data: bytes):
+        if len(data) > self._max_entry_bytes:
+            return
+        self._drop(sha256)
+        self._entries[sha256] = (time.monotonic() + self._ttl, data)
+        self._bytes += len(data)
+        while self._bytes > self._max_bytes:
+            _, (_, old) = self._entries.popitem(last=False)
+            self._bytes -= len(old)
+
+    def _drop(self, sha256: str):
+        entry = self._entries.pop(sha256, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def get_stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self._max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def parse_range(range_header: Optional[str], size: int):
+    """解析单段 HTTP Range 头，返回 (start, end) 闭区间
+
+    无 Range、无法解析、非 bytes 单位或多段范围时返回 None（按 RFC 9110 忽略，返回完整内容）；
+    格式正确但不可满足时抛出 ValueError
+    """
+    if not range_header:
+        return None
+    match = _RANGE_RE.match(range_header)
+    if match is None:
+        return None
+    start_s, end_s = match.groups()
+    if start_s == "":
+        if end_s == "":
+            return None
+        # 后缀范围: 最后 N 字节
+        length = int(end_s)
+        if length == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, size - length), size - 1
+    start = int(start_s)
+    if end_s and int(end_s) < start:
+        return None
+    if start >= size:
+        raise ValueError("Unsatisfiable range")
+    end = min(int(end_s), size - 1) if end_s else size - 1
+    return start, end
+
+
+class PayloadCollector:
+    """定期删除不再被 webhook_logs 引用的负载
+
+    - 只删除 created_at 早于 grace 秒的负载；write_payloads 复用已有负载时会刷新 created_at 并锁定该行，
+      正在写入、尚未提交的日志所引用的负载不会被删除
+    - 每批最多 batch_size 行，删满一批立即继续；多进程通过 advisory lock 同一时刻只有一个执行
+    """
+
+    def __init__(self, session_factory, interval: float = 3600.0, grace: float = 86400.0, batch_size: int = 1000):
+        self._session_factory = session_factory
+        self._interval = interval
+        self._grace = grace
+        self._batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.deleted = 0
+        self.last_run_at: Optional[float] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                deleted = await self.collect()
+                if deleted:
+                    logger.info("[PayloadGC] 已清理未引用负载: %d", deleted)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("[PayloadGC] 负载清理失败，下次重试: %s", e)
+            await asyncio.sleep(self._interval)
+
+    async def collect(self) -> int:
+        """清理一轮，返回删除的负载数"""
+        total = 0
+        while True:
+            deleted = await self._collect_batch()
+            if deleted is None:
+                break
+            total += deleted
+            if deleted < self._batch_size:
+                break
+        self.runs += 1
+        self.deleted += total
+        self.last_run_at = time.time()
+        return total
+
+    async def _collect_batch(self) -> Optional[int]:
+        """删除一批，其他进程正在清理时返回 None"""
+        async with self._session_factory() as db:
+            result = await db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": PAYLOAD_GC_LOCK})
+            if not result.scalar():
+                return None
+            # 外层条件在行被并发写入锁定后会重新检查，刷新过 created_at 的负载不会被删除
+            result = await db.execute(
+                text("""
+                    DELETE FROM webhook_payloads p
+                    WHERE p.sha256 IN (
+                        SELECT c.sha256 FROM webhook_payloads c
+                        WHERE c.created_at < NOW() - make_interval(secs => :grace)
+                          AND NOT EXISTS (SELECT 1 FROM webhook_logs w WHERE w.body_ref = c.sha256)
+                        LIMIT :limit
+                    )
+                    AND p.created_at < NOW() - make_interval(secs => :grace)
+                """),
+                {"grace": self._grace, "limit": self._batch_size}
+            )
+            await db.commit()
+            return result.rowcount
+
+    def get_stats(self) -> dict:
+        return {
+            "interval": self._interval,
+            "grace": self._grace,
+            "runs": self.runs,
+            "deleted": self.deleted,
+            "last_run_at": self.last_run_at,
+        }
@@ -0,0 +1,119 @@
+"""
+Webhook 投递 HTTP 客户端
+由 lifespan 持有的长连接 aiohttp 会话：按目标主机复用连接池、DNS TTL 缓存、HTTP keep-alive，
+并通过 aiohttp TraceConfig 统计连接新建/复用/排队情况，便于按目标规模调整连接池
+"""
+
+import logging
+from typing import Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryClient:
+    """共享的 Webhook 投递客户端"""
+
+    def __init__(
+        self,
+        limit: int = 200,
+        limit_per_host: int = 20,
+        ttl_dns_cache: int = 300,
+        keepalive_timeout: float = 30.0,
+        timeout: float = 30.0,
+    ):
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._ttl_dns_cache = ttl_dns_cache
+        self._keepalive_timeout = keepalive_timeout
+        self._timeout = timeout
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        # 连接池统计
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.total_waits = 0
+        self.requests = 0
+
+    async def start(self):
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+        trace_config.on_connection_queued_start.append(self._on_queued_start)
+        trace_config.on_connection_queued_end.append(self._on_queued_end)
+        trace_config.on_request_start.append(self._on_request_start)
+
+        self._connector = aiohttp.TCPConnector(
+            limit=self._limit,
+            limit_per_host=self._limit_per_host,
+            ttl_dns_cache=self._ttl_dns_cache,
+            keepalive_timeout=self._keepalive_timeout,
+            enable_cleanup_closed=True,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=self._connector,
+            timeout=aiohttp.ClientTimeout(total=self._timeout),
+            trace_configs=[trace_config],
+        )
+        logger.info(
+            f"[Delivery] 投递客户端已启动: limit={self._limit}, "
+            f"limit_per_host={self._limit_per_host}, ttl_dns_cache={self._ttl_dns_cache}s"
+        )
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+            self._session = None
+            self._connector = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("DeliveryClient is not started")
+        return self._session
+
+    async def _on_connection_create(self, session, ctx, params):
+        self.connections_created += 1
+
+    async def _on_connection_reuse(self, session, ctx, params):
+        self.connections_reused += 1
+
+    async def _on_queued_start(self, session, ctx, params):
+        self.waiting += 1
+        self.total_waits += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+
+    async def _on_queued_end(self, session, ctx, params):
+        self.waiting -= 1
+
+    async def _on_request_start(self, session, ctx, params):
+        self.requests += 1
+
+    def get_stats(self) -> dict:
+        connector = self._connector
+        in_use = len(getattr(connector, "_acquired", ())) if connector else 0
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values()) if connector else 0
+        per_host = {}
+        if connector:
+            for key, conns in getattr(connector, "_acquired_per_host", {}).items():
+                if conns:
+                    per_host[f"{key.host}:{key.port}"] = len(conns)
+        return {
+            "limit": self._limit,
+            "limit_per_host": self._limit_per_host,
+            "ttl_dns_cache": self._ttl_dns_cache,
+            "keepalive_timeout": self._keepalive_timeout,
+            "connections_open": in_use + idle,
+            "connections_in_use": in_use,
+            "connections_idle": idle,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "total_waits": self.total_waits,
+            "requests": self.requests,
+            "in_use_per_host": per_host,
+        }
@@ -0,0 +1,260 @@
+"""
+Webhook 投递持久化队列 - Redis Streams + 消费组
+API 进程只负责入队，独立的 webhook_worker 进程消费并投递；
+消费者崩溃后未确认的消息会被其他消费者通过 XAUTOCLAIM 接管；
+消息确认后立即 XDEL，流中只保留未完成的投递
+"""
+
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_STREAM = "webhook:deliveries"
+DELIVERY_GROUP = "webhook-workers"
+
+
+def _field(fields: dict, name: str, default=None):
+    """兼容 decode_responses 开/关两种 Redis 客户端"""
+    return fields.get(name.encode(), fields.get(name, default))
+
+
+def _text(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    return value or None
+
+
+async def enqueue_delivery(
+    redis_conn,
+    log_id: str,
+    tenant_id: str,
+    webhook_url: str,
+    headers: dict,
+    body: bytes,
+    secret_key: Optional[str],
+    retry_count: int = 0,
+    body_ref: Optional[str] = None
+) -> str:
+    """投递任务入队，返回消息 ID
+
+    有 body_ref 时流中只记录负载摘要，由消费者从负载存储读取请求体；
+    流不按长度裁剪（裁剪不感知消费进度，会丢弃未确认的投递），确认后的消息由消费者删除
+    """
+    message_id = await redis_conn.xadd(
+        DELIVERY_STREAM,
+        {
+            "log_id": log_id,
+            "tenant_id": tenant_id,
+            "webhook_url": webhook_url,
+            "headers": json.dumps(headers),
+            "body": b"" if body_ref else (body or b""),
+            "body_ref": body_ref or "",
+            "secret_key": secret_key or "",
+            "retry_count": retry_count,
+        }
+    )
+    return message_id
+
+
+def decode_delivery(fields: dict) -> dict:
+    """把流消息字段还原为 process_webhook_retry 的参数（有 body_ref 时 body 为 None）"""
+    body_ref = _text(_field(fields, "body_ref"))
+    body = None
+    if body_ref is None:
+        body = _field(fields, "body", b"")
+        body = body if isinstance(body, bytes) else body.encode("utf-8")
+    return {
+        "log_id": _text(_field(fields, "log_id")),
+        "tenant_id": _text(_field(fields, "tenant_id")),
+        "webhook_url": _text(_field(fields, "webhook_url")),
+        "headers": json.loads(_text(_field(fields, "headers")) or "{}"),
+        "body": body,
+        "body_ref": body_ref,
+        "secret_key": _text(_field(fields, "secret_key")),
+        "retry_count": int(_text(_field(fields, "retry_count")) or 0),
+    }
+
+
+# ======== 企业微信入站队列（快速应答模式） ========
+# 验签解密后立即入队并应答企业微信，配额/日志/推送/转发由消费者异步完成
+
+WECHAT_INBOUND_STREAM = "wechat:inbound"
+WECHAT_INBOUND_GROUP = "wechat-inbound"
+WECHAT_INBOUND_MAXLEN = 200_000
+
+
+async def enqueue_wechat_message(
+    redis_conn,
+    api_key: str,
+    xml: str,
+    headers: dict,
+    source_ip: str,
+    dedup_key: Optional[str] = None
+) -> str:
+    message_id = await redis_conn.xadd(
+        WECHAT_INBOUND_STREAM,
+        {
+            "api_key": api_key,
+            "xml": xml,
+            "headers": json.dumps(headers),
+            "source_ip": source_ip,
+            "dedup_key": dedup_key or "",
+        },
+        maxlen=WECHAT_INBOUND_MAXLEN,
+        approximate=True
+    )
+    return message_id
+
+
+def decode_wechat_message(fields: dict) -> dict:
+    return {
+        "api_key": _text(_field(fields, "api_key")),
+        "xml": _text(_field(fields, "xml")) or "",
+        "headers": json.loads(_text(_field(fields, "headers")) or "{}"),
+        "source_ip": _text(_field(fields, "source_ip")) or "unknown",
+        "dedup_key": _text(_field(fields, "dedup_key")),
+    }
+
+
+class DeliveryConsumer:
+    """投递队列消费者（每个 worker 进程一个）
+
+    stream / group / decode 可替换，用于消费其他同样语义（至少一次、确认后删除）的队列
+    """
+
+    def __init__(
+        self,
+        redis_conn,
+        consumer_name: str,
+        handler: Callable[[dict], Awaitable[None]],
+        concurrency: int = 100,
+        batch_size: int = 50,
+        block_ms: int = 5000,
+        claim_idle_ms: int = 300_000,
+        stream: str = DELIVERY_STREAM,
+        group: str = DELIVERY_GROUP,
+        decode: Callable[[dict], dict] = decode_delivery,
+    ):
+        self._redis = redis_conn
+        self._stream = stream
+        self._group = group
+        self._decode = decode
+        self.consumer_name = consumer_name
+        self._handler = handler
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._batch_size = batch_size
+        self._block_ms = block_ms
+        self._claim_idle_ms = claim_idle_ms
+        self._tasks: set = set()
+        self._stopping = False
+        self.processed = 0
+        self.failed = 0
+        self.claimed = 0
+
+    async def ensure_group(self):
+        try:
+            await self._redis.xgroup_create(self._stream, self._group, id="0", mkstream=True)
+            logger.info(f"[DeliveryQueue] 已创建消费组 {self._stream}/{self._group}")
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def run(self):
+        """主循环：读取新消息，定期接管超时未确认的消息"""
+        await self.ensure_group()
+        claim_task = asyncio.create_task(self._claim_loop())
+        try:
+            while not self._stopping:
+                # 并发已满时不再拉取，避免消息堆积在本进程内存
+                await self._semaphore.acquire()
+                self._semaphore.release()
+                try:
+                    response = await self._redis.xreadgroup(
+                        self._group,
+                        self.consumer_name,
+                        {self._stream: ">"},
+                        count=self._batch_size,
+                        block=self._block_ms
+                    )
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"[DeliveryQueue] 读取队列失败，1秒后重试: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                for _, messages in response or []:
+                    for message_id, fields in messages:
+                        await self._dispatch(message_id, fields)
+        finally:
+            claim_task.cancel()
+
+    async def _claim_loop(self):
+        """接管其他（已崩溃）消费者长时间未确认的消息"""
+        while not self._stopping:
+            await asyncio.sleep(self._claim_idle_ms / 1000 / 2)
+            try:
+                start_id = "0-0"
+                while True:
+                    result = await self._redis.xautoclaim(
+                        self._stream, self._group, self.consumer_name,
+                        min_idle_time=self._claim_idle_ms, start_id=start_id, count=self._batch_size
+                    )
+                    start_id, messages = result[0], result[1]
+                    for message_id, fields in messages:
+                        if fields:
+                            self.claimed += 1
+                            await self._dispatch(message_id, fields)
+                    if start_id in (b"0-0", "0-0"):
+                        break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[DeliveryQueue] 接管未确认消息失败: {e}")
+
+    async def _dispatch(self, message_id, fields: dict):
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._process(message_id, fields))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, message_id, fields: dict):
+        try:
+            try:
+                await self._handler(self._decode(fields))
+                self.processed += 1
+            except Exception as e:
+                # 投递结果已由 handler 记录；这里的异常说明消息本身无法处理，确认后丢弃避免反复重放
+                self.failed += 1
+                logger.error(f"[DeliveryQueue] 处理消息失败 id={message_id}: {e}")
+            # 被取消（进程退出）时不确认，消息留在 PEL 中由其他消费者接管；
+            # 确认后同时删除，已完成的消息不再占用 Redis 内存
+            try:
+                pipe = self._redis.pipeline(transaction=False)
+                pipe.xack(self._stream, self._group, message_id)
+                pipe.xdel(self._stream, message_id)
+                await pipe.execute()
+            except Exception as e:
+                logger.error(f"[DeliveryQueue] 确认消息失败 id={message_id}: {e}")
+        finally:
+            self._semaphore.release()
+
+    async def stop(self, timeout: float = 30.0):
+        """停止拉取，等待进行中的投递完成（未完成的消息保持未确认，由其他消费者接管）"""
+        self._stopping = True
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=timeout)
+
+    def get_stats(self) -> dict:
+        return {
+            "stream": self._stream,
+            "consumer": self.consumer_name,
+            "in_flight": len(self._tasks),
+            "processed": self.processed,
+            "failed": self.failed,
+            "claimed": self.claimed,
+        }
@@ -0,0 +1,226 @@
+"""
+投递目标主机健康跟踪
+按目标主机维护熔断器（closed / open / half_open）和 AIMD 自适应并发上限：
+- 连续失败达到阈值后熔断，熔断期内不再拨号，直接排期重试
+- 熔断到期后放行一个探测请求（half_open），成功则恢复，失败则加倍熔断时长
+- 成功且延迟正常时并发上限加性增长，429/5xx/超时/高延迟时乘性减半
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# 各 worker 上报的主机状态（API 进程汇总读取）
+HEALTH_KEY_PREFIX = "delivery:health:"
+
+
+def destination_host(url: str) -> str:
+    parts = urlsplit(url)
+    return (parts.netloc or url).lower()
+
+
+class ShortCircuit(Exception):
+    """目标主机不可用，本次不拨号"""
+
+    def __init__(self, host: str, retry_after: float, reason: str):
+        super().__init__(f"{host}: {reason}")
+        self.host = host
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class HostHealth:
+    """单个目标主机的熔断与并发状态"""
+
+    def __init__(self, host: str, config: dict):
+        self.host = host
+        self._config = config
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.open_duration = config["open_seconds"]
+        self.probe_in_flight = False
+        self.limit = float(config["initial_limit"])
+        self.in_flight = 0
+        self.latency_ewma_ms: Optional[float] = None
+        self.successes = 0
+        self.failures = 0
+        self.short_circuits = 0
+        self._slot_freed = asyncio.Condition()
+
+    async def acquire(self) -> bool:
+        """获取一个投递名额，返回是否为 half_open 探测请求"""
+        now = time.monotonic()
+        if self.state == STATE_OPEN:
+            if now < self.open_until:
+                self.short_circuits += 1
+                raise ShortCircuit(self.host, self.open_until - now, "circuit open")
+            self.state = STATE_HALF_OPEN
+            self.probe_in_flight = False
+
+        if self.state == STATE_HALF_OPEN:
+            if self.probe_in_flight:
+                self.short_circuits += 1
+                raise ShortCircuit(self.host, self._config["open_seconds"], "half-open probe in flight")
+            self.probe_in_flight = True
+            self.in_flight += 1
+            return True
+
+        # 并发已满时短暂等待，超时则排期重试而不是继续堆积
+        async with self._slot_freed:
+            try:
+                await asyncio.wait_for(
+                    self._slot_freed.wait_for(lambda: self.in_flight < int(self.limit)),
+                    timeout=self._config["acquire_timeout"]
+                )
+            except asyncio.TimeoutError:
+                self.short_circuits += 1
+                raise ShortCircuit(self.host, self._config["acquire_timeout"], "concurrency limit reached")
+        self.in_flight += 1
+        return False
+
+    async def release(self, status_code: int, latency_ms: float, probe: bool):
+        self.in_flight -= 1
+        alpha = 0.2
+        self.latency_ewma_ms = latency_ms if self.latency_ewma_ms is None else (
+            alpha * latency_ms + (1 - alpha) * self.latency_ewma_ms
+        )
+
+        overloaded = status_code == 0 or status_code == 429 or status_code >= 500
+        slow = latency_ms > self._config["latency_threshold_ms"]
+        cfg = self._config
+
+        if overloaded:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.limit = max(cfg["min_limit"], self.limit * 0.5)
+            if probe or self.consecutive_failures >= cfg["failure_threshold"]:
+                self._open(double=probe)
+        else:
+            self.successes += 1
+            self.consecutive_failures = 0
+            if slow:
+                self.limit = max(cfg["min_limit"], self.limit * 0.5)
+            else:
+                self.limit = min(cfg["max_limit"], self.limit + 1.0 / max(self.limit, 1.0))
+            if probe or self.state != STATE_CLOSED:
+                logger.info(f"[DestHealth] {self.host} 探测成功，熔断关闭")
+                self.state = STATE_CLOSED
+                self.open_duration = cfg["open_seconds"]
+
+        if probe:
+            self.probe_in_flight = False
+        async with self._slot_freed:
+            self._slot_freed.notify_all()
+
+    def _open(self, double: bool):
+        if double:
+            self.open_duration = min(self.open_duration * 2, self._config["max_open_seconds"])
+        self.state = STATE_OPEN
+        self.open_until = time.monotonic() + self.open_duration
+        logger.warning(
+            f"[DestHealth] {self.host} 熔断 {self.open_duration:.0f} 秒"
+            f"（连续失败 {self.consecutive_failures} 次）"
+        )
+
+    def snapshot(self) -> dict:
+        remaining = max(0.0, self.open_until - time.monotonic()) if self.state == STATE_OPEN else 0.0
+        return {
+            "host": self.host,
+            "state": self.state,
+            "open_remaining_seconds": round(remaining, 1),
+            "consecutive_failures": self.consecutive_failures,
+            "concurrency_limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "latency_ewma_ms": round(self.latency_ewma_ms, 1) if self.latency_ewma_ms is not None else None,
+            "successes": self.successes,
+            "failures": self.failures,
+            "short_circuits": self.short_circuits,
+        }
+
+
+class DestinationHealth:
+    """所有目标主机的健康状态（每个进程一份）"""
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        open_seconds: float = 30.0,
+        max_open_seconds: float = 600.0,
+        initial_limit: int = 10,
+        min_limit: int = 1,
+        max_limit: int = 100,
+        latency_threshold_ms: float = 5000.0,
+        acquire_timeout: float = 5.0,
+    ):
+        self._config = {
+            "failure_threshold": failure_threshold,
+            "open_seconds": open_seconds,
+            "max_open_seconds": max_open_seconds,
+            "initial_limit": initial_limit,
+            "min_limit": min_limit,
+            "max_limit": max_limit,
+            "latency_threshold_ms": latency_threshold_ms,
+            "acquire_timeout": acquire_timeout,
+        }
+        self._hosts: Dict[str, HostHealth] = {}
+        self._publish_task: Optional[asyncio.Task] = None
+
+    def get(self, url: str) -> HostHealth:
+        host = destination_host(url)
+        health = self._hosts.get(host)
+        if health is None:
+            health = self._hosts[host] = HostHealth(host, self._config)
+        return health
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {host: h.snapshot() for host, h in self._hosts.items()}
+
+    # ======== 跨进程上报 ========
+
+    async def start_publishing(self, redis_conn, worker_id: str, interval: float = 5.0):
+        """定期把本进程的主机状态写入 Redis，供 API 进程汇总展示"""
+        async def _loop():
+            key = HEALTH_KEY_PREFIX + worker_id
+            while True:
+                try:
+                    if self._hosts:
+                        await redis_conn.set(key, json.dumps(self.snapshot()), ex=int(interval * 6))
+                except Exception as e:
+                    logger.warning(f"[DestHealth] 上报主机状态失败: {e}")
+                await asyncio.sleep(interval)
+
+        self._publish_task = asyncio.create_task(_loop())
+
+    async def stop_publishing(self):
+        if self._publish_task:
+            self._publish_task.cancel()
+            try:
+                await self._publish_task
+            except asyncio.CancelledError:
+                pass
+            self._publish_task = None
+
+
+async def collect_health(redis_conn) -> Dict[str, Dict[str, dict]]:
+    """汇总所有 worker 上报的主机状态: {worker_id: {host: 状态}}"""
+    result = {}
+    keys = [key async for key in redis_conn.scan_iter(match=HEALTH_KEY_PREFIX + "*", count=100)]
+    if not keys:
+        return result
+    values = await redis_conn.mget(keys)
+    for key, value in zip(keys, values):
+        if value is None:
+            continue
+        worker_id = (key.decode() if isinstance(key, bytes) else key)[len(HEALTH_KEY_PREFIX):]
+        result[worker_id] = json.loads(value)
+    return result
@@ -0,0 +1,99 @@
+"""
+Webhook 请求体流式读取
+按块读取请求体，边读边计算 SHA-256 并检查大小上限（超限尽早返回 413），
+超过阈值的请求体落盘到临时文件并以 mmap 只读映射，日志、路由和转发共用同一份缓冲区
+"""
+
+import hashlib
+import mmap
+import tempfile
+from typing import Union
+
+from fastapi import Request
+
+
+class BodyTooLarge(ValueError):
+    """请求体超过允许的最大字节数"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"Request body exceeds {limit} bytes")
+        self.limit = limit
+
+
+class IngestBody:
+    """已读取的请求体
+
+    data: 小请求体为 bytes，落盘的大请求体为只读 mmap（临时文件已删除，映射随对象释放）
+    """
+
+    __slots__ = ("data", "size", "sha256", "spooled")
+
+    def __init__(self, data: Union[bytes, mmap.mmap], size: int, sha256: str, spooled: bool):
+        self.data = data
+        self.size = size
+        self.sha256 = sha256
+        self.spooled = spooled
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __bool__(self) -> bool:
+        return self.size > 0
+
+    def view(self) -> memoryview:
+        """零拷贝视图，可直接交给 hashlib、压缩、Redis 和 aiohttp"""
+        return memoryview(self.data)
+
+    def head(self, n: int) -> bytes:
+        """前 n 个字节（只复制这一段）"""
+        return bytes(self.data[:n])
+
+
+async def read_body(
+    request: Request,
+    max_bytes: int,
+    spool_threshold: int
+) -> IngestBody:
+    """流式读取请求体
+
+    Content-Length 超限时不读取直接拒绝；未声明长度时读取过程中超限即中止
+    """
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise BodyTooLarge(max_bytes)
+
+    digest = hashlib.sha256()
+    size = 0
+    chunks = []
+    spool = None  # 超过阈值后创建的临时文件
+
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            size += len(chunk)
+            if size > max_bytes:
+                raise BodyTooLarge(max_bytes)
+            digest.update(chunk)
+            if spool is not None:
+                spool.write(chunk)
+                continue
+            chunks.append(chunk)
+            if size > spool_threshold:
+                # 超过阈值后转存到临时文件，内存中不再累积
+                spool = tempfile.TemporaryFile()
+                for buffered in chunks:
+                    spool.write(buffered)
+                chunks = []
+
+        if spool is None:
+            data = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+            return IngestBody(data, size, digest.hexdigest(), spooled=False)
+
+        spool.flush()
+        mapped = mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+        return IngestBody(mapped, size, digest.hexdigest(), spooled=True)
+    finally:
+        # mmap 在文件关闭后仍然有效
+        if spool is not None:
+            spool.close()
@@ -0,0 +1,192 @@
+"""
+日志配置 - 非阻塞结构化日志
+- 业务代码只把 LogRecord 放入内存队列（QueueHandler），格式化和写出在 QueueListener 线程中完成
+- 输出为单行 JSON（也可切换为文本），extra 字段原样输出
+- 按日志分类（logger 名称前缀）单独设置级别，运行时可调整
+- DEBUG 日志按分类采样（每 N 条保留 1 条），并限制每秒条数，避免排障时拖慢热路径
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# LogRecord 自带属性，其余属性视为 extra 字段
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """单行 JSON 日志"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """DEBUG 及以下级别的日志按分类采样和限速，更高级别不受影响"""
+
+    def __init__(self, sample_every: int = 1, max_per_second: int = 0):
+        super().__init__()
+        self.sample_every = sample_every
+        self.max_per_second = max_per_second  # 0 表示不限
+        self._counters: Dict[str, int] = {}
+        self._window = 0
+        self._window_count = 0
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        if self.sample_every > 1:
+            n = self._counters.get(record.name, 0)
+            self._counters[record.name] = n + 1
+            if n % self.sample_every:
+                self.dropped += 1
+                return False
+        if self.max_per_second:
+            window = int(time.monotonic())
+            if window != self._window:
+                self._window, self._window_count = window, 0
+            self._window_count += 1
+            if self._window_count > self.max_per_second:
+                self.dropped += 1
+                return False
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """只在调用线程合并消息参数，格式化留给监听线程；队列满时丢弃而不阻塞"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 参数可能是可变对象，入队前合并为最终消息；异常栈在监听线程中格式化
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LoggingManager:
+    """进程级日志配置"""
+
+    def __init__(self):
+        self._listener: Optional[logging.handlers.QueueListener] = None
+        self._handler: Optional[NonBlockingQueueHandler] = None
+        self._output: Optional[logging.Handler] = None
+        self._lock = threading.Lock()
+        self.sampler = DebugSampler()
+        self.json_format = True
+        atexit.register(self.shutdown)
+
+    def setup(
+        self,
+        level: str = "INFO",
+        json_format: bool = True,
+        categories: Optional[Dict[str, str]] = None,
+        queue_size: int = 10000,
+        sample_every: int = 1,
+        max_debug_per_second: int = 0,
+    ):
+        """替换根 logger 的处理器为队列处理器（可重复调用）"""
+        with self._lock:
+            self._stop_listener()
+            root = logging.getLogger()
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+
+            self._output = logging.StreamHandler(sys.stderr)
+            self._apply_format(json_format)
+            log_queue = queue.Queue(maxsize=queue_size)
+            self._handler = NonBlockingQueueHandler(log_queue)
+            self._handler.addFilter(self.sampler)
+            root.addHandler(self._handler)
+            root.setLevel(level.upper())
+
+            self.sampler.sample_every = sample_every
+            self.sampler.max_per_second = max_debug_per_second
+            for name, category_level in (categories or {}).items():
+                logging.getLogger(name).setLevel(category_level.upper())
+
+            self._listener = logging.handlers.QueueListener(log_queue, self._output, respect_handler_level=True)
+            self._listener.start()
+
+    def _apply_format(self, json_format: bool):
+        self.json_format = json_format
+        self._output.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+
+    def _stop_listener(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def shutdown(self):
+        """停止监听线程并写出队列中剩余的日志"""
+        with self._lock:
+            self._stop_listener()
+
+    # ======== 运行时调整 ========
+
+    def set_level(self, category: str, level: str):
+        """category 为 logger 名称（"root" 表示根 logger），level 为 DEBUG/INFO/WARNING/ERROR 或 NOTSET（继承上级）"""
+        level = level.upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level: {level}")
+        logging.getLogger(None if category == "root" else category).setLevel(level)
+
+    def set_sampling(self, sample_every: Optional[int] = None, max_debug_per_second: Optional[int] = None):
+        if sample_every is not None:
+            self.sampler.sample_every = max(1, sample_every)
+        if max_debug_per_second is not None:
+            self.sampler.max_per_second = max(0, max_debug_per_second)
+
+    def set_json_format(self, json_format: bool):
+        if self._output is not None:
+            self._apply_format(json_format)
+
+    def get_config(self) -> dict:
+        """当前各分类级别（只列出显式设置过级别的 logger）与采样配置"""
+        levels = {"root": logging.getLevelName(logging.getLogger().level)}
+        for name, item in sorted(logging.root.manager.loggerDict.items()):
+            if isinstance(item, logging.Logger) and item.level != logging.NOTSET:
+                levels[name] = logging.getLevelName(item.level)
+        return {
+            "levels": levels,
+            "json_format": self.json_format,
+            "sample_every": self.sampler.sample_every,
+            "max_debug_per_second": self.sampler.max_per_second,
+            "sampled_out": self.sampler.dropped,
+            "queue_size": self._handler.queue.qsize() if self._handler else 0,
+            "queue_dropped": self._handler.dropped if self._handler else 0,
+        }
+
+
+logging_manager = LoggingManager()
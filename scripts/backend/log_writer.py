@@ -0,0 +1,221 @@
+"""
+webhook_logs 批量异步写入
+请求线程只把日志行放入有界队列，后台写入任务按条数或时间阈值批量落库：
+优先使用 asyncpg COPY，失败时回退到多行 INSERT；
+同一批次内各租户的 request_count 增量合并为一条 UPDATE；
+行中附带的原始负载（payload）在同一事务内写入 webhook_payloads
+"""
+
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+from blob_store import write_payloads
+
+logger = logging.getLogger(__name__)
+
+# 写入列顺序（COPY 与 INSERT 共用）
+LOG_COLUMNS = (
+    "id", "tenant_id", "user_id", "source_ip", "method",
+    "path", "headers", "body", "retry_count", "created_at",
+    "delivery_status", "body_ref", "body_size",
+)
+
+# 持久化级别
+ACK_AFTER_FLUSH = "after_flush"    # 落库后再响应（默认，进程崩溃不丢日志）
+ACK_BEFORE_FLUSH = "before_flush"  # 入队即响应（延迟最低，崩溃时可能丢失最后一批）
+
+# 停止信号：写入任务处理完手头的批次后退出
+_STOP = object()
+
+
+class LogWriter:
+    """webhook_logs 批量写入器"""
+
+    def __init__(
+        self,
+        engine,
+        max_queue: int = 10_000,
+        batch_size: int = 500,
+        flush_interval: float = 0.2,
+        durability: str = ACK_AFTER_FLUSH,
+        max_flush_attempts: int = 3,
+    ):
+        if durability not in (ACK_AFTER_FLUSH, ACK_BEFORE_FLUSH):
+            raise ValueError(f"Unknown durability: {durability}")
+        self._engine = engine
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_flush_attempts = max_flush_attempts
+        self.durability = durability
+        self._task: Optional[asyncio.Task] = None
+        self._use_copy = True
+        # 指标
+        self.flushed_rows = 0
+        self.flush_count = 0
+        self.failed_flushes = 0
+        self.last_flush_latency_ms = 0.0
+        self.max_flush_latency_ms = 0.0
+        self._total_flush_latency_ms = 0.0
+
+    @property
+    def ack_after_flush(self) -> bool:
+        return self.durability == ACK_AFTER_FLUSH
+
+    async def write(self, row: dict) -> asyncio.Future:
+        """提交一条日志
+
+        队列满时等待（对接收端形成背压）；after_flush 模式下等到所在批次提交后才返回。
+        返回值为该行落库完成的 future，可供后续依赖该行的操作等待。
+        """
+        row.setdefault("retry_count", 0)
+        row.setdefault("created_at", datetime.utcnow())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future))
+        if self.ack_after_flush:
+            await asyncio.shield(future)
+        return future
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止写入任务并把队列中剩余的日志落库
+
+        不取消写入任务：已取出或正在写入的批次先落库，其 future 照常完成
+        """
+        if self._task:
+            if not self._task.done():
+                await self._queue.put(_STOP)
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while not self._queue.empty():
+            batch = []
+            while not self._queue.empty() and len(batch) < self._batch_size:
+                batch.append(self._queue.get_nowait())
+            await self._flush(batch)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self._flush_interval
+            while len(batch) < self._batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        rows = [row for row, _ in batch]
+        started = time.perf_counter()
+        error: Optional[BaseException] = None
+        for attempt in range(self._max_flush_attempts):
+            try:
+                await self._write_batch(rows)
+                error = None
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+                logger.warning(f"[LogWriter] 第 {attempt + 1} 次批量写入失败 ({len(rows)} 条): {e}")
+                await asyncio.sleep(0.1 * (2 ** attempt))
+
+        latency_ms = (time.perf_counter() - started) * 1000
+        self.flush_count += 1
+        self.last_flush_latency_ms = latency_ms
+        self.max_flush_latency_ms = max(self.max_flush_latency_ms, latency_ms)
+        self._total_flush_latency_ms += latency_ms
+
+        if error is not None:
+            self.failed_flushes += 1
+            logger.error(f"[LogWriter] 批量写入最终失败，丢弃 {len(rows)} 条日志: {error}")
+        else:
+            self.flushed_rows += len(rows)
+
+        for _, future in batch:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+                future.exception()  # 标记已读取，避免无人等待时告警
+
+    async def _write_batch(self, rows: List[dict]):
+        request_counts = Counter(row["tenant_id"] for row in rows)
+        async with self._engine.begin() as conn:
+            # 先写负载，日志行中的 body_ref 始终指向已存在的负载
+            await write_payloads(conn, [row["payload"] for row in rows if row.get("payload")])
+            if self._use_copy:
+                try:
+                    raw = await conn.get_raw_connection()
+                    await raw.driver_connection.copy_records_to_table(
+                        "webhook_logs",
+                        records=[tuple(row.get(c) for c in LOG_COLUMNS) for row in rows],
+                        columns=list(LOG_COLUMNS)
+                    )
+                except (AttributeError, NotImplementedError) as e:
+                    # 非 asyncpg 驱动，改用多行 INSERT
+                    logger.warning(f"[LogWriter] 当前驱动不支持 COPY，改用 INSERT: {e}")
+                    self._use_copy = False
+            if not self._use_copy:
+                await conn.execute(
+                    text(f"""
+                        INSERT INTO webhook_logs ({", ".join(LOG_COLUMNS)})
+                        VALUES ({", ".join(":" + c for c in LOG_COLUMNS)})
+                    """),
+                    [{c: row.get(c) for c in LOG_COLUMNS} for row in rows]
+                )
+
+            # 合并后的租户请求计数，整批一条 UPDATE（按 id 排序以避免并发更新死锁）
+            tenant_ids = sorted(request_counts)
+            await conn.execute(
+                text("""
+                    UPDATE tenants t
+                    SET request_count = COALESCE(t.request_count, 0) + v.n
+                    FROM unnest(CAST(:ids AS text[]), CAST(:counts AS int[])) AS v(id, n)
+                    WHERE t.id = v.id
+                """),
+                {"ids": tenant_ids, "counts": [request_counts[t] for t in tenant_ids]}
+            )
+
+    def get_stats(self) -> dict:
+        return {
+            "durability": self.durability,
+            "queue_depth": self._queue.qsize(),
+            "max_queue": self._queue.maxsize,
+            "batch_size": self._batch_size,
+            "flush_interval": self._flush_interval,
+            "use_copy": self._use_copy,
+            "flushed_rows": self.flushed_rows,
+            "flush_count": self.flush_count,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_latency_ms": round(self.last_flush_latency_ms, 2),
+            "avg_flush_latency_ms": round(self._total_flush_latency_ms / self.flush_count, 2) if self.flush_count else 0.0,
+            "max_flush_latency_ms": round(self.max_flush_latency_ms, 2),
+        }
@@ -0,0 +1,161 @@
+"""
+登录限流 - 在任何 bcrypt 计算之前按账号和来源 IP 拒绝过量的登录尝试
+- 来源 IP：ip_window 秒内的登录尝试次数（成功失败都计）超过 ip_limit 时拒绝
+- 账号：account_window 秒内的连续失败次数达到 account_limit 时拒绝，登录成功后清零
+- 有 Redis 时多进程共享计数（检查一次 Lua 调用）；无 Redis 或 Redis 出错时使用进程内计数
+"""
+
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+IP_KEY_PREFIX = "login:ip:"
+ACCOUNT_KEY_PREFIX = "login:fail:"
+
+# 计入一次尝试并检查两个计数，返回需要等待的秒数（0 表示放行）
+# KEYS: IP 计数, 账号失败计数; ARGV: ip_window, ip_limit, account_limit
+CHECK_SCRIPT = """
+local attempts = redis.call('INCR', KEYS[1])
+if attempts == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+if attempts > tonumber(ARGV[2]) then
+    return math.max(redis.call('TTL', KEYS[1]), 1)
+end
+local failures = tonumber(redis.call('GET', KEYS[2]) or '0')
+if failures >= tonumber(ARGV[3]) then
+    return math.max(redis.call('TTL', KEYS[2]), 1)
+end
+return 0
+"""
+
+
+def account_key(account: str) -> str:
+    # 登录名不以明文写入 Redis
+    return ACCOUNT_KEY_PREFIX + hashlib.sha256(account.strip().lower().encode("utf-8")).hexdigest()[:32]
+
+
+class LoginThrottle:
+    """按账号和来源 IP 的登录限流"""
+
+    def __init__(
+        self,
+        account_limit: int = 10,
+        account_window: int = 900,
+        ip_limit: int = 30,
+        ip_window: int = 300,
+        local_max_keys: int = 100_000,
+    ):
+        self._account_limit = account_limit
+        self._account_window = account_window
+        self._ip_limit = ip_limit
+        self._ip_window = ip_window
+        self._local_max_keys = local_max_keys
+        self._redis = None
+        self._script = None
+        # key -> [计数, 过期时间]
+        self._local: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.checked = 0
+        self.throttled = 0
+        self.failures = 0
+        self.redis_errors = 0
+
+    def start(self, redis_conn):
+        self._redis = redis_conn
+        if redis_conn is not None:
+            self._script = redis_conn.register_script(CHECK_SCRIPT)
+
+    async def check(self, account: str, ip: str) -> float:
+        """计入一次登录尝试，返回需要等待的秒数（0 表示放行）"""
+        self.checked += 1
+        retry_after = None
+        if self._redis is not None:
+            try:
+                retry_after = float(await self._script(
+                    keys=[IP_KEY_PREFIX + ip, account_key(account)],
+                    args=[self._ip_window, self._ip_limit, self._account_limit]
+                ))
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning("[LoginThrottle] Redis 限流检查失败，使用本地计数: %s", e)
+        if retry_after is None:
+            retry_after = self._local_check(account, ip)
+        if retry_after > 0:
+            self.throttled += 1
+        return retry_after
+
+    async def record_failure(self, account: str):
+        self.failures += 1
+        key = account_key(account)
+        if self._redis is not None:
+            try:
+                # 每次失败都顺延窗口，持续尝试的账号保持锁定
+                pipe = self._redis.pipeline(transaction=False)
+                pipe.incr(key)
+                pipe.expire(key, self._account_window)
+                await pipe.execute()
+                return
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning("[LoginThrottle] Redis 记录登录失败出错，使用本地计数: %s", e)
+        self._local_incr(key, self._account_window, extend=True)
+
+    async def reset(self, account: str):
+        """登录成功，清零账号失败计数"""
+        key = account_key(account)
+        self._local.pop(key, None)
+        if self._redis is not None:
+            try:
+                await self._redis.delete(key)
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning("[LoginThrottle] 清零登录失败计数出错: %s", e)
+
+    # ======== 进程内计数 ========
+
+    def _local_get(self, key: str, now: float) -> Optional[List[float]]:
+        entry = self._local.get(key)
+        if entry is not None and entry[1] <= now:
+            del self._local[key]
+            return None
+        return entry
+
+    def _local_incr(self, key: str, window: int, extend: bool = False) -> List[float]:
+        now = time.monotonic()
+        entry = self._local_get(key, now)
+        if entry is None:
+            entry = self._local[key] = [0, now + window]
+            while len(self._local) > self._local_max_keys:
+                self._local.popitem(last=False)
+        else:
+            self._local.move_to_end(key)
+        entry[0] += 1
+        if extend:
+            entry[1] = now + window
+        return entry
+
+    def _local_check(self, account: str, ip: str) -> float:
+        now = time.monotonic()
+        attempts = self._local_incr(IP_KEY_PREFIX + ip, self._ip_window)
+        if attempts[0] > self._ip_limit:
+            return max(attempts[1] - now, 1.0)
+        failures = self._local_get(account_key(account), now)
+        if failures is not None and failures[0] >= self._account_limit:
+            return max(failures[1] - now, 1.0)
+        return 0.0
+
+    def get_stats(self) -> dict:
+        return {
+            "backend": "redis" if self._redis is not None else "local",
+            "account_limit": self._account_limit,
+            "ip_limit": self._ip_limit,
+            "local_keys": len(self._local),
+            "checked": self.checked,
+            "throttled": self.throttled,
+            "failures": self.failures,
+            "redis_errors": self.redis_errors,
+        }
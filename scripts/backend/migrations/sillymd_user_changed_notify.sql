@@ -0,0 +1,24 @@
+-- sillymd 用户库：用户资料变更通知（webhook_hub 登录身份缓存 principal_cache 监听 user_changed 频道）
+-- 只关注影响登录身份的列；需由 sillymd 数据库管理员手动执行一次：
+--   psql "$SILLYMD_DATABASE_URL" -f sillymd_user_changed_notify.sql
+-- 未执行时 webhook_hub 仍可运行，身份缓存仅依赖 TTL 失效
+
+CREATE OR REPLACE FUNCTION webhook_hub_notify_user_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('user_changed', OLD.id::text);
+    ELSE
+        PERFORM pg_notify('user_changed', NEW.id::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'webhook_hub_user_changed') THEN
+        CREATE TRIGGER webhook_hub_user_changed
+        AFTER UPDATE OF email, username, vendor_level, is_active OR DELETE ON users
+        FOR EACH ROW EXECUTE PROCEDURE webhook_hub_notify_user_changed();
+    END IF;
+END $$;
@@ -0,0 +1,89 @@
+"""
+企业微信回调去重 - 按 (corp_id, MsgId) 记录已接收的消息
+企业微信 5 秒内未收到应答会重试同一条回调，重试请求在这里以 O(1) 判定并直接应答
+- 有 Redis 时使用 SET NX EX，所有 worker 共享
+- 无 Redis 或 Redis 出错时使用进程内带过期的 LRU
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DEDUP_KEY_PREFIX = "wechat:msg:"
+
+
+def message_key(fields: dict) -> Optional[str]:
+    """消息唯一标识：普通消息用 MsgId，事件消息没有 MsgId，用 FromUserName + CreateTime"""
+    msg_id = fields.get("MsgId")
+    if msg_id:
+        return msg_id
+    from_user, create_time = fields.get("FromUserName"), fields.get("CreateTime")
+    if from_user and create_time:
+        return f"{from_user}:{create_time}"
+    return None
+
+
+class MessageDedup:
+    """已接收消息索引"""
+
+    def __init__(self, ttl: int = 600, local_max_size: int = 100_000):
+        self._redis = None
+        self._ttl = ttl
+        self._local_max_size = local_max_size
+        self._local: "OrderedDict[str, float]" = OrderedDict()
+        self.checked = 0
+        self.duplicates = 0
+        self.redis_errors = 0
+
+    def start(self, redis_conn):
+        self._redis = redis_conn
+
+    async def first_seen(self, corp_id: str, msg_key: str) -> bool:
+        """记录消息，首次出现返回 True，重复返回 False"""
+        self.checked += 1
+        key = f"{DEDUP_KEY_PREFIX}{corp_id}:{msg_key}"
+        if self._redis is not None:
+            try:
+                created = await self._redis.set(key, b"1", nx=True, ex=self._ttl)
+                if not created:
+                    self.duplicates += 1
+                return bool(created)
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning(f"[MsgDedup] Redis 去重失败，使用本地索引: {e}")
+        return self._local_first_seen(key)
+
+    def _local_first_seen(self, key: str) -> bool:
+        now = time.monotonic()
+        expires_at = self._local.get(key)
+        if expires_at is not None and expires_at > now:
+            self.duplicates += 1
+            return False
+        self._local[key] = now + self._ttl
+        self._local.move_to_end(key)
+        # 过期条目总在最旧的一端（TTL 相同），超出容量时也从这一端淘汰
+        while self._local and (len(self._local) > self._local_max_size or next(iter(self._local.values())) <= now):
+            self._local.popitem(last=False)
+        return True
+
+    async def forget(self, corp_id: str, msg_key: str):
+        """处理失败时撤销记录，让企业微信的重试能够重新处理"""
+        key = f"{DEDUP_KEY_PREFIX}{corp_id}:{msg_key}"
+        self._local.pop(key, None)
+        if self._redis is not None:
+            try:
+                await self._redis.delete(key)
+            except Exception as e:
+                logger.warning(f"[MsgDedup] 撤销去重记录失败: {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            "backend": "redis" if self._redis is not None else "local",
+            "local_size": len(self._local),
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "redis_errors": self.redis_errors,
+        }
@@ -0,0 +1,518 @@
+"""
+OpenClaw 设备跨 worker 归属 - 每个设备只由一个 worker 建立上游 WebSocket 连接
+- 设备目录：Redis 集合保存所有启用设备的 ID（tenant_id:device_id），配置在建立连接时从数据库读取
+- worker 通过心跳登记存活（有序集合，分值为过期时间），按最高随机权重（rendezvous hash）把设备均匀分配给存活 worker，
+  worker 增减时只有少量设备迁移
+- 建立连接前必须持有设备租约（SET NX PX），持有者按心跳续约；续约失败或设备改分配给其他 worker 时断开并释放租约，
+  worker 异常退出后租约过期，设备由其他 worker 接管
+- 设备增删通过 pub/sub 通知所有 worker 立即重新分配
+- 无 Redis 时退化为单进程：设备直接在本进程连接
+- 设备连接限制并发并加随机抖动，未连上的按指数退避重试，避免启动或接管时同时冲击上游 ws_url；
+  启动时从 openclaw_devices 分页加载启用的设备（warm_start）
+- 持有者定期把设备连接状态写入按租户、按用户索引的 Redis 哈希，任一 worker 一次读取即可返回状态
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+DEVICES_KEY = "openclaw:devices"
+WORKERS_KEY = "openclaw:workers"
+LEASE_KEY_PREFIX = "openclaw:lease:"
+CHANGED_CHANNEL = "openclaw:changed"
+# 设备状态哈希：字段为 tenant_id:device_id，值为状态 JSON
+STATUS_TENANT_KEY_PREFIX = "openclaw:status:tenant:"
+STATUS_USER_KEY_PREFIX = "openclaw:status:user:"
+
+# 仅当租约仍属于本 worker 时续约 / 释放
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class OpenClawSpec(NamedTuple):
+    """建立设备连接所需的配置（对应 OpenClawService.add_device_with_forwarding 参数）"""
+    device_id: str          # tenant_id:device_id
+    name: str
+    api_key: str
+    ws_url: str
+    tenant_id: str
+    user_id: int
+    webhook_url: Optional[str]
+
+
+def rendezvous_owner(device_id: str, workers: Iterable[str]) -> Optional[str]:
+    """最高随机权重分配：每个 (worker, 设备) 组合一个伪随机权重，权重最高的 worker 持有设备"""
+    best, best_score = None, -1
+    for worker_id in workers:
+        score = int.from_bytes(
+            hashlib.blake2b(f"{worker_id}|{device_id}".encode(), digest_size=8).digest(), "big"
+        )
+        if score > best_score:
+            best, best_score = worker_id, score
+    return best
+
+
+class OpenClawCoordinator:
+    """OpenClaw 设备归属协调"""
+
+    def __init__(
+        self,
+        service,
+        worker_id: str,
+        loader: Callable[[str], Awaitable[Optional[OpenClawSpec]]],
+        lease_ttl: float = 30.0,
+        heartbeat_interval: float = 10.0,
+        connect_concurrency: int = 10,
+        connect_jitter: float = 1.0,
+        connect_timeout: float = 15.0,
+        backoff_base: float = 2.0,
+        backoff_max: float = 120.0,
+        max_attempts: int = 5,
+        status_interval: float = 5.0,
+    ):
+        self._service = service
+        self.worker_id = worker_id
+        self._loader = loader
+        self._lease_ttl_ms = int(lease_ttl * 1000)
+        self._lease_ttl = lease_ttl
+        self._heartbeat_interval = heartbeat_interval
+        self._redis = None
+        self._renew_script = None
+        self._release_script = None
+        self._owned: Set[str] = set()
+        # device_id -> 本地估计的租约到期时间（monotonic，以发出请求前的时刻计，不晚于 Redis 中的实际到期）
+        self._lease_expires: Dict[str, float] = {}
+        # 到期前预留的余量：续约持续失败时提前断开，避免与接管的 worker 同时连接
+        self._lease_margin = max(1.0, lease_ttl * 0.2)
+        self._workers: List[str] = []
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._connect_slots = asyncio.Semaphore(connect_concurrency)
+        self._connect_jitter = connect_jitter
+        self._connect_timeout = connect_timeout
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._max_attempts = max_attempts
+        self._connecting: Dict[str, asyncio.Task] = {}
+        self._specs: Dict[str, OpenClawSpec] = {}
+        self._status_interval = status_interval
+        # 超过该时间未更新的状态视为持有者已失联
+        self._status_stale_after = max(3 * status_interval, lease_ttl)
+        self.connected = 0
+        self.failed = 0
+        self.warmup_state = "idle"
+        self.warmup_loaded = 0
+        self.acquired = 0
+        self.released = 0
+        self.lost = 0
+        self.rebalances = 0
+        self.errors = 0
+
+    @property
+    def owned(self) -> Set[str]:
+        return self._owned
+
+    async def start(self, redis_conn):
+        self._redis = redis_conn
+        if redis_conn is None:
+            return
+        self._renew_script = redis_conn.register_script(RENEW_SCRIPT)
+        self._release_script = redis_conn.register_script(RELEASE_SCRIPT)
+        self._tasks = [
+            asyncio.create_task(self._run()),
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._publish_status_loop()),
+            asyncio.create_task(self._lease_watchdog()),
+        ]
+
+    async def stop(self):
+        for task in self._tasks + list(self._connecting.values()):
+            task.cancel()
+        for task in self._tasks + list(self._connecting.values()):
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        # 主动释放，其他 worker 在下次重新分配时接管
+        for device_id in list(self._owned):
+            await self._release(device_id)
+        if self._redis is not None:
+            try:
+                await self._redis.zrem(WORKERS_KEY, self.worker_id)
+                await self._redis.publish(CHANGED_CHANNEL, self.worker_id)
+            except Exception as e:
+                logger.warning("[OpenClawLease] 注销 worker 失败: %s", e)
+
+    # ======== 设备增删 ========
+
+    async def add(self, spec: OpenClawSpec):
+        """登记设备；由分配到的 worker 建立连接"""
+        if self._redis is None:
+            self._release_local(spec.device_id)
+            self._owned.add(spec.device_id)
+            self._schedule_connect(spec.device_id, spec)
+            return
+        await self._redis.sadd(DEVICES_KEY, spec.device_id)
+        # 配置可能已变更：当前持有者断开，下一轮重新加载配置后连接
+        await self._redis.publish(CHANGED_CHANNEL, spec.device_id)
+
+    async def remove(self, device_id: str):
+        if self._redis is None:
+            self._release_local(device_id)
+            return
+        await self._redis.srem(DEVICES_KEY, device_id)
+        await self._redis.publish(CHANGED_CHANNEL, device_id)
+
+    # ======== 启动加载 ========
+
+    def start_warm_start(self, pages: AsyncIterator[List[OpenClawSpec]]):
+        """后台分页加载启用的设备：有 Redis 时写入设备目录（由分配到的 worker 连接），否则在本进程连接"""
+        self._tasks.append(asyncio.create_task(self._warm_start(pages)))
+
+    async def _warm_start(self, pages: AsyncIterator[List[OpenClawSpec]]):
+        self.warmup_state = "loading"
+        try:
+            async for page in pages:
+                self.warmup_loaded += len(page)
+                if self._redis is not None:
+                    await self._redis.sadd(DEVICES_KEY, *(spec.device_id for spec in page))
+                    self._wakeup.set()
+                else:
+                    for spec in page:
+                        if spec.device_id not in self._owned:
+                            self._owned.add(spec.device_id)
+                            self._schedule_connect(spec.device_id, spec)
+                logger.info("[OpenClawLease] 启动加载进度: %s", self.progress())
+            self.warmup_state = "loaded"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.warmup_state = "error"
+            logger.error("[OpenClawLease] 启动加载设备失败: %s", e)
+
+    def progress(self) -> dict:
+        return {
+            "state": self.warmup_state,
+            "loaded": self.warmup_loaded,
+            "connected": self.connected,
+            "pending": len(self._connecting),
+            "failed": self.failed,
+        }
+
+    # ======== 分配 ========
+
+    async def _run(self):
+        while True:
+            try:
+                await self.rebalance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.warning("[OpenClawLease] 重新分配失败: %s", e)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._heartbeat_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _listen(self):
+        """设备增删 / worker 退出通知：配置变更的设备先断开再按新配置连接"""
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(CHANGED_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    device_id = message["data"]
+                    if isinstance(device_id, bytes):
+                        device_id = device_id.decode()
+                    if device_id in self._owned:
+                        await self._release(device_id)
+                    self._wakeup.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("[OpenClawLease] 变更通知订阅中断，5秒后重连: %s", e)
+                await asyncio.sleep(5)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    async def _heartbeat(self) -> List[str]:
+        """登记本 worker 存活并返回所有存活 worker"""
+        now = time.time()
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.zadd(WORKERS_KEY, {self.worker_id: now + self._lease_ttl})
+        pipe.zremrangebyscore(WORKERS_KEY, "-inf", now)
+        pipe.zrangebyscore(WORKERS_KEY, now, "+inf")
+        pipe.smembers(DEVICES_KEY)
+        _, _, workers, devices = await pipe.execute()
+        self._workers = sorted(w.decode() if isinstance(w, bytes) else w for w in workers)
+        return [d.decode() if isinstance(d, bytes) else d for d in devices]
+
+    async def rebalance(self):
+        """续约持有的租约，释放不再分配给本 worker 的设备，争取新分配的设备"""
+        self.rebalances += 1
+        devices = await self._heartbeat()
+        catalog = set(devices)
+
+        # 续约（一次 pipeline）
+        owned = sorted(self._owned)
+        if owned:
+            started = time.monotonic()
+            pipe = self._redis.pipeline(transaction=False)
+            for device_id in owned:
+                self._renew_script(keys=[LEASE_KEY_PREFIX + device_id], args=[self.worker_id, self._lease_ttl_ms],
+                                   client=pipe)
+            renewed = await pipe.execute()
+            for device_id, ok in zip(owned, renewed):
+                if not ok:
+                    self.lost += 1
+                    logger.warning("[OpenClawLease] 设备租约已失效，断开: %s", device_id)
+                    self._release_local(device_id)
+                elif device_id in self._lease_expires:
+                    self._lease_expires[device_id] = started + self._lease_ttl
+
+        for device_id in list(self._owned):
+            if device_id not in catalog or rendezvous_owner(device_id, self._workers) != self.worker_id:
+                await self._release(device_id)
+
+        for device_id in devices:
+            if device_id in self._owned or rendezvous_owner(device_id, self._workers) != self.worker_id:
+                continue
+            await self._acquire(device_id)
+
+    async def _acquire(self, device_id: str) -> bool:
+        """取得租约后排队连接（配置在连接时加载）"""
+        started = time.monotonic()
+        locked = await self._redis.set(
+            LEASE_KEY_PREFIX + device_id, self.worker_id, nx=True, px=self._lease_ttl_ms
+        )
+        if not locked:
+            # 上一个持有者尚未释放或租约未过期，下一轮再试
+            return False
+        self._owned.add(device_id)
+        self._lease_expires[device_id] = started + self._lease_ttl
+        self.acquired += 1
+        self._schedule_connect(device_id)
+        return True
+
+    async def _lease_watchdog(self):
+        """续约失败（Redis 超时、网络分区）时，在租约到期前断开本地连接
+
+        rebalance 出错或阻塞都不影响本检查；租约到期后其他 worker 可能已接管该设备
+        """
+        while True:
+            now = time.monotonic()
+            next_check = now + self._heartbeat_interval
+            for device_id, expires in list(self._lease_expires.items()):
+                deadline = expires - self._lease_margin
+                if deadline <= now:
+                    self.lost += 1
+                    logger.warning("[OpenClawLease] 设备租约未能续期，到期前断开: %s", device_id)
+                    self._release_local(device_id)
+                else:
+                    next_check = min(next_check, deadline)
+            await asyncio.sleep(max(0.1, next_check - now))
+
+    async def _release(self, device_id: str):
+        self._release_local(device_id)
+        self.released += 1
+        if self._redis is not None:
+            await self._release_lease(device_id)
+
+    def _release_local(self, device_id: str):
+        self._lease_expires.pop(device_id, None)
+        task = self._connecting.pop(device_id, None)
+        if task is not None:
+            task.cancel()
+        if device_id in self._owned:
+            self._owned.discard(device_id)
+            self._disconnect(device_id)
+        spec = self._specs.pop(device_id, None)
+        if spec is not None and self._redis is not None:
+            self._forget_status(spec)
+
+    async def _release_lease(self, device_id: str):
+        try:
+            await self._release_script(keys=[LEASE_KEY_PREFIX + device_id], args=[self.worker_id])
+        except Exception as e:
+            logger.warning("[OpenClawLease] 释放租约失败，等待过期: %s", e)
+
+    # ======== 本地连接 ========
+
+    def _schedule_connect(self, device_id: str, spec: Optional[OpenClawSpec] = None):
+        if device_id in self._connecting:
+            return
+        task = asyncio.create_task(self._connect_with_retry(device_id, spec))
+        self._connecting[device_id] = task
+        task.add_done_callback(lambda t, d=device_id: self._connect_done(d, t))
+
+    def _connect_done(self, device_id: str, task: asyncio.Task):
+        if self._connecting.get(device_id) is task:
+            del self._connecting[device_id]
+        if self.warmup_state == "loaded" and not self._connecting:
+            self.warmup_state = "done"
+            logger.info("[OpenClawLease] 启动加载完成: %s", self.progress())
+
+    async def _connect_with_retry(self, device_id: str, spec: Optional[OpenClawSpec]):
+        """限并发连接：加抖动后连接并等待连上，失败按指数退避重试；最后一次不再断开，交由服务自行重连"""
+        for attempt in range(self._max_attempts):
+            async with self._connect_slots:
+                await asyncio.sleep(random.uniform(0, self._connect_jitter))
+                if spec is None:
+                    spec = await self._loader(device_id)
+                    if spec is None:
+                        # 数据库中已删除或停用：一并清理本地状态（含租约期限），但不取消当前任务自身
+                        if self._connecting.get(device_id) is asyncio.current_task():
+                            del self._connecting[device_id]
+                        self._release_local(device_id)
+                        if self._redis is not None:
+                            await self._release_lease(device_id)
+                            await self._redis.srem(DEVICES_KEY, device_id)
+                        return
+                self._connect(spec)
+                if await self._wait_connected(device_id):
+                    self.connected += 1
+                    return
+            if attempt == self._max_attempts - 1:
+                break
+            self._disconnect(device_id)
+            delay = min(self._backoff_max, self._backoff_base * (2 ** attempt))
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+        self.failed += 1
+        logger.warning("[OpenClawLease] 设备连接失败（已重试 %d 次）: %s", self._max_attempts, device_id)
+
+    async def _wait_connected(self, device_id: str) -> bool:
+        deadline = time.monotonic() + self._connect_timeout
+        while True:
+            status = self._service.manager.get_device_status(device_id) or {}
+            if status.get("connected"):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.25)
+
+    def _connect(self, spec: OpenClawSpec):
+        self._specs[spec.device_id] = spec
+        self._service.add_device_with_forwarding(
+            device_id=spec.device_id,
+            name=spec.name,
+            api_key=spec.api_key,
+            ws_url=spec.ws_url,
+            tenant_id=spec.tenant_id,
+            user_id=spec.user_id,
+            webhook_url=spec.webhook_url
+        )
+        logger.info("[OpenClawLease] 设备已在本 worker 连接: %s", spec.device_id)
+
+    def _disconnect(self, device_id: str):
+        try:
+            self._service.remove_device(device_id)
+        except Exception as e:
+            logger.warning("[OpenClawLease] 断开设备失败: %s, %s", device_id, e)
+
+    # ======== 设备状态 ========
+
+    def _local_status(self, spec: OpenClawSpec) -> dict:
+        status = dict(self._service.manager.get_device_status(spec.device_id) or {"connected": False})
+        status.update(tenant_id=spec.tenant_id, user_id=spec.user_id, owner=self.worker_id, updated_at=time.time())
+        return status
+
+    async def _publish_status_loop(self):
+        while True:
+            await asyncio.sleep(self._status_interval)
+            try:
+                await self.publish_status()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("[OpenClawLease] 写入设备状态失败: %s", e)
+
+    async def publish_status(self):
+        """把本 worker 持有设备的状态写入租户 / 用户两个索引（一次 pipeline）"""
+        specs = [self._specs[d] for d in self._owned if d in self._specs]
+        if not specs:
+            return
+        ttl = int(self._status_stale_after * 2)
+        keys = set()
+        pipe = self._redis.pipeline(transaction=False)
+        for spec in specs:
+            value = json.dumps(self._local_status(spec), default=str)
+            for key in (STATUS_TENANT_KEY_PREFIX + spec.tenant_id, f"{STATUS_USER_KEY_PREFIX}{spec.user_id}"):
+                pipe.hset(key, spec.device_id, value)
+                keys.add(key)
+        for key in keys:
+            pipe.expire(key, ttl)
+        await pipe.execute()
+
+    def _forget_status(self, spec: OpenClawSpec):
+        async def forget():
+            try:
+                pipe = self._redis.pipeline(transaction=False)
+                pipe.hdel(STATUS_TENANT_KEY_PREFIX + spec.tenant_id, spec.device_id)
+                pipe.hdel(f"{STATUS_USER_KEY_PREFIX}{spec.user_id}", spec.device_id)
+                await pipe.execute()
+            except Exception as e:
+                logger.warning("[OpenClawLease] 删除设备状态失败: %s", e)
+        asyncio.create_task(forget())
+
+    async def tenant_status(self, tenant_id: str) -> Dict[str, dict]:
+        """租户所有设备的状态：tenant_id:device_id -> 状态"""
+        if self._redis is None:
+            return {d: self._local_status(s) for d, s in self._specs.items() if s.tenant_id == tenant_id}
+        return self._decode_status(await self._redis.hgetall(STATUS_TENANT_KEY_PREFIX + tenant_id))
+
+    async def user_status(self, user_id) -> Dict[str, dict]:
+        """用户所有设备的状态：tenant_id:device_id -> 状态"""
+        if self._redis is None:
+            return {d: self._local_status(s) for d, s in self._specs.items() if s.user_id == user_id}
+        return self._decode_status(await self._redis.hgetall(f"{STATUS_USER_KEY_PREFIX}{user_id}"))
+
+    def _decode_status(self, raw: dict) -> Dict[str, dict]:
+        now = time.time()
+        result = {}
+        for device_id, value in raw.items():
+            if isinstance(device_id, bytes):
+                device_id = device_id.decode()
+            status = json.loads(value)
+            if now - status.get("updated_at", 0) > self._status_stale_after:
+                status["connected"] = False
+                status["stale"] = True
+            result[device_id] = status
+        return result
+
+    def get_stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "backend": "redis" if self._redis is not None else "local",
+            "workers": len(self._workers),
+            "owned": len(self._owned),
+            "acquired": self.acquired,
+            "released": self.released,
+            "lost": self.lost,
+            "rebalances": self.rebalances,
+            "errors": self.errors,
+            "warmup": self.progress(),
+        }
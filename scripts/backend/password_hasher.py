@@ -0,0 +1,103 @@
+"""
+密码哈希 - bcrypt 计算放到独立线程池，不阻塞事件循环
+- bcrypt 计算期间释放 GIL，线程池即可并行，无需进程池
+- 排队中的任务数有上限，超出时立即拒绝（HasherBusy），避免登录突发拖垮同进程的接收链路
+- cost 可配置；登录成功时若哈希的 cost 与配置不同（或为旧系统明文），由调用方重新哈希
+"""
+
+import asyncio
+import hmac
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+
+class HasherBusy(Exception):
+    """密码哈希排队已满"""
+
+
+def _truncate(password: str) -> bytes:
+    # bcrypt 限制 72 字节，截断密码
+    return password[:72].encode("utf-8")
+
+
+def _check(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return bcrypt.checkpw(_truncate(plain_password), hashed_password.encode("utf-8"))
+    except Exception:
+        return False
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(_truncate(password), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def hash_rounds(hashed_password: str) -> Optional[int]:
+    """bcrypt 哈希（$2b$12$...）中的 cost，非 bcrypt 哈希返回 None"""
+    parts = hashed_password.split("$")
+    if len(parts) < 4 or not parts[1].startswith("2"):
+        return None
+    try:
+        return int(parts[2])
+    except ValueError:
+        return None
+
+
+class PasswordHasher:
+    """bcrypt 线程池"""
+
+    def __init__(self, rounds: int = 12, workers: int = 2, max_pending: int = 32):
+        if not 4 <= rounds <= 31:
+            raise ValueError(f"bcrypt rounds 超出范围 4-31: {rounds}")
+        self.rounds = rounds
+        self._workers = workers
+        self._max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+        self.verified = 0
+        self.hashed = 0
+        self.rejected = 0
+
+    async def _run(self, fn: Callable, *args):
+        if self._pending >= self._max_pending:
+            self.rejected += 1
+            raise HasherBusy()
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """验证密码 - 支持 bcrypt 和明文（兼容旧系统）"""
+        if hashed_password.startswith("$2"):
+            self.verified += 1
+            return await self._run(_check, plain_password, hashed_password)
+        # 兼容旧系统的明文密码（登录成功后会被重新哈希）
+        return hmac.compare_digest(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+    async def hash(self, password: str) -> str:
+        """按配置的 cost 生成密码哈希"""
+        self.hashed += 1
+        return await self._run(_hash, password, self.rounds)
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        return hash_rounds(hashed_password) != self.rounds
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def get_stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "workers": self._workers,
+            "max_pending": self._max_pending,
+            "pending": self._pending,
+            "verified": self.verified,
+            "hashed": self.hashed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,193 @@
+"""
+Webhook 请求信封 - 每个请求的头部/请求体只解码、解析一次
+- JSON 后端优先使用 orjson，其次 msgspec，都未安装时使用标准库 json
+- 路由字段（如 target_device）通过浅扫描顶层对象提取，不构建整个文档
+- 超过阈值的请求体在线程池中解析/扫描，避免占用事件循环
+"""
+
+import asyncio
+import json
+import re
+from typing import Dict, Iterable, Optional
+
+from ingest_body import IngestBody
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "msgspec" if msgspec is not None else "json"
+
+# 转发/记录时去掉的敏感请求头
+SENSITIVE_HEADERS = frozenset(("authorization", "cookie"))
+
+# 超过该大小的请求体在线程池中解析
+PARSE_OFFLOAD_THRESHOLD = 256 * 1024
+# 不超过该大小的请求体直接完整解析（比浅扫描更快），更大的只做浅扫描
+SHALLOW_SCAN_THRESHOLD = 64 * 1024
+# 预览文本长度（字符）；按 UTF-8 最多 4 字节/字符截取字节
+PREVIEW_CHARS = 10000
+
+if orjson is None and msgspec is not None:
+    _msgspec_decoder = msgspec.json.Decoder()
+    _msgspec_encoder = msgspec.json.Encoder()
+
+
+def loads(data):
+    """解析 JSON，接受 str / bytes / memoryview；解析失败统一抛出 ValueError"""
+    if orjson is not None:
+        return orjson.loads(data)
+    if msgspec is not None:
+        try:
+            return _msgspec_decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+    if not isinstance(data, (str, bytes, bytearray)):
+        data = bytes(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    if msgspec is not None:
+        return _msgspec_encoder.encode(obj).decode()
+    return json.dumps(obj)
+
+
+# 顶层扫描只关心字符串和结构字符，数字/字面量夹在其间被跳过
+_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]:,]')
+
+
+def scan_top_level(buf, keys: Iterable[str]) -> Dict[str, object]:
+    """浅扫描 JSON 顶层对象，只解析 keys 中字段的值
+
+    嵌套对象/数组和长字符串由正则整体跳过，不构建对象；
+    重复字段取首次出现的值；不是 JSON 对象或值非法时对应字段不返回；
+    文档中根本没有出现的字段名先按字节查找排除（C 速度），全部不出现时不做扫描
+    """
+    found: Dict[str, object] = {}
+    wanted = {k for k in keys if re.search(re.escape(dumps(k).encode()), buf)}
+    if not wanted:
+        return found
+    depth = 0
+    key = None          # 当前顶层字段名
+    value_start = None  # 需要提取的值在 buf 中的起始位置
+
+    for m in _TOKEN.finditer(buf):
+        tok = buf[m.start():m.start() + 1]
+        if depth == 0:
+            if tok != b"{":
+                return found
+            depth = 1
+            continue
+
+        if tok == b'"':
+            if depth == 1 and key is None:
+                try:
+                    key = loads(buf[m.start():m.end()])
+                except ValueError:
+                    return found
+            continue
+        if tok in (b"{", b"["):
+            depth += 1
+            continue
+        if depth > 1:
+            if tok in (b"}", b"]"):
+                depth -= 1
+            continue
+
+        # 以下为顶层的 : , }
+        if tok == b":":
+            value_start = m.end() if key in wanted else None
+            continue
+        if value_start is not None:
+            try:
+                found[key] = loads(buf[value_start:m.start()])
+            except ValueError:
+                pass
+            wanted.discard(key)
+            value_start = None
+            if not wanted:
+                return found
+        if tok == b"}":
+            return found
+        key = None
+    return found
+
+
+class WebhookEnvelope:
+    """单个 Webhook 请求的信封
+
+    headers / headers_json / preview 首次访问时计算并缓存；
+    请求体 JSON 最多完整解析一次，路由字段优先使用浅扫描
+    """
+
+    __slots__ = ("body", "raw_headers", "_headers", "_headers_json", "_preview", "_json", "_parsed", "_routing")
+
+    def __init__(self, body: IngestBody, raw_headers: Dict[str, str]):
+        self.body = body
+        self.raw_headers = raw_headers
+        self._headers = None
+        self._headers_json = None
+        self._preview = None
+        self._json = None
+        self._parsed = False
+        self._routing: Dict[str, object] = {}
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """去掉敏感头后的请求头"""
+        if self._headers is None:
+            self._headers = {k: v for k, v in self.raw_headers.items() if k.lower() not in SENSITIVE_HEADERS}
+        return self._headers
+
+    @property
+    def headers_json(self) -> str:
+        if self._headers_json is None:
+            self._headers_json = dumps(self.headers)
+        return self._headers_json
+
+    @property
+    def preview(self) -> Optional[str]:
+        """请求体前 PREVIEW_CHARS 个字符（只解码这一段）"""
+        if not self.body:
+            return None
+        if self._preview is None:
+            self._preview = self.body.head(PREVIEW_CHARS * 4).decode('utf-8', errors='replace')[:PREVIEW_CHARS]
+        return self._preview
+
+    async def json(self):
+        """完整解析请求体，非法 JSON 返回 None"""
+        if not self._parsed:
+            self._parsed = True
+            if self.body:
+                try:
+                    if self.body.size > PARSE_OFFLOAD_THRESHOLD:
+                        self._json = await asyncio.to_thread(loads, self.body.view())
+                    else:
+                        self._json = loads(self.body.view())
+                except ValueError:
+                    self._json = None
+        return self._json
+
+    async def routing_fields(self, *keys: str) -> Dict[str, object]:
+        """读取请求体顶层字段（用于路由），未出现的字段不返回"""
+        missing = [k for k in keys if k not in self._routing]
+        if missing and self.body:
+            if self._parsed or self.body.size <= SHALLOW_SCAN_THRESHOLD:
+                doc = await self.json()
+                fields = {k: doc[k] for k in missing if k in doc} if isinstance(doc, dict) else {}
+            elif self.body.size > PARSE_OFFLOAD_THRESHOLD:
+                fields = await asyncio.to_thread(scan_top_level, self.body.view(), missing)
+            else:
+                fields = scan_top_level(self.body.view(), missing)
+            for k in missing:
+                self._routing[k] = fields.get(k)
+        return {k: self._routing[k] for k in keys if self._routing.get(k) is not None}
@@ -0,0 +1,239 @@
+"""
+登录身份缓存 - JWT 校验结果与用户信息的进程内缓存
+- 以 token 的 SHA-256 为键，缓存解码后的 claims 和 {id, email, username, vendor_level}
+- 条目 ttl 秒过期，且不晚于 token 自身的 exp
+- 用户资料变更由 Postgres 触发器 NOTIFY（见 migrations/sillymd_user_changed_notify.sql），监听到后失效该用户的全部条目
+- 监听连接中断期间清空缓存并仅依赖 TTL，重连后恢复
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Set, Tuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "user_changed"
+
+# users 表上的变更通知触发器（NOTIFY user_changed），由 sillymd 数据库管理员执行
+NOTIFY_TRIGGER_MIGRATION = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "migrations", "sillymd_user_changed_notify.sql"
+)
+
+
+class Principal(NamedTuple):
+    claims: dict
+    user: dict
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class PrincipalCache:
+    """登录身份缓存
+
+    - decode(token) 校验并解码 JWT，无效时返回 None（不缓存）
+    - loader(user_id) 加载用户信息，用户不存在或已停用时返回 None（按 negative_ttl 缓存）
+    - 同一 token 并发未命中时只发起一次加载（单飞）
+    """
+
+    def __init__(
+        self,
+        decode: Callable[[str], Optional[dict]],
+        loader: Callable[[str], Awaitable[Optional[dict]]],
+        max_size: int = 10_000,
+        ttl: float = 30.0,
+        negative_ttl: float = 5.0,
+        install_trigger: bool = False,
+        keepalive_interval: float = 30.0,
+    ):
+        self._decode = decode
+        self._loader = loader
+        self._max_size = max_size
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._install_trigger = install_trigger
+        self._keepalive_interval = keepalive_interval
+        # token 哈希 -> (过期时间, user_id, Principal 或 None)
+        self._entries: "OrderedDict[str, Tuple[float, str, Optional[Principal]]]" = OrderedDict()
+        # user_id -> token 哈希集合，用于按用户失效
+        self._user_index: Dict[str, Set[str]] = {}
+        # token 哈希 -> (加载中的 Future, user_id)
+        self._inflight: Dict[str, Tuple[asyncio.Future, str]] = {}
+        self._dsn: Optional[str] = None
+        self._listener_task: Optional[asyncio.Task] = None
+        self.listening = False
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    async def get(self, token: str) -> Optional[Principal]:
+        """校验 token 并返回登录身份；token 无效或用户不可用时返回 None"""
+        key = token_key(token)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, _, principal = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return principal
+            self._drop(key)
+
+        self.misses += 1
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight[0])
+
+        claims = self._decode(token)
+        if claims is None:
+            return None
+
+        user_id = str(claims["sub"])
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (future, user_id)
+        try:
+            self.loads += 1
+            user = await self._loader(user_id)
+            principal = Principal(claims, user) if user is not None else None
+            # 加载期间若被失效，结果仍返回给本批调用方，但不写入缓存
+            if self._inflight.get(key, (None,))[0] is future:
+                self._store(key, user_id, claims, principal)
+            future.set_result(principal)
+            return principal
+        except BaseException as e:
+            future.set_exception(e)
+            # 避免无人等待时出现 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            if self._inflight.get(key, (None,))[0] is future:
+                del self._inflight[key]
+
+    def vendor_level(self, user_id) -> Optional[str]:
+        """已缓存的用户等级，未缓存时返回 None"""
+        now = time.monotonic()
+        for key in self._user_index.get(str(user_id), ()):
+            expires_at, _, principal = self._entries[key]
+            if principal is not None and expires_at > now:
+                return principal.user["vendor_level"]
+        return None
+
+    def _store(self, key: str, user_id: str, claims: dict, principal: Optional[Principal]):
+        ttl = self._ttl if principal is not None else self._negative_ttl
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            ttl = min(ttl, exp - time.time())
+            if ttl <= 0:
+                return
+        self._entries[key] = (time.monotonic() + ttl, user_id, principal)
+        self._entries.move_to_end(key)
+        self._user_index.setdefault(user_id, set()).add(key)
+        while len(self._entries) > self._max_size:
+            old_key, (_, old_user, _) = self._entries.popitem(last=False)
+            self._unindex(old_key, old_user)
+
+    def _unindex(self, key: str, user_id: str):
+        keys = self._user_index.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_index[user_id]
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._unindex(key, entry[1])
+
+    def invalidate_user(self, user_id):
+        """失效该用户的全部条目（含正在进行的加载）"""
+        user_id = str(user_id)
+        for key in self._user_index.pop(user_id, ()):
+            self._entries.pop(key, None)
+        # 正在进行的加载结果不再写入缓存
+        for key in [k for k, (_, uid) in self._inflight.items() if uid == user_id]:
+            del self._inflight[key]
+        self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._user_index.clear()
+        self._inflight.clear()
+
+    # ======== 变更通知 ========
+
+    async def start(self, dsn: Optional[str]):
+        """监听用户变更通知（dsn 为 asyncpg 连接串；为 None 时仅依赖 TTL）"""
+        self._dsn = dsn
+        if dsn:
+            self._listener_task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener_task:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        if payload:
+            self.invalidate_user(payload)
+
+    async def _listen(self):
+        """独立连接 LISTEN，断线后重连；断线期间清空缓存以免错过通知"""
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self._dsn, timeout=10)
+                if self._install_trigger:
+                    # 仅在显式开启时代为执行迁移（默认由数据库管理员执行）
+                    try:
+                        with open(NOTIFY_TRIGGER_MIGRATION, encoding="utf-8") as f:
+                            await conn.execute(f.read())
+                        logger.info("[PrincipalCache] 已执行用户变更触发器迁移")
+                    except (OSError, asyncpg.PostgresError) as e:
+                        # 无建触发器权限时仍监听，通知可由其他系统发出
+                        logger.warning("[PrincipalCache] 创建用户变更触发器失败: %s", e)
+                    self._install_trigger = False
+                await conn.add_listener(NOTIFY_CHANNEL, self._on_notify)
+                # 重连前可能错过了通知
+                self.clear()
+                self.listening = True
+                logger.info("[PrincipalCache] 已监听用户变更通知")
+                # asyncpg 不会主动发现断线，定期探测
+                while True:
+                    await asyncio.sleep(self._keepalive_interval)
+                    await conn.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("[PrincipalCache] 用户变更监听中断，5秒后重连: %s", e)
+                self.clear()
+                await asyncio.sleep(5)
+            finally:
+                self.listening = False
+                if conn is not None:
+                    try:
+                        await conn.close(timeout=5)
+                    except Exception:
+                        pass
+
+    def get_stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self._max_size,
+            "ttl": self._ttl,
+            "listening": self.listening,
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,248 @@
+"""
+Webhook 重试调度器
+重试计划持久化在 webhook_logs.next_attempt_at / delivery_status 上，
+调度器按批领取即将到期的记录放入内存最小堆，到期后重新派发投递；
+内存中只保留 (到期时间, log_id)，待重试数量不受进程内存限制，重启后计划不丢失
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import random
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# 投递状态
+STATUS_PENDING = "pending"
+STATUS_DELIVERED = "delivered"
+STATUS_RETRYING = "retrying"
+STATUS_FAILED = "failed"
+
+# 可重试的 HTTP 状态码（0 表示网络错误/超时）
+RETRYABLE_STATUS = {0, 408, 425, 429}
+
+
+def is_retryable(status_code: int) -> bool:
+    return status_code in RETRYABLE_STATUS or status_code >= 500
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（秒数或 HTTP 日期），返回等待秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is not None:
+        retry_at = retry_at.replace(tzinfo=None) - (retry_at.utcoffset() or timedelta(0))
+    return max(0.0, (retry_at - datetime.utcnow()).total_seconds())
+
+
+def compute_backoff(
+    retry_count: int,
+    base_delay: float = 2.0,
+    max_delay: float = 3600.0,
+    retry_after: Optional[float] = None
+) -> float:
+    """带抖动的指数退避（equal jitter），Retry-After 作为下限"""
+    ceiling = min(max_delay, base_delay * (2 ** retry_count))
+    delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, max_delay))
+    return delay
+
+
+class RetryScheduler:
+    """从 webhook_logs 领取到期重试并派发
+
+    - 每次领取 next_attempt_at 落在 horizon 秒内的一批记录（FOR UPDATE SKIP LOCKED，多进程安全）
+    - 领取时把 next_attempt_at 推后 lease 秒作为租约，进程崩溃后租约到期记录会被重新领取
+    - 派发后由投递流程写回新的 next_attempt_at 或终态
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        dispatch: Callable[[dict], Awaitable[None]],
+        batch_size: int = 500,
+        horizon: float = 30.0,
+        poll_interval: float = 5.0,
+        lease: float = 300.0,
+    ):
+        self._session_factory = session_factory
+        self._dispatch = dispatch
+        self._batch_size = batch_size
+        self._horizon = horizon
+        self._poll_interval = poll_interval
+        self._lease = lease
+        self._heap: List[Tuple[datetime, str]] = []
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.claimed = 0
+        self.dispatched = 0
+        self.abandoned = 0
+
+    async def start(self):
+        self._tasks = [
+            asyncio.create_task(self._claim_loop()),
+            asyncio.create_task(self._dispatch_loop()),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _claim_loop(self):
+        while True:
+            try:
+                claimed = await self._claim_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[RetryScheduler] 领取到期重试失败: {e}")
+                claimed = 0
+            # 领满一批说明还有积压，立即继续领取
+            if claimed < self._batch_size:
+                await asyncio.sleep(self._poll_interval)
+
+    async def _claim_batch(self) -> int:
+        async with self._session_factory() as db:
+            result = await db.execute(
+                text("""
+                    WITH due AS (
+                        SELECT id, next_attempt_at FROM webhook_logs
+                        WHERE delivery_status = :status
+                          AND next_attempt_at <= :until
+                        ORDER BY next_attempt_at
+                        LIMIT :limit
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    UPDATE webhook_logs w
+                    SET next_attempt_at = due.next_attempt_at + make_interval(secs => :lease)
+                    FROM due
+                    WHERE w.id = due.id
+                    RETURNING w.id, due.next_attempt_at AS due_at
+                """),
+                {
+                    "status": STATUS_RETRYING,
+                    "until": datetime.utcnow() + timedelta(seconds=self._horizon),
+                    "limit": self._batch_size,
+                    "lease": self._lease,
+                }
+            )
+            rows = result.fetchall()
+            await db.commit()
+
+        for row in rows:
+            heapq.heappush(self._heap, (row.due_at, row.id))
+        if rows:
+            self.claimed += len(rows)
+            self._wakeup.set()
+        return len(rows)
+
+    async def _dispatch_loop(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            wait = (self._heap[0][0] - datetime.utcnow()).total_seconds()
+            if wait > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = datetime.utcnow()
+            due_ids = []
+            while self._heap and self._heap[0][0] <= now and len(due_ids) < self._batch_size:
+                due_ids.append(heapq.heappop(self._heap)[1])
+            try:
+                await self._dispatch_batch(due_ids)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 租约到期后会被重新领取
+                logger.error(f"[RetryScheduler] 派发重试失败 ({len(due_ids)} 条): {e}")
+
+    async def _dispatch_batch(self, log_ids: List[str]):
+        """批量加载投递所需数据（使用租户当前的回调配置）并派发
+
+        请求体只传递负载摘要（body_ref），由投递方按需读取；
+        租户已停用或删除、未配置回调地址的记录直接标记为失败，不再反复领取
+        """
+        async with self._session_factory() as db:
+            result = await db.execute(
+                text("""
+                    SELECT w.id, w.tenant_id, w.headers, w.body, w.body_ref, w.retry_count,
+                           w.last_attempt_at, t.webhook_url, t.secret_key
+                    FROM webhook_logs w
+                    LEFT JOIN tenants t ON w.tenant_id = t.id AND t.is_active
+                    WHERE w.id = ANY(:ids) AND w.delivery_status = :status
+                """),
+                {"ids": log_ids, "status": STATUS_RETRYING}
+            )
+            rows = result.fetchall()
+
+            dead_ids = [row.id for row in rows if not row.webhook_url]
+            if dead_ids:
+                await db.execute(
+                    text("""
+                        UPDATE webhook_logs
+                        SET delivery_status = :failed,
+                            error_message = 'Tenant inactive or no webhook URL',
+                            next_attempt_at = NULL
+                        WHERE id = ANY(:ids) AND delivery_status = :status
+                    """),
+                    {"ids": dead_ids, "failed": STATUS_FAILED, "status": STATUS_RETRYING}
+                )
+                await db.commit()
+                self.abandoned += len(dead_ids)
+
+        for row in rows:
+            if not row.webhook_url:
+                continue
+            body = None
+            if not row.body_ref:
+                # 旧记录只有截断后的文本
+                body = row.body.encode("utf-8") if row.body else b""
+            await self._dispatch({
+                "log_id": row.id,
+                "tenant_id": row.tenant_id,
+                "webhook_url": row.webhook_url,
+                "headers": json.loads(row.headers) if row.headers else {},
+                "body": body,
+                "body_ref": row.body_ref,
+                "secret_key": row.secret_key,
+                # 从未真正拨号（首次投递即被熔断跳过）的记录仍按首次投递计
+                "retry_count": (row.retry_count or 0) + 1 if row.last_attempt_at else 0,
+            })
+            self.dispatched += 1
+
+    def get_stats(self) -> dict:
+        return {
+            "scheduled_in_memory": len(self._heap),
+            "next_due_at": self._heap[0][0].isoformat() if self._heap else None,
+            "claimed": self.claimed,
+            "dispatched": self.dispatched,
+            "abandoned": self.abandoned,
+        }
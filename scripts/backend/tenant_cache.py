@@ -0,0 +1,242 @@
+"""
+租户快照缓存 - Webhook 接收热路径使用
+api_key -> 不可变租户快照，带容量上限、TTL 和单飞加载
+租户配置变更时通过 Redis pub/sub 通知所有 worker 失效
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 跨进程失效通知频道
+INVALIDATE_CHANNEL = "tenant_cache:invalidate"
+
+
+class TenantSnapshot(NamedTuple):
+    """租户只读快照（字段与 Tenant 表一致，push_devices 已预解析）"""
+    id: str
+    user_id: int
+    name: str
+    api_key: str
+    webhook_url: Optional[str]
+    secret_key: Optional[str]
+    is_active: bool
+    created_at: object
+    request_count: int
+    wechat_token: Optional[str]
+    wechat_aes_key: Optional[str]
+    wechat_corp_id: Optional[str]
+    wechat_corp_secret: Optional[str]
+    wechat_push_target: Optional[str]
+    wechat_agent_id: Optional[int]
+    wechat_push_devices: Optional[str]
+    max_body_bytes: Optional[int]
+    push_devices: Tuple[str, ...]
+
+
+def parse_push_devices(raw: Optional[str]) -> Tuple[str, ...]:
+    """解析企微回复推送设备列表，非法或为空时返回默认 ("wechat",)"""
+    if raw:
+        try:
+            devices = json.loads(raw)
+            if isinstance(devices, list) and devices:
+                return tuple(str(d) for d in devices)
+        except (ValueError, TypeError):
+            pass
+    return ("wechat",)
+
+
+def snapshot_from_row(row) -> TenantSnapshot:
+    """从 tenants 表查询结果构建快照"""
+    return TenantSnapshot(
+        id=row.id,
+        user_id=row.user_id,
+        name=row.name,
+        api_key=row.api_key,
+        webhook_url=row.webhook_url,
+        secret_key=row.secret_key,
+        is_active=row.is_active,
+        created_at=row.created_at,
+        request_count=row.request_count,
+        wechat_token=row.wechat_token,
+        wechat_aes_key=row.wechat_aes_key,
+        wechat_corp_id=row.wechat_corp_id,
+        wechat_corp_secret=row.wechat_corp_secret,
+        wechat_push_target=row.wechat_push_target,
+        wechat_agent_id=row.wechat_agent_id,
+        wechat_push_devices=row.wechat_push_devices,
+        max_body_bytes=row.max_body_bytes,
+        push_devices=parse_push_devices(row.wechat_push_devices),
+    )
+
+
+class TenantCache:
+    """进程内租户快照缓存
+
+    - LRU 容量上限，超出后淘汰最久未使用的条目
+    - 正向条目 ttl 秒过期，不存在的 api_key 以 negative_ttl 秒缓存，防止无效 key 打穿数据库
+    - 同一 api_key 并发未命中时只发起一次加载（单飞）
+    - request_count 等统计字段可能滞后至多一个 TTL
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], Awaitable[Optional[TenantSnapshot]]],
+        max_size: int = 10_000,
+        ttl: float = 60.0,
+        negative_ttl: float = 5.0,
+    ):
+        self._loader = loader
+        self._max_size = max_size
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        # api_key -> (过期时间, 快照或 None)
+        self._entries: "OrderedDict[str, Tuple[float, Optional[TenantSnapshot]]]" = OrderedDict()
+        # tenant_id -> api_key，用于按租户 ID 失效
+        self._tenant_index: Dict[str, str] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._listener_task: Optional[asyncio.Task] = None
+        self._redis = None
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    async def get(self, api_key: str) -> Optional[TenantSnapshot]:
+        """获取租户快照，未命中时加载（并发请求共享同一次加载）"""
+        entry = self._entries.get(api_key)
+        if entry is not None:
+            expires_at, snapshot = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(api_key)
+                self.hits += 1
+                return snapshot
+            self._drop(api_key)
+
+        self.misses += 1
+        future = self._inflight.get(api_key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[api_key] = future
+        try:
+            self.loads += 1
+            snapshot = await self._loader(api_key)
+            # 加载期间若被失效，结果仍返回给本批调用方，但不写入缓存
+            if self._inflight.get(api_key) is future:
+                self._store(api_key, snapshot)
+            future.set_result(snapshot)
+            return snapshot
+        except BaseException as e:
+            future.set_exception(e)
+            # 避免无人等待时出现 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            if self._inflight.get(api_key) is future:
+                del self._inflight[api_key]
+
+    def _store(self, api_key: str, snapshot: Optional[TenantSnapshot]):
+        ttl = self._ttl if snapshot is not None else self._negative_ttl
+        self._entries[api_key] = (time.monotonic() + ttl, snapshot)
+        self._entries.move_to_end(api_key)
+        if snapshot is not None:
+            self._tenant_index[snapshot.id] = api_key
+        while len(self._entries) > self._max_size:
+            old_key, (_, old_snapshot) = self._entries.popitem(last=False)
+            if old_snapshot is not None and self._tenant_index.get(old_snapshot.id) == old_key:
+                del self._tenant_index[old_snapshot.id]
+
+    def _drop(self, api_key: str):
+        entry = self._entries.pop(api_key, None)
+        if entry is not None and entry[1] is not None:
+            self._tenant_index.pop(entry[1].id, None)
+
+    def invalidate_local(self, tenant_id: Optional[str] = None, api_key: Optional[str] = None):
+        """仅失效本进程缓存"""
+        if tenant_id:
+            api_key = self._tenant_index.pop(tenant_id, None) or api_key
+        if api_key:
+            self._drop(api_key)
+            # 正在进行的加载结果不再写入缓存
+            self._inflight.pop(api_key, None)
+        self.invalidations += 1
+
+    async def invalidate(self, tenant_id: Optional[str] = None, api_key: Optional[str] = None):
+        """失效本进程缓存，并通过 Redis 通知其他 worker"""
+        self.invalidate_local(tenant_id=tenant_id, api_key=api_key)
+        if self._redis is None:
+            return
+        try:
+            await self._redis.publish(
+                INVALIDATE_CHANNEL,
+                json.dumps({"tenant_id": tenant_id, "api_key": api_key})
+            )
+        except Exception as e:
+            logger.warning(f"[TenantCache] 发布失效通知失败，其他 worker 将在 TTL 后刷新: {e}")
+
+    async def start(self, redis_conn):
+        """启动 Redis 失效通知监听"""
+        self._redis = redis_conn
+        if redis_conn is not None:
+            self._listener_task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener_task:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+
+    async def _listen(self):
+        """订阅失效频道，断线后重连；断线期间清空缓存以免错过通知"""
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                logger.info("[TenantCache] 已订阅租户失效通知")
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        data = json.loads(message["data"])
+                    except (ValueError, TypeError):
+                        continue
+                    self.invalidate_local(
+                        tenant_id=data.get("tenant_id"),
+                        api_key=data.get("api_key")
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[TenantCache] 失效通知订阅中断，5秒后重连: {e}")
+                self.clear()
+                await asyncio.sleep(5)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    def clear(self):
+        self._entries.clear()
+        self._tenant_index.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self._max_size,
+            "ttl": self._ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,76 @@
+"""WeChatTokenManager 提前刷新：gettoken 返回同一 token 时不重复刷新"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wechat_api import WeChatTokenManager  # noqa: E402
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+
+class FakeTokenManager(WeChatTokenManager):
+    """gettoken 在有效期内返回同一 token 和不变的过期时间"""
+
+    def __init__(self, calls: list, expires_at: float, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = calls
+        self.expires_at = expires_at
+
+    async def _fetch(self, corp_id, corp_secret):
+        self.fetches += 1
+        self.calls.append(corp_id)
+        return "token-1", self.expires_at
+
+
+async def _drain(*managers):
+    for manager in managers:
+        while manager._refresh_tasks:
+            await asyncio.gather(*manager._refresh_tasks)
+
+
+def test_unchanged_expiry_refreshes_once():
+    async def run():
+        calls = []
+        manager = FakeTokenManager(calls, time.time() + 100, refresh_margin=300)
+        for _ in range(20):
+            assert await manager.get_token("corp", "secret") == "token-1"
+            await _drain(manager)
+        assert len(calls) == 1
+
+    asyncio.run(run())
+
+
+def test_unchanged_expiry_refreshes_once_across_workers():
+    async def run():
+        calls = []
+        redis = FakeRedis()
+        expires_at = time.time() + 100
+        workers = [FakeTokenManager(calls, expires_at, refresh_margin=300, lock_ttl=1) for _ in range(3)]
+        for worker in workers:
+            worker._redis = redis
+        for _ in range(10):
+            for worker in workers:
+                assert await worker.get_token("corp", "secret") == "token-1"
+            await _drain(*workers)
+        assert len(calls) == 1
+
+    asyncio.run(run())
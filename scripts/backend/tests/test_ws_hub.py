@@ -0,0 +1,86 @@
+"""WebSocketHub 空闲检测：只收推送的客户端不会被当作空闲连接关闭"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from starlette.websockets import WebSocket  # noqa: E402
+
+import ws_liveness  # noqa: E402
+from ws_hub import WebSocketHub  # noqa: E402
+
+
+class FakeClient:
+    """ASGI 端的客户端：发送一次绑定请求，之后只接收"""
+
+    def __init__(self, bind: dict):
+        self.inbound = asyncio.Queue()
+        self.outbound = []
+        self.inbound.put_nowait({"type": "websocket.connect"})
+        self.inbound.put_nowait({"type": "websocket.receive", "text": json.dumps(bind)})
+
+    async def receive(self):
+        return await self.inbound.get()
+
+    async def send(self, message):
+        self.outbound.append(message)
+
+    def disconnect(self):
+        self.inbound.put_nowait({"type": "websocket.disconnect", "code": 1000})
+
+    @property
+    def closed(self) -> bool:
+        return any(message["type"] == "websocket.close" for message in self.outbound)
+
+
+async def endpoint(websocket: WebSocket):
+    """模拟 ws_server.websocket_endpoint：应答绑定后等待客户端断开"""
+    await websocket.accept()
+    bind = json.loads(await websocket.receive_text())
+    await websocket.send_text(json.dumps({"type": "bound", "device_id": f"u1:{bind['device_name']}"}))
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+
+async def _idle_for(hub: WebSocketHub, client: FakeClient, bind: dict, seconds: float, monkeypatch):
+    scope = {"type": "websocket", "path": "/ws", "headers": []}
+    task = asyncio.create_task(hub.serve(WebSocket(scope, client.receive, client.send), endpoint))
+    while not hub.user_devices("u1"):
+        await asyncio.sleep(0.01)
+    now = time.monotonic()
+    monkeypatch.setattr(ws_liveness.time, "monotonic", lambda: now + seconds)
+    for _ in range(int(seconds) + 2):
+        hub.liveness._tick()
+    monkeypatch.undo()
+    await asyncio.sleep(0.05)
+    client.disconnect()
+    await asyncio.wait_for(task, 5)
+
+
+def test_receive_only_client_is_not_reaped(monkeypatch):
+    async def run():
+        hub = WebSocketHub("w1", ping_interval=60.0, idle_timeout=180.0)
+        bind = {"type": "bind", "device_name": "d1"}
+        client = FakeClient(bind)
+        await _idle_for(hub, client, bind, 600, monkeypatch)
+        assert not client.closed
+        assert hub.liveness.pings == 0
+        assert hub.liveness.reaped == 0
+
+    asyncio.run(run())
+
+
+def test_client_announcing_ping_is_reaped_when_idle(monkeypatch):
+    async def run():
+        hub = WebSocketHub("w1", ping_interval=60.0, idle_timeout=180.0)
+        bind = {"type": "bind", "device_name": "d1", "ping": True}
+        client = FakeClient(bind)
+        await _idle_for(hub, client, bind, 600, monkeypatch)
+        assert client.closed
+        assert hub.liveness.reaped == 1
+
+    asyncio.run(run())
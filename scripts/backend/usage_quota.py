@@ -0,0 +1,315 @@
+"""
+月度用量配额 - 基于 Redis 原子计数
+每次 Webhook 只执行一次 Lua 脚本完成「检查 + 计数」，
+后台 flusher 定期把累计增量批量写回 user_monthly_usage
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# 检查并计数：
+# KEYS[1] = user:{id}:{year_month} 计数器, KEYS[2] = 待落库增量 hash
+# ARGV[1] = 限额（-1 表示不限）, ARGV[2] = user_id
+# 返回 {状态, 当前计数}，状态: -1 计数器不存在需预热, 0 超限, 1 允许
+CHECK_AND_INCR_SCRIPT = """
+local used = redis.call('GET', KEYS[1])
+if not used then
+    return {-1, 0}
+end
+used = tonumber(used)
+local limit = tonumber(ARGV[1])
+if limit >= 0 and used >= limit then
+    return {0, used}
+end
+used = redis.call('INCR', KEYS[1])
+redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+return {1, used}
+"""
+
+# 释放锁：只删除自己持有的锁
+# KEYS[1] = 锁, ARGV[1] = 持有者 token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# 计数器保留时间，覆盖整月即可
+COUNTER_TTL = 40 * 24 * 3600
+
+# 落库锁：flusher 落库和计数器预热互斥，预热读到的数据库值与待落库增量才一致
+FLUSH_LOCK_KEY = "usage:flush_lock"
+FLUSH_LOCK_TTL = 60
+
+
+def current_year_month() -> str:
+    return datetime.utcnow().strftime("%Y-%m")
+
+
+def next_reset_date(now: Optional[datetime] = None) -> datetime:
+    """下个月 1 日（UTC）"""
+    now = now or datetime.utcnow()
+    return (now.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def counter_key(user_id: int, year_month: str) -> str:
+    return f"user:{user_id}:{year_month}"
+
+
+def pending_key(year_month: str) -> str:
+    return f"usage:pending:{year_month}"
+
+
+def flushing_key(year_month: str) -> str:
+    return f"usage:flushing:{year_month}"
+
+
+class UsageQuota:
+    """Redis 原子配额计数
+
+    - 等级限额在进程内缓存 level_ttl 秒
+    - 超限用户在进程内缓存拒绝结果直到 reset_date，被拒流量不再访问 Redis 和数据库
+    - 计数器不存在（月初或被淘汰）时从数据库加待落库增量预热，预热期间持有落库锁
+    """
+
+    def __init__(
+        self,
+        redis_conn,
+        session_factory,
+        level_loader: Callable[[int], Awaitable[str]],
+        level_limits: Dict[str, Optional[int]],
+        default_limit: int,
+        level_ttl: float = 300.0,
+        flush_interval: float = 5.0,
+        flush_batch_size: int = 500,
+        seed_lock_wait: float = 5.0,
+    ):
+        self._redis = redis_conn
+        self._session_factory = session_factory
+        self._level_loader = level_loader
+        self._level_limits = level_limits
+        self._default_limit = default_limit
+        self._level_ttl = level_ttl
+        self._flush_interval = flush_interval
+        self._flush_batch_size = flush_batch_size
+        self._seed_lock_wait = seed_lock_wait
+        self._script = redis_conn.register_script(CHECK_AND_INCR_SCRIPT)
+        self._release_script = redis_conn.register_script(RELEASE_LOCK_SCRIPT)
+        # user_id -> (过期时间, vendor_level)
+        self._levels: Dict[int, Tuple[float, str]] = {}
+        # user_id -> (拒绝截止时间戳, 拒绝时的限额, 限制信息)
+        self._denials: Dict[int, Tuple[float, int, dict]] = {}
+        self._flusher_task: Optional[asyncio.Task] = None
+        self.cached_denials = 0
+        self.flushed_rows = 0
+        self.last_flush_at: Optional[str] = None
+
+    async def get_vendor_level(self, user_id: int) -> str:
+        entry = self._levels.get(user_id)
+        now = time.monotonic()
+        if entry and entry[0] > now:
+            return entry[1]
+        level = await self._level_loader(user_id)
+        self._levels[user_id] = (now + self._level_ttl, level)
+        return level
+
+    def invalidate_user(self, user_id: int):
+        """用户等级变更后调用，清除本进程等级与拒绝缓存"""
+        self._levels.pop(user_id, None)
+        self._denials.pop(user_id, None)
+
+    async def check_and_consume(self, user_id: int) -> Tuple[bool, Dict]:
+        """检查配额并计数，返回值与 check_rate_limit 一致: (是否允许, 限制信息)
+
+        限制信息中的 used 为本次请求之前的使用量
+        """
+        vendor_level = await self.get_vendor_level(user_id)
+        limit = self._level_limits.get(vendor_level, self._default_limit)
+
+        denial = self._denials.get(user_id)
+        if denial is not None:
+            denied_until, denied_limit, info = denial
+            if time.time() < denied_until and denied_limit == limit:
+                self.cached_denials += 1
+                return False, info
+            del self._denials[user_id]
+
+        year_month = current_year_month()
+        keys = [counter_key(user_id, year_month), pending_key(year_month)]
+        args = [-1 if limit is None else limit, user_id]
+
+        status, used = await self._script(keys=keys, args=args)
+        if status == -1:
+            await self._seed_counter(user_id, year_month)
+            status, used = await self._script(keys=keys, args=args)
+
+        if status == 0:
+            reset_at = next_reset_date()
+            info = {
+                "vendor_level": vendor_level,
+                "limit": limit,
+                "used": used,
+                "remaining": 0,
+                "reset_date": reset_at.strftime("%Y-%m-%d")
+            }
+            self._denials[user_id] = (
+                (reset_at - datetime(1970, 1, 1)).total_seconds(), limit, info
+            )
+            return False, info
+
+        used_before = used - 1
+        return True, {
+            "vendor_level": vendor_level,
+            "limit": limit,
+            "used": used_before,
+            "remaining": None if limit is None else limit - used_before - 1
+        }
+
+    async def get_used(self, user_id: int) -> int:
+        """读取当月使用量（优先 Redis 计数器）"""
+        year_month = current_year_month()
+        value = await self._redis.get(counter_key(user_id, year_month))
+        if value is not None:
+            return int(value)
+        return await self._load_db_usage(user_id, year_month)
+
+    async def _load_db_usage(self, user_id: int, year_month: str) -> int:
+        async with self._session_factory() as db:
+            result = await db.execute(
+                text("""
+                    SELECT request_count FROM user_monthly_usage
+                    WHERE user_id = :user_id AND year_month = :year_month
+                """),
+                {"user_id": user_id, "year_month": year_month}
+            )
+            row = result.fetchone()
+            return row.request_count if row else 0
+
+    async def _seed_counter(self, user_id: int, year_month: str):
+        """用数据库值 + 尚未落库的增量初始化计数器（NX，多 worker 并发预热只生效一次）
+
+        持有落库锁读取，避免落库在两次读取之间移动增量导致重复计数或漏计
+        """
+        lock_token = await self._acquire_flush_lock(self._seed_lock_wait)
+        if lock_token is None:
+            raise RuntimeError("usage flush lock busy, cannot seed counter")
+        try:
+            used = await self._load_db_usage(user_id, year_month)
+            pending = await self._redis.hget(pending_key(year_month), str(user_id))
+            flushing = await self._redis.hget(flushing_key(year_month), str(user_id))
+            used += int(pending or 0) + int(flushing or 0)
+            await self._redis.set(counter_key(user_id, year_month), used, nx=True, ex=COUNTER_TTL)
+        finally:
+            await self._release_flush_lock(lock_token)
+
+    # ======== 落库锁 ========
+
+    async def _acquire_flush_lock(self, wait: float = 0.0) -> Optional[str]:
+        """获取落库锁，最多等待 wait 秒，返回持有者 token；未获取到返回 None"""
+        lock_token = uuid.uuid4().hex
+        deadline = time.monotonic() + wait
+        while True:
+            if await self._redis.set(FLUSH_LOCK_KEY, lock_token, nx=True, ex=FLUSH_LOCK_TTL):
+                return lock_token
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(0.05)
+
+    async def _release_flush_lock(self, lock_token: str):
+        await self._release_script(keys=[FLUSH_LOCK_KEY], args=[lock_token])
+
+    # ======== 增量落库 ========
+
+    async def start(self):
+        self._flusher_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher_task:
+            self._flusher_task.cancel()
+            try:
+                await self._flusher_task
+            except asyncio.CancelledError:
+                pass
+            self._flusher_task = None
+        # 退出前尽量落库一次
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning(f"[Quota] 退出前落库失败，增量保留在 Redis 中: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[Quota] 用量增量落库失败，下次重试: {e}")
+
+    async def flush(self):
+        """把待落库增量批量写入 user_monthly_usage（同一时刻只有一个 worker 执行）"""
+        lock_token = await self._acquire_flush_lock()
+        if lock_token is None:
+            return
+        try:
+            now = datetime.utcnow()
+            months = {now.strftime("%Y-%m"), (now.replace(day=1) - timedelta(days=1)).strftime("%Y-%m")}
+            for year_month in sorted(months):
+                await self._flush_month(year_month)
+            self.last_flush_at = now.isoformat()
+        finally:
+            await self._release_flush_lock(lock_token)
+
+    async def _flush_month(self, year_month: str):
+        processing = flushing_key(year_month)
+        # 上次落库中断时遗留的增量优先处理，否则原子地取走当前增量
+        if not await self._redis.exists(processing):
+            try:
+                await self._redis.rename(pending_key(year_month), processing)
+            except Exception:
+                return  # 没有待落库增量
+
+        deltas = await self._redis.hgetall(processing)
+        rows = [
+            {"id": str(uuid.uuid4()), "user_id": int(k), "year_month": year_month, "delta": int(v)}
+            for k, v in deltas.items() if int(v) > 0
+        ]
+        for i in range(0, len(rows), self._flush_batch_size):
+            batch = rows[i:i + self._flush_batch_size]
+            async with self._session_factory() as db:
+                await db.execute(
+                    text("""
+                        INSERT INTO user_monthly_usage (id, user_id, year_month, request_count, last_request_at)
+                        VALUES (:id, :user_id, :year_month, :delta, NOW())
+                        ON CONFLICT (user_id, year_month) DO UPDATE
+                        SET request_count = user_monthly_usage.request_count + EXCLUDED.request_count,
+                            last_request_at = NOW()
+                    """),
+                    batch
+                )
+                await db.commit()
+            # 已提交的批次立即移除，中断后重跑不会重复累加
+            await self._redis.hdel(processing, *[str(r["user_id"]) for r in batch])
+        await self._redis.delete(processing)
+        self.flushed_rows += len(rows)
+        if rows:
+            logger.info(f"[Quota] {year_month} 用量增量已落库: {len(rows)} 个用户")
+
+    def get_stats(self) -> dict:
+        return {
+            "cached_levels": len(self._levels),
+            "cached_denials": len(self._denials),
+            "denials_served_from_cache": self.cached_denials,
+            "flushed_rows": self.flushed_rows,
+            "last_flush_at": self.last_flush_at,
+        }
@@ -9,32 +9,65 @@ import hashlib
 import hmac
 import json
 import logging
+import os
 import secrets
+import socket
+import time
 import uuid
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from typing import Optional, Tuple, Dict, List
-import bcrypt
 from jose import JWTError, jwt
 
 import aiohttp
 from fastapi import FastAPI, HTTPException, Header, Request, Depends, Form, Cookie, WebSocket, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
-from sqlalchemy import Column, String, DateTime, Text, Integer, Boolean, BigInteger, text
+from sqlalchemy import Column, String, DateTime, Text, Integer, Boolean, BigInteger, LargeBinary, text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 import redis.asyncio as redis
 from wechat_crypto import WeChatCrypto, verify_wechat_signature
-from wechat_push import push_to_wechat_app
-from ws_server import (
-    websocket_endpoint,
-    notify_by_target,
-    WebSocketManager,
-    cleanup_connections,
-    init_redis
+from tenant_cache import TenantCache, TenantSnapshot, snapshot_from_row
+from principal_cache import PrincipalCache
+from password_hasher import HasherBusy, PasswordHasher
+from login_throttle import LoginThrottle
+from usage_quota import UsageQuota
+from log_writer import LogWriter
+from blob_store import PayloadCache, PayloadCollector, prepare_payload, load_payload, parse_range
+from ingest_body import BodyTooLarge, read_body
+from payload_envelope import WebhookEnvelope
+from wechat_message import CryptoCache, WeChatMessageError, extract_fields, verify_msg_signature
+from msg_dedup import MessageDedup, message_key
+from wechat_api import WeChatTokenManager
+from wechat_push_queue import PushTarget, WeChatPushScheduler
+from log_config import logging_manager
+from delivery_client import DeliveryClient
+from delivery_queue import (
+    DeliveryConsumer,
+    WECHAT_INBOUND_GROUP,
+    WECHAT_INBOUND_STREAM,
+    decode_wechat_message,
+    enqueue_delivery,
+    enqueue_wechat_message,
 )
+from destination_health import DestinationHealth, ShortCircuit, collect_health, destination_host
+from retry_scheduler import (
+    RetryScheduler,
+    compute_backoff,
+    is_retryable,
+    parse_retry_after,
+    STATUS_DELIVERED,
+    STATUS_FAILED,
+    STATUS_PENDING,
+    STATUS_RETRYING,
+)
+from ws_server import websocket_endpoint
+from ws_hub import WebSocketHub
+from ws_offline import OfflineBuffer
+from ws_registry import DeviceRegistry
+from openclaw_leases import OpenClawCoordinator, OpenClawSpec
 
 # OpenClaw 服务（可选导入）
 try:
@@ -89,6 +122,196 @@ REDIS_CONFIG = {
     "retry_on_timeout": True,
 }
 
+# 租户快照缓存配置（接收热路径）
+TENANT_CACHE_CONFIG = {
+    "max_size": 10_000,     # 最多缓存的 api_key 数
+    "ttl": 60.0,            # 快照有效期（秒），兜底跨进程失效通知丢失的情况
+    "negative_ttl": 5.0,    # 不存在的 api_key 缓存时间（秒）
+}
+
+# 登录身份缓存配置（JWT 校验 + 用户信息，用户变更由 Postgres LISTEN/NOTIFY 失效）
+PRINCIPAL_CACHE_CONFIG = {
+    "max_size": 10_000,         # 最多缓存的 token 数
+    "ttl": 30.0,                # 身份有效期（秒），兜底变更通知丢失的情况
+    "negative_ttl": 5.0,        # 用户不存在或已停用的缓存时间（秒）
+    # users 表的变更通知触发器由 migrations/sillymd_user_changed_notify.sql 提供，需在 sillymd 库手动执行；
+    # 未执行时身份缓存仅依赖 TTL 失效
+    "install_trigger": False,
+}
+
+# 密码哈希配置（bcrypt 在独立线程池中计算，不阻塞事件循环）
+PASSWORD_HASH_CONFIG = {
+    "rounds": 12,           # bcrypt cost；调整后旧哈希在用户下次登录时重新哈希
+    "workers": 2,           # 线程数
+    "max_pending": 32,      # 排队上限，超出时返回 503
+}
+
+# 登录限流配置（在 bcrypt 计算之前检查）
+LOGIN_THROTTLE_CONFIG = {
+    "account_limit": 10,    # 单账号连续失败次数上限
+    "account_window": 900,  # 账号失败计数窗口（秒），每次失败顺延
+    "ip_limit": 30,         # 单 IP 窗口内登录尝试上限
+    "ip_window": 300,       # IP 计数窗口（秒）
+}
+
+# 月度配额计数配置（Redis 原子计数 + 批量落库）
+USAGE_QUOTA_CONFIG = {
+    "level_ttl": 300.0,         # 用户等级进程内缓存时间（秒）
+    "flush_interval": 5.0,      # 用量增量落库间隔（秒）
+    "flush_batch_size": 500,    # 每批落库的用户数
+    "seed_lock_wait": 5.0,      # 计数器预热等待落库锁的时间（秒），超时回退到数据库计数
+}
+
+# webhook_logs 批量写入配置
+LOG_WRITER_CONFIG = {
+    "max_queue": 10_000,        # 内存队列上限，满时对接收端形成背压
+    "batch_size": 500,          # 达到条数立即落库
+    "flush_interval": 0.2,      # 或达到时间阈值（秒）落库
+    "durability": "after_flush",  # after_flush: 落库后响应; before_flush: 入队即响应
+}
+
+# Webhook 投递 HTTP 客户端连接池配置
+DELIVERY_CLIENT_CONFIG = {
+    "limit": 200,               # 全部目标主机的连接总数上限
+    "limit_per_host": 20,       # 单个目标主机的连接上限
+    "ttl_dns_cache": 300,       # DNS 缓存时间（秒）
+    "keepalive_timeout": 30.0,  # 空闲连接保持时间（秒）
+    "timeout": WEBHOOK_TIMEOUT,
+}
+
+# 重试退避配置（带抖动的指数退避，Retry-After 作为下限）
+RETRY_BACKOFF_CONFIG = {
+    "base_delay": 2.0,          # 首次重试基准延迟（秒）
+    "max_delay": 3600.0,        # 单次退避上限（秒）
+}
+
+# 重试调度器配置（从 webhook_logs 领取到期重试）
+RETRY_SCHEDULER_CONFIG = {
+    "batch_size": 500,          # 每次领取条数
+    "horizon": 30.0,            # 提前领取未来多少秒内到期的重试
+    "poll_interval": 5.0,       # 领取间隔（秒）
+    "lease": 300.0,             # 领取租约（秒），进程崩溃后到期重新领取
+}
+
+# 投递目标主机熔断与自适应并发配置
+DESTINATION_HEALTH_CONFIG = {
+    "failure_threshold": 5,         # 连续失败多少次熔断
+    "open_seconds": 30.0,           # 首次熔断时长（秒），探测失败后加倍
+    "max_open_seconds": 600.0,      # 熔断时长上限（秒）
+    "initial_limit": 10,            # 单主机初始并发上限
+    "min_limit": 1,
+    "max_limit": 100,
+    "latency_threshold_ms": 5000.0, # 超过该延迟视为过载，并发减半
+    "acquire_timeout": 5.0,         # 等待并发名额的最长时间（秒），超时改为排期重试
+}
+
+# Webhook 请求体接收配置
+INGEST_CONFIG = {
+    "max_body_bytes": 20 * 1024 * 1024,   # 全局请求体上限，租户可通过 tenants.max_body_bytes 进一步收紧
+    "spool_threshold": 1024 * 1024,       # 超过该大小的请求体落盘到临时文件（mmap 读取）
+    "wechat_max_body_bytes": 256 * 1024,  # 企业微信回调（加密 XML）上限
+}
+
+# 企业微信回调处理配置
+WECHAT_CALLBACK_CONFIG = {
+    "fast_ack": True,               # 验签解密并入队后立即应答（需要 Redis），避免 5 秒超时触发重试
+    "dedup_ttl": 600,               # (corp_id, MsgId) 去重记录保留时间（秒），覆盖企业微信的重试窗口
+    "dedup_local_max_size": 100_000,  # 无 Redis 时进程内去重索引容量
+    "inbound_concurrency": 50,      # 入站队列消费者并发数
+}
+
+# 企业微信 access_token 管理
+WECHAT_TOKEN_CONFIG = {
+    "refresh_margin": 300.0,  # 距过期不足该秒数时后台提前刷新
+    "lock_ttl": 10,           # 跨进程刷新锁时长（秒）
+    "request_timeout": 10.0,  # 企业微信 API 请求超时（秒）
+}
+
+# 企业微信应用推送调度
+WECHAT_PUSH_CONFIG = {
+    "merge_window": 3.0,    # 同一推送目标在该窗口（秒）内的通知合并为一条摘要
+    "max_batch": 10,        # 单条摘要最多合并的通知数
+    "max_pending": 1000,    # 单个推送目标最多积压的通知数，超出丢弃最旧的
+    "rate": 0.5,            # 每个应用每秒发送消息数（令牌桶速率）
+    "burst": 10,            # 令牌桶容量
+    "backoff_base": 30.0,   # 企业微信限流时应用首次暂停秒数，之后加倍
+    "backoff_max": 600.0,
+}
+
+# WebSocket 设备连接发送队列
+WS_HUB_CONFIG = {
+    "queue_size": 256,              # 每个连接最多积压的推送帧数
+    "drop_policy": "drop_oldest",   # 队列满时：drop_oldest / drop_newest / collapse / disconnect
+    "send_timeout": 10.0,           # 单帧发送超时（秒），超时视为设备停滞并断开
+    "drain_timeout": 2.0,           # 连接结束时等待队列发完的时间（秒）
+    "replay_page": 100,             # 离线推送补发时每页读取条数
+    "ping_interval": 60.0,          # 连接无入站帧超过该秒数时发送 {"type": "ping"}（仅绑定时声明 "ping": true 的连接）
+    "idle_timeout": 180.0,          # 连接无入站帧超过该秒数时关闭（同上；其余连接由 uvicorn 的 ws_ping 检测）
+}
+
+# WebSocket 设备离线缓冲（按设备保留最近的推送，重连时按游标补发）
+WS_OFFLINE_CONFIG = {
+    "enabled": True,
+    "max_len": 500,                 # 每个设备最多保留的推送条数
+    "max_age": 86400,               # 推送保留时间（秒）
+    "local_max_devices": 10000,     # 无 Redis 时进程内缓冲的设备数上限
+    "max_devices": 32,              # 每个用户缓冲的设备数上限（保留最近绑定的设备，未绑定过的设备名不缓冲）
+    "known_ttl": 30 * 86400,        # 设备超过该秒数未绑定后不再缓冲
+}
+
+# OpenClaw 设备租约（设备在存活 worker 间均匀分配，持有租约的 worker 建立连接）
+OPENCLAW_LEASE_CONFIG = {
+    "lease_ttl": 30.0,              # 租约有效期（秒），worker 退出后到期由其他 worker 接管
+    "heartbeat_interval": 10.0,     # 续约与重新分配间隔（秒）
+    "connect_concurrency": 10,      # 每个 worker 同时建立的上游连接数
+    "connect_jitter": 1.0,          # 每次连接前的随机延迟上限（秒）
+    "connect_timeout": 15.0,        # 等待连接成功的时间（秒）
+    "backoff_base": 2.0,            # 连接失败后的重试间隔（秒），之后加倍
+    "backoff_max": 120.0,
+    "max_attempts": 5,
+    "status_interval": 5.0,         # 设备状态写入 Redis 的间隔（秒）
+}
+
+# 启动时分页加载 openclaw_devices 的每页行数
+OPENCLAW_WARM_START_PAGE_SIZE = 500
+
+# WebSocket 设备归属登记（跨进程推送只发往持有设备的 worker）
+WS_REGISTRY_CONFIG = {
+    "ttl": 90,                      # 登记有效期（秒），worker 退出后到期自动失效
+    "heartbeat_interval": 30.0,     # 续期间隔（秒）
+}
+
+# Webhook 详情接口内联返回负载的大小上限（字节），更大的负载通过 /body 接口读取
+WEBHOOK_DETAIL_INLINE_BODY = 64 * 1024
+
+# /body 接口解压后负载缓存（分段读取大负载时避免每个 Range 请求都重新解压）
+PAYLOAD_CACHE_CONFIG = {
+    "max_bytes": 128 * 1024 * 1024,                         # 缓存总字节数上限
+    "max_entry_bytes": INGEST_CONFIG["max_body_bytes"],     # 超过该大小的负载不缓存（覆盖所有可接收的负载）
+    "ttl": 60.0,                            # 缓存时间（秒）
+}
+
+# 未引用负载清理（webhook_logs 删除后其 webhook_payloads 不再需要）
+PAYLOAD_GC_CONFIG = {
+    "interval": 3600.0,             # 清理间隔（秒）
+    "grace": 86400.0,               # 只清理超过该秒数未被写入的负载（不小于 1 小时）
+    "batch_size": 1000,             # 每批删除的负载数
+}
+
+# 日志配置（分类级别和采样可通过 /api/v1/system/logging 运行时调整）
+LOGGING_CONFIG = {
+    "level": "INFO",
+    "json_format": True,           # 输出单行 JSON；False 时输出文本
+    "categories": {                # logger 名称 -> 级别
+        "webhook_main.ingest": "INFO",
+        "webhook_main.wechat": "INFO",
+        "webhook_main.delivery": "INFO",
+    },
+    "queue_size": 10000,           # 日志队列容量，写出跟不上时丢弃而不阻塞请求
+    "sample_every": 1,             # DEBUG 日志每 N 条保留 1 条
+    "max_debug_per_second": 200,   # DEBUG 日志每秒上限（0 不限）
+}
+
 # JWT 配置
 SECRET_KEY = "webhook-hub-secret-key-change-in-production-2024"
 ALGORITHM = "HS256"
@@ -106,9 +329,13 @@ VENDOR_LEVEL_LIMITS = {
 # 获取限制值，None 表示不限
 DEFAULT_LIMIT = 30_000  # 默认限制
 
-# 日志
-logging.basicConfig(level=logging.INFO)
+# 日志（队列异步写出，格式化在后台线程完成）
+logging_manager.setup(**LOGGING_CONFIG)
 logger = logging.getLogger(__name__)
+# 热路径按分类使用独立 logger，可单独调整级别
+ingest_logger = logging.getLogger("webhook_main.ingest")
+wechat_logger = logging.getLogger("webhook_main.wechat")
+delivery_logger = logging.getLogger("webhook_main.delivery")
 
 # 数据库 - Webhook Hub
 Base = declarative_base()
@@ -135,6 +362,7 @@ class Tenant(Base):
     wechat_push_target = Column(String(100))   # 推送目标用户ID
     wechat_agent_id = Column(Integer)          # 应用ID
     wechat_push_devices = Column(Text)         # 企微回复推送的设备列表（JSON数组）
+    max_body_bytes = Column(BigInteger)        # 请求体大小上限（字节），为空时使用全局上限
 
 class WebhookLog(Base):
     """Webhook 记录表"""
@@ -154,6 +382,24 @@ class WebhookLog(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     delivered_at = Column(DateTime)
     error_message = Column(Text)
+    # 投递状态: pending / delivered / retrying / failed
+    delivery_status = Column(String(20))
+    last_attempt_at = Column(DateTime)
+    next_attempt_at = Column(DateTime)  # 下次重试时间（retrying 时有效）
+    # 原始负载引用（webhook_payloads.sha256）与原始字节数；body 仅保留给旧记录
+    body_ref = Column(String(64))
+    body_size = Column(BigInteger)
+
+
+class WebhookPayload(Base):
+    """Webhook 原始负载（按 SHA-256 内容寻址，压缩存储）"""
+    __tablename__ = "webhook_payloads"
+
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)       # 原始字节数
+    encoding = Column(String(10), nullable=False)   # zstd / gzip / identity
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)  # 最近写入时间（再次引用时刷新，用于清理未引用负载）
 
 
 class UserMonthlyUsage(Base):
@@ -213,6 +459,22 @@ users_async_session = sessionmaker(users_engine, class_=AsyncSession, expire_on_
 async def init_db():
     async with engine.begin() as conn:
         await asyncio.wait_for(conn.run_sync(Base.metadata.create_all), timeout=10.0)
+        # 已有表补充新增列（create_all 不会修改已存在的表）
+        for ddl in (
+            "ALTER TABLE webhook_logs ADD COLUMN IF NOT EXISTS delivery_status VARCHAR(20)",
+            "ALTER TABLE webhook_logs ADD COLUMN IF NOT EXISTS last_attempt_at TIMESTAMP",
+            "ALTER TABLE webhook_logs ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP",
+            "ALTER TABLE webhook_logs ADD COLUMN IF NOT EXISTS body_ref VARCHAR(64)",
+            "ALTER TABLE webhook_logs ADD COLUMN IF NOT EXISTS body_size BIGINT",
+            "ALTER TABLE tenants ADD COLUMN IF NOT EXISTS max_body_bytes BIGINT",
+            "CREATE INDEX IF NOT EXISTS ix_webhook_logs_retry_due ON webhook_logs (next_attempt_at) "
+            "WHERE delivery_status = 'retrying'",
+            # 负载清理按引用和写入时间查找
+            "CREATE INDEX IF NOT EXISTS ix_webhook_logs_body_ref ON webhook_logs (body_ref) "
+            "WHERE body_ref IS NOT NULL",
+            "CREATE INDEX IF NOT EXISTS ix_webhook_payloads_created_at ON webhook_payloads (created_at)",
+        ):
+            await conn.execute(text(ddl))
 
 # Redis 连接
 redis_conn = None
@@ -220,9 +482,187 @@ redis_conn = None
 # OpenClaw WebSocket 服务（可选）
 openclaw_service = None
 
+# OpenClaw 设备归属协调（每个设备只由一个 worker 连接，lifespan 中启动）
+openclaw_coordinator = None
+
+
+async def load_tenant_snapshot(api_key: str) -> Optional[TenantSnapshot]:
+    """从数据库加载租户快照（租户缓存未命中时调用）"""
+    async with async_session() as db:
+        result = await db.execute(
+            text("SELECT * FROM tenants WHERE api_key = :key AND is_active = true"),
+            {"key": api_key}
+        )
+        row = result.fetchone()
+        return snapshot_from_row(row) if row else None
+
+
+def decode_access_token(token: str) -> Optional[dict]:
+    """校验并解码 JWT，无效或缺少 sub 时返回 None"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return payload if payload.get("sub") is not None else None
+
+
+async def load_principal(user_id: str) -> Optional[dict]:
+    """从用户库加载登录身份（身份缓存未命中时调用）"""
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    async with users_async_session() as db:
+        result = await db.execute(
+            text("SELECT id, email, username, vendor_level FROM users WHERE id = :id AND is_active = true"),
+            {"id": user_id}
+        )
+        row = result.fetchone()
+    if row is None:
+        return None
+    return {
+        "id": row.id,
+        "email": row.email,
+        "username": row.username,
+        "vendor_level": row.vendor_level or "normal",
+    }
+
+
+async def load_openclaw_device(unique_device_id: str) -> Optional[OpenClawSpec]:
+    """读取 OpenClaw 设备连接配置（tenant_id:device_id），设备或租户已停用时返回 None"""
+    tenant_id, _, device_id = unique_device_id.partition(":")
+    async with async_session() as db:
+        result = await db.execute(
+            text("""
+                SELECT d.name, d.ws_url, d.api_key, d.webhook_url, t.user_id
+                FROM openclaw_devices d JOIN tenants t ON t.id = d.tenant_id
+                WHERE d.tenant_id = :tenant_id AND d.device_id = :device_id
+                  AND d.is_active = true AND t.is_active = true
+            """),
+            {"tenant_id": tenant_id, "device_id": device_id}
+        )
+        row = result.fetchone()
+    if not row:
+        return None
+    return OpenClawSpec(unique_device_id, row.name, row.api_key, row.ws_url, tenant_id, row.user_id, row.webhook_url)
+
+
+async def iter_openclaw_devices(page_size: int):
+    """按 (tenant_id, device_id) 键集分页读取所有启用的 OpenClaw 设备，每次产出一页"""
+    last = ("", "")
+    while True:
+        async with async_session() as db:
+            result = await db.execute(
+                text("""
+                    SELECT d.tenant_id, d.device_id, d.name, d.ws_url, d.api_key, d.webhook_url, t.user_id
+                    FROM openclaw_devices d JOIN tenants t ON t.id = d.tenant_id
+                    WHERE d.is_active = true AND t.is_active = true
+                      AND (d.tenant_id, d.device_id) > (:tenant_id, :device_id)
+                    ORDER BY d.tenant_id, d.device_id
+                    LIMIT :limit
+                """),
+                {"tenant_id": last[0], "device_id": last[1], "limit": page_size}
+            )
+            rows = result.fetchall()
+        if not rows:
+            return
+        yield [
+            OpenClawSpec(
+                f"{row.tenant_id}:{row.device_id}", row.name, row.api_key, row.ws_url,
+                row.tenant_id, row.user_id, row.webhook_url
+            )
+            for row in rows
+        ]
+        if len(rows) < page_size:
+            return
+        last = (rows[-1].tenant_id, rows[-1].device_id)
+
+
+# 企业微信加解密上下文缓存（(token, aes_key, corp_id) -> WeChatCrypto）
+wechat_crypto_cache = CryptoCache(WeChatCrypto, max_size=TENANT_CACHE_CONFIG["max_size"])
+
+# 企业微信 access_token 管理（lifespan 中启动，按 (corp_id, corp_secret) 共享 token）
+wechat_tokens = WeChatTokenManager(**WECHAT_TOKEN_CONFIG)
+
+
+async def resolve_push_target(tenant_id: str) -> Optional[PushTarget]:
+    """推送调度器发送前读取租户当前的企业微信应用配置，未配置或租户已删除时返回 None"""
+    async with async_session() as db:
+        result = await db.execute(
+            text("""
+                SELECT wechat_corp_id, wechat_corp_secret, wechat_agent_id, wechat_push_target
+                FROM tenants WHERE id = :id AND is_active = true
+            """),
+            {"id": tenant_id}
+        )
+        row = result.fetchone()
+    if not row or not (row.wechat_corp_id and row.wechat_corp_secret and row.wechat_agent_id and row.wechat_push_target):
+        return None
+    return PushTarget(row.wechat_corp_id, row.wechat_corp_secret, row.wechat_agent_id, row.wechat_push_target)
+
+
+# 企业微信应用推送调度器（lifespan 中启动）
+wechat_push_scheduler = WeChatPushScheduler(wechat_tokens, resolve_push_target, **WECHAT_PUSH_CONFIG)
+
+# 企业微信回调去重索引
+wechat_dedup = MessageDedup(
+    ttl=WECHAT_CALLBACK_CONFIG["dedup_ttl"],
+    local_max_size=WECHAT_CALLBACK_CONFIG["dedup_local_max_size"]
+)
+
+# 企业微信入站队列消费者（快速应答模式，lifespan 中启动）
+wechat_inbound_consumer = None
+
+# 本进程标识（队列消费者名、跨进程推送来源）
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+# WebSocket 设备推送中枢（/ws 连接在此登记，lifespan 中启动跨进程订阅）
+ws_offline = OfflineBuffer(
+    max_len=WS_OFFLINE_CONFIG["max_len"],
+    max_age=WS_OFFLINE_CONFIG["max_age"],
+    local_max_devices=WS_OFFLINE_CONFIG["local_max_devices"],
+    max_devices=WS_OFFLINE_CONFIG["max_devices"],
+    known_ttl=WS_OFFLINE_CONFIG["known_ttl"]
+) if WS_OFFLINE_CONFIG["enabled"] else None
+ws_hub = WebSocketHub(
+    WORKER_ID,
+    offline=ws_offline,
+    registry=DeviceRegistry(WORKER_ID, **WS_REGISTRY_CONFIG),
+    **WS_HUB_CONFIG
+)
+
+# 租户快照缓存（api_key -> TenantSnapshot）
+tenant_cache = TenantCache(load_tenant_snapshot, **TENANT_CACHE_CONFIG)
+
+# 登录身份缓存（token 哈希 -> claims + 用户信息）
+principal_cache = PrincipalCache(decode_access_token, load_principal, **PRINCIPAL_CACHE_CONFIG)
+
+# 密码哈希线程池与登录限流（lifespan 中接入 Redis）
+password_hasher = PasswordHasher(**PASSWORD_HASH_CONFIG)
+login_throttle = LoginThrottle(**LOGIN_THROTTLE_CONFIG)
+
+# 解压后负载缓存（/body 分段读取）
+payload_cache = PayloadCache(**PAYLOAD_CACHE_CONFIG)
+
+# webhook_logs 批量写入器（同时合并 tenants.request_count 增量）
+log_writer = LogWriter(engine, **LOG_WRITER_CONFIG)
+
+# Webhook 投递客户端（lifespan 中启动，进程内共享连接池）
+delivery_client: Optional[DeliveryClient] = None
+
+# 投递目标主机健康状态（每个进程独立，worker 定期上报到 Redis）
+destination_health = DestinationHealth(**DESTINATION_HEALTH_CONFIG)
+
+# 重试调度器（正常由 webhook_worker 运行；Redis 不可用时在 API 进程内运行）
+retry_scheduler: Optional[RetryScheduler] = None
+
+# 未引用负载清理（与重试调度器一样，正常由 webhook_worker 运行）
+payload_collector: Optional[PayloadCollector] = None
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global redis_conn, openclaw_service
+    global redis_conn, openclaw_service, openclaw_coordinator, usage_quota, delivery_client, retry_scheduler, wechat_inbound_consumer
+    global payload_collector
 
     # 数据库初始化（带超时和异常处理）
     try:
@@ -242,35 +682,121 @@ async def lifespan(app: FastAPI):
         logger.warning(f"[Lifespan] Redis 连接失败，消息转发将受限: {e}")
         redis_conn = None
 
+    # 租户缓存跨进程失效监听（无 Redis 时仅依赖 TTL）
+    await tenant_cache.start(redis_conn)
+
+    # 用户变更通知监听（独立连接，不占用连接池）
+    await principal_cache.start(USERS_DATABASE_URL.replace("+asyncpg", "", 1))
+
+    # 登录限流计数（无 Redis 时按进程计数）
+    login_throttle.start(redis_conn)
+
+    # 月度配额 Redis 计数（无 Redis 时回退到逐请求 SQL 计数）
+    if redis_conn:
+        usage_quota = UsageQuota(
+            redis_conn,
+            async_session,
+            level_loader=get_user_vendor_level,
+            level_limits=VENDOR_LEVEL_LIMITS,
+            default_limit=DEFAULT_LIMIT,
+            **USAGE_QUOTA_CONFIG
+        )
+        await usage_quota.start()
+        logger.info("[Lifespan] 月度配额 Redis 计数已启用")
+
     # 初始化 OpenClaw 服务（如果可用）
     if OPENCLAW_AVAILABLE:
         openclaw_service = OpenClawService()
         await openclaw_service.start()
         logger.info("[Lifespan] OpenClaw WebSocket 服务已启动")
+        # 有 Redis 时设备按租约分配给各 worker；无 Redis 时在本进程连接
+        openclaw_coordinator = OpenClawCoordinator(
+            openclaw_service, WORKER_ID, load_openclaw_device, **OPENCLAW_LEASE_CONFIG
+        )
+        await openclaw_coordinator.start(redis_conn)
+        # 后台加载已启用的设备，限并发、加抖动重连，进度见 /api/v1/system/stats
+        openclaw_coordinator.start_warm_start(iter_openclaw_devices(OPENCLAW_WARM_START_PAGE_SIZE))
     else:
         logger.info("[Lifespan] OpenClaw 服务不可用，跳过初始化")
 
-    # 启动 WebSocket 清理任务（用于设备绑定推送）
-    cleanup_task = asyncio.create_task(cleanup_connections())
-    logger.info("[Lifespan] WebSocket 清理任务已启动")
+    await log_writer.start()
+
+    delivery_client = DeliveryClient(**DELIVERY_CLIENT_CONFIG)
+    await delivery_client.start()
+
+    # 无 Redis 时没有独立 worker 消费投递队列，由本进程调度重试
+    if redis_conn is None:
+        async def _dispatch_retry(job: dict):
+            asyncio.create_task(process_webhook_retry(**job))
+
+        retry_scheduler = RetryScheduler(async_session, _dispatch_retry, **RETRY_SCHEDULER_CONFIG)
+        await retry_scheduler.start()
+        payload_collector = PayloadCollector(async_session, **PAYLOAD_GC_CONFIG)
+        await payload_collector.start()
+        logger.info("[Lifespan] 重试调度器与负载清理已在 API 进程内启动")
+    logger.info(f"[Lifespan] Webhook 日志批量写入已启动 (durability={log_writer.durability})")
+
+    await wechat_tokens.start(redis_conn)
+    await wechat_push_scheduler.start(redis_conn)
+
+    # 企业微信回调去重与快速应答入站队列
+    wechat_dedup.start(redis_conn)
+    wechat_inbound_task = None
+    if redis_conn and WECHAT_CALLBACK_CONFIG["fast_ack"]:
+        wechat_inbound_consumer = DeliveryConsumer(
+            redis_conn,
+            WORKER_ID,
+            handle_wechat_inbound,
+            concurrency=WECHAT_CALLBACK_CONFIG["inbound_concurrency"],
+            stream=WECHAT_INBOUND_STREAM,
+            group=WECHAT_INBOUND_GROUP,
+            decode=decode_wechat_message
+        )
+        wechat_inbound_task = asyncio.create_task(wechat_inbound_consumer.run())
+        logger.info("[Lifespan] 企业微信快速应答已启用")
 
-    # 初始化 WebSocket Redis（用于跨进程消息转发）
-    ws_redis_initialized = await init_redis()
-    if ws_redis_initialized:
-        logger.info("[Lifespan] WebSocket Redis 已初始化")
-    else:
-        logger.warning("[Lifespan] WebSocket Redis 初始化失败，跨进程消息转发不可用")
+    # 设备推送中枢订阅跨进程推送（无 Redis 时只投递本进程的连接，离线缓冲使用进程内存储），
+    # 并启动连接存活检测（定时轮，代替周期性全量清理）
+    if ws_offline:
+        ws_offline.start(redis_conn)
+    await ws_hub.start(redis_conn)
 
     yield
 
-    # 关闭清理任务
-    cleanup_task.cancel()
-    try:
-        await cleanup_task
-    except asyncio.CancelledError:
-        pass
+    await tenant_cache.stop()
+    await principal_cache.stop()
+    password_hasher.close()
+    await ws_hub.stop()
+
+    # 先停止入站队列，其产生的日志和投递随后一并落库
+    if wechat_inbound_task:
+        wechat_inbound_task.cancel()
+        try:
+            await wechat_inbound_task
+        except asyncio.CancelledError:
+            pass
+        await wechat_inbound_consumer.stop()
+
+    # 落库剩余日志
+    await log_writer.stop()
+
+    await wechat_push_scheduler.stop()
+    await wechat_tokens.close()
+
+    if retry_scheduler:
+        await retry_scheduler.stop()
+    if payload_collector:
+        await payload_collector.stop()
 
-    # 关闭 OpenClaw 服务（如果已启动）
+    if delivery_client:
+        await delivery_client.close()
+
+    if usage_quota:
+        await usage_quota.stop()
+
+    # 关闭 OpenClaw 服务（如果已启动），先释放设备租约由其他 worker 接管
+    if openclaw_coordinator:
+        await openclaw_coordinator.stop()
     if openclaw_service:
         await openclaw_service.stop()
         logger.info("[Lifespan] OpenClaw WebSocket 服务已停止")
@@ -359,26 +885,38 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """验证密码 - 支持 bcrypt 和明文（兼容旧系统）"""
-    # bcrypt限制72字节，截断密码
-    plain_bytes = plain_password[:72].encode('utf-8')
-    if hashed_password.startswith('$2'):
-        try:
-            return bcrypt.checkpw(plain_bytes, hashed_password.encode('utf-8'))
-        except Exception:
-            return False
-    # 兼容旧系统的明文密码（实际应该迁移）
-    return plain_password == hashed_password
+def password_busy_exception() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Server busy, please retry",
+        headers={"Retry-After": "1"},
+    )
 
-def get_password_hash(password: str) -> str:
-    """生成密码哈希 - bcrypt限制72字节"""
-    password_bytes = password[:72].encode('utf-8')
-    return bcrypt.hashpw(password_bytes, bcrypt.gensalt(12)).decode('utf-8')
+async def rehash_password(user_id: int, password: str, old_hash: str):
+    """按当前 cost 重新哈希密码（登录成功后后台执行，哈希已被修改时放弃）"""
+    try:
+        password_hash = await password_hasher.hash(password)
+        async with users_async_session() as db:
+            await db.execute(
+                text("""
+                    UPDATE users SET password_hash = :password_hash, updated_at = NOW()
+                    WHERE id = :id AND password_hash = :old_hash
+                """),
+                {"id": user_id, "password_hash": password_hash, "old_hash": old_hash}
+            )
+            await db.commit()
+    except HasherBusy:
+        # 下次登录再重新哈希
+        pass
+    except Exception as e:
+        logger.warning("[Auth] 用户 %s 密码重新哈希失败: %s", user_id, e)
 
 
 async def get_user_vendor_level(user_id: int) -> str:
-    """获取用户等级"""
+    """获取用户等级（优先取登录身份缓存）"""
+    level = principal_cache.vendor_level(user_id)
+    if level is not None:
+        return level
     async with users_async_session() as db:
         result = await db.execute(
             text("SELECT vendor_level FROM users WHERE id = :id AND is_active = true"),
@@ -481,6 +1019,26 @@ async def check_rate_limit(user_id: int) -> Tuple[bool, Dict]:
     }
 
 
+# 月度配额计数（Redis 可用时在 lifespan 中初始化）
+usage_quota: Optional[UsageQuota] = None
+
+
+async def consume_quota(user_id: int) -> Tuple[bool, Dict]:
+    """检查配额并计入本次请求
+    优先使用 Redis 原子计数，Redis 不可用时回退到 SQL 检查 + 计数
+    """
+    if usage_quota:
+        try:
+            return await usage_quota.check_and_consume(user_id)
+        except Exception as e:
+            logger.warning(f"[Quota] Redis 配额计数失败，回退到数据库: {e}")
+
+    allowed, limit_info = await check_rate_limit(user_id)
+    if allowed:
+        await increment_user_usage(user_id)
+    return allowed, limit_info
+
+
 def get_vendor_level_name(level: str) -> str:
     """获取等级中文名"""
     names = {
@@ -653,66 +1211,34 @@ async def get_current_user(
     if not jwt_token:
         raise credentials_exception
 
-    try:
-        payload = jwt.decode(jwt_token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
+    # 校验结果与用户信息走登录身份缓存
+    principal = await principal_cache.get(jwt_token)
+    if principal is None:
         raise credentials_exception
-
-    # 查询用户信息
-    async with users_async_session() as db:
-        result = await db.execute(
-            text("SELECT id, email, username FROM users WHERE id = :id AND is_active = true"),
-            {"id": int(user_id)}
-        )
-        row = result.fetchone()
-        if row is None:
-            raise credentials_exception
-        return {"id": row.id, "email": row.email, "username": row.username}
+    return principal.user
 
 async def get_tenant(
-    x_api_key: str = Header(..., description="API Key"),
-    db: AsyncSession = Depends(get_db)
-) -> Tenant:
-    """验证 API Key 并返回租户信息"""
-    result = await db.execute(
-        text("SELECT * FROM tenants WHERE api_key = :key AND is_active = true"),
-        {"key": x_api_key}
-    )
-    row = result.fetchone()
-    if not row:
+    x_api_key: str = Header(..., description="API Key")
+) -> TenantSnapshot:
+    """验证 API Key 并返回租户信息（走租户快照缓存）"""
+    tenant = await tenant_cache.get(x_api_key)
+    if not tenant:
         raise HTTPException(status_code=401, detail="Invalid API Key")
-
-    return Tenant(
-        id=row.id,
-        user_id=row.user_id,
-        name=row.name,
-        api_key=row.api_key,
-        webhook_url=row.webhook_url,
-        secret_key=row.secret_key,
-        is_active=row.is_active,
-        created_at=row.created_at,
-        request_count=row.request_count,
-        wechat_token=row.wechat_token,
-        wechat_aes_key=row.wechat_aes_key,
-        wechat_corp_id=row.wechat_corp_id,
-        wechat_corp_secret=row.wechat_corp_secret,
-        wechat_push_target=row.wechat_push_target,
-        wechat_agent_id=row.wechat_agent_id
-    )
+    return tenant
 
 # ======== Webhook 转发功能 ========
 
 async def forward_webhook(
     webhook_url: str,
     headers: dict,
-    body: bytes,
+    body,
     secret_key: Optional[str] = None
-) -> Tuple[int, str]:
-    """转发 Webhook 到用户指定的回调地址"""
-    logger.info(f"[Forward] Starting to forward webhook to: {webhook_url[:50]}...")
+) -> Tuple[int, str, Optional[float]]:
+    """转发 Webhook 到用户指定的回调地址
+    body 可以是 bytes 或 memoryview（大请求体为临时文件的 mmap 视图，直接作为请求数据发送）
+    返回: (状态码, 响应内容, Retry-After 秒数)，网络错误时状态码为 0
+    """
+    delivery_logger.debug("[Forward] Starting to forward webhook to: %.50s...", webhook_url)
 
     forward_headers = dict(headers)
     forward_headers.pop("host", None)
@@ -720,82 +1246,230 @@ async def forward_webhook(
 
     if secret_key:
         timestamp = str(int(datetime.utcnow().timestamp()))
-        try:
-            body_text = body.decode('utf-8')
-        except UnicodeDecodeError:
-            body_text = body.decode('utf-8', errors='replace')
-        signature = hmac.new(
-            secret_key.encode(),
-            f"{timestamp}.{body_text}".encode(),
-            hashlib.sha256
-        ).hexdigest()
+        mac = hmac.new(secret_key.encode(), f"{timestamp}.".encode(), hashlib.sha256)
+        # 对发送的原始字节签名（bytes / memoryview 直接计算，不解码、不复制）
+        mac.update(body)
+        signature = mac.hexdigest()
         forward_headers["X-Webhook-Signature"] = f"t={timestamp},v1={signature}"
 
-    timeout = aiohttp.ClientTimeout(total=WEBHOOK_TIMEOUT)
+    # 优先使用共享连接池；客户端未启动时（如独立脚本调用）临时建立会话
+    if delivery_client is not None:
+        return await _post_webhook(delivery_client.session, webhook_url, forward_headers, body)
 
+    timeout = aiohttp.ClientTimeout(total=WEBHOOK_TIMEOUT)
     async with aiohttp.ClientSession(timeout=timeout) as session:
-        try:
-            async with session.post(
-                webhook_url,
-                headers=forward_headers,
-                data=body
-            ) as response:
-                response_text = await response.text()
-                logger.info(f"[Forward] Success: status={response.status}, body_len={len(response_text)}")
-                return response.status, response_text
-        except asyncio.TimeoutError:
-            logger.error("[Forward] Timeout")
-            return 0, "Timeout"
-        except Exception as e:
-            logger.error(f"[Forward] Error: {e}")
-            return 0, str(e)
+        return await _post_webhook(session, webhook_url, forward_headers, body)
+
+async def _post_webhook(
+    session: aiohttp.ClientSession,
+    webhook_url: str,
+    forward_headers: dict,
+    body
+) -> Tuple[int, str, Optional[float]]:
+    try:
+        async with session.post(
+            webhook_url,
+            headers=forward_headers,
+            data=body
+        ) as response:
+            response_text = await response.text()
+            delivery_logger.debug("[Forward] Success: status=%s, body_len=%d", response.status, len(response_text))
+            return response.status, response_text, parse_retry_after(response.headers.get("Retry-After"))
+    except asyncio.TimeoutError:
+        delivery_logger.error("[Forward] Timeout")
+        return 0, "Timeout", None
+    except Exception as e:
+        delivery_logger.error("[Forward] Error: %s", e)
+        return 0, str(e), None
 
 async def process_webhook_retry(
     log_id: str,
     tenant_id: str,
     webhook_url: str,
     headers: dict,
-    body: bytes,
+    body: Optional[bytes],
     secret_key: Optional[str],
-    retry_count: int = 0
+    retry_count: int = 0,
+    log_flushed: Optional[asyncio.Future] = None,
+    body_ref: Optional[str] = None
 ):
-    """处理 Webhook 转发和重试"""
-    logger.info(f"[Retry] Processing webhook log_id={log_id}, retry={retry_count}")
-    status_code, response = await forward_webhook(webhook_url, headers, body, secret_key)
-    logger.info(f"[Retry] Forward result: status_code={status_code}, retry={retry_count}")
+    """执行一次 Webhook 投递并记录结果
 
+    失败且可重试时不在进程内等待，而是把下次重试时间写入 next_attempt_at，
+    由 RetryScheduler 到期后重新派发
+    log_flushed: 日志行批量落库完成的 future，更新投递结果前需等待该行已写入
+    body_ref: body 为 None 时从负载存储读取请求体
+    """
+    delivery_logger.debug("[Retry] Processing webhook log_id=%s, retry=%d", log_id, retry_count)
+    if body is None:
+        async with async_session() as db:
+            body = await load_payload(db, body_ref) if body_ref else None
+        if body is None:
+            delivery_logger.error("[Retry] 负载不存在，放弃投递: log_id=%s, body_ref=%s", log_id, body_ref)
+            await record_delivery_result(log_id, 0, "Payload not found", retry_count, STATUS_FAILED, None)
+            return
+    health = destination_health.get(webhook_url)
     try:
-        async with async_session() as session:
-            delivered = 200 <= status_code < 300
+        probe = await health.acquire()
+    except ShortCircuit as sc:
+        # 目标主机已熔断或并发已满：不拨号，按熔断剩余时间排期重试，不计入重试次数
+        delivery_logger.info("[Retry] 跳过投递 log_id=%s: %s", log_id, sc)
+        if log_flushed is not None:
+            try:
+                await log_flushed
+            except Exception as e:
+                delivery_logger.error("[Retry] 日志行写入失败，无法记录投递结果: log_id=%s, error=%s", log_id, e)
+                return
+        next_attempt_at = datetime.utcnow() + timedelta(
+            seconds=compute_backoff(0, retry_after=sc.retry_after, **RETRY_BACKOFF_CONFIG)
+        )
+        try:
+            await record_short_circuit(log_id, f"Short-circuited: {sc.reason}", next_attempt_at)
+        except Exception as e:
+            delivery_logger.error("[Retry] Database update failed: %s", e)
+        return
 
-            await session.execute(
-                text("""
-                    UPDATE webhook_logs
-                    SET status_code = :status,
-                        response_body = :response,
-                        retry_count = :retry,
-                        delivered_at = CASE WHEN :delivered THEN NOW() ELSE delivered_at END,
-                        error_message = CASE WHEN :delivered THEN NULL ELSE :response END
-                    WHERE id = :id
-                """),
-                {
-                    "id": log_id,
-                    "status": status_code if status_code else None,
-                    "response": response[:1000] if response else None,
-                    "retry": retry_count,
-                    "delivered": delivered
-                }
-            )
-            await session.commit()
-            logger.info(f"[Retry] Database updated for log_id={log_id}, delivered={delivered}")
+    status_code = 0
+    started = time.perf_counter()
+    try:
+        status_code, response, retry_after = await forward_webhook(webhook_url, headers, body, secret_key)
+    finally:
+        await health.release(status_code, (time.perf_counter() - started) * 1000, probe)
+    delivery_logger.debug("[Retry] Forward result: status_code=%s, retry=%d", status_code, retry_count)
+
+    if log_flushed is not None:
+        try:
+            await log_flushed
+        except Exception as e:
+            delivery_logger.error("[Retry] 日志行写入失败，无法记录投递结果: log_id=%s, error=%s", log_id, e)
+            return
+
+    delivered = 200 <= status_code < 300
+    next_attempt_at = None
+    if delivered:
+        delivery_status = STATUS_DELIVERED
+    elif is_retryable(status_code) and retry_count < MAX_RETRIES:
+        delivery_status = STATUS_RETRYING
+        delay = compute_backoff(retry_count, retry_after=retry_after, **RETRY_BACKOFF_CONFIG)
+        next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        delivery_logger.info("[Retry] log_id=%s 将在 %.1f 秒后重试", log_id, delay)
+    else:
+        delivery_status = STATUS_FAILED
+
+    try:
+        await record_delivery_result(
+            log_id, status_code, response, retry_count, delivery_status, next_attempt_at
+        )
+        delivery_logger.debug("[Retry] Database updated for log_id=%s, status=%s", log_id, delivery_status)
     except Exception as e:
-        logger.error(f"[Retry] Database update failed: {e}")
+        delivery_logger.error("[Retry] Database update failed: %s", e)
 
-        if not delivered and retry_count < MAX_RETRIES:
-            await asyncio.sleep(2 ** retry_count)
-            await process_webhook_retry(
-                log_id, tenant_id, webhook_url, headers, body, secret_key, retry_count + 1
+@async_retry(max_retries=3, delay=1.0)
+async def record_delivery_result(
+    log_id: str,
+    status_code: int,
+    response: Optional[str],
+    retry_count: int,
+    delivery_status: str,
+    next_attempt_at: Optional[datetime]
+):
+    """写回投递结果与重试计划"""
+    delivered = delivery_status == STATUS_DELIVERED
+    async with async_session() as session:
+        await session.execute(
+            text("""
+                UPDATE webhook_logs
+                SET status_code = :status,
+                    response_body = :response,
+                    retry_count = :retry,
+                    delivered_at = CASE WHEN :delivered THEN NOW() ELSE delivered_at END,
+                    error_message = CASE WHEN :delivered THEN NULL ELSE :response END,
+                    delivery_status = :delivery_status,
+                    last_attempt_at = :now,
+                    next_attempt_at = :next_attempt_at
+                WHERE id = :id
+            """),
+            {
+                "id": log_id,
+                "status": status_code if status_code else None,
+                "response": response[:1000] if response else None,
+                "retry": retry_count,
+                "delivered": delivered,
+                "delivery_status": delivery_status,
+                "now": datetime.utcnow(),
+                "next_attempt_at": next_attempt_at
+            }
+        )
+        await session.commit()
+
+@async_retry(max_retries=3, delay=1.0)
+async def record_short_circuit(log_id: str, reason: str, next_attempt_at: datetime):
+    """记录未拨号的投递（目标主机熔断）并排期重试
+
+    不更新 retry_count / last_attempt_at，重试调度器据此不把这次计为一次投递尝试
+    """
+    async with async_session() as session:
+        await session.execute(
+            text("""
+                UPDATE webhook_logs
+                SET error_message = :reason,
+                    delivery_status = :delivery_status,
+                    next_attempt_at = :next_attempt_at
+                WHERE id = :id
+            """),
+            {
+                "id": log_id,
+                "reason": reason,
+                "delivery_status": STATUS_RETRYING,
+                "next_attempt_at": next_attempt_at
+            }
+        )
+        await session.commit()
+
+async def dispatch_delivery(
+    log_id: str,
+    tenant_id: str,
+    webhook_url: str,
+    headers: dict,
+    body: bytes,
+    secret_key: Optional[str],
+    log_flushed: Optional[asyncio.Future] = None,
+    body_ref: Optional[str] = None
+):
+    """投递任务入持久化队列，由 webhook_worker 进程消费
+
+    日志行尚未落库（before_flush 模式）时等落库后再入队，保证 worker 能更新到该行；
+    有 body_ref 时队列中只携带负载摘要（负载与日志行同一事务落库），不复制请求体；
+    Redis 不可用时回退到本进程内投递
+    """
+    if redis_conn is None:
+        asyncio.create_task(process_webhook_retry(
+            log_id, tenant_id, webhook_url, headers, body, secret_key,
+            log_flushed=log_flushed
+        ))
+        return
+
+    async def _enqueue():
+        if log_flushed is not None:
+            try:
+                await log_flushed
+            except Exception as e:
+                delivery_logger.error("[Delivery] 日志行写入失败，放弃投递: log_id=%s, error=%s", log_id, e)
+                return
+        try:
+            await enqueue_delivery(
+                redis_conn, log_id, tenant_id, webhook_url, headers, body, secret_key, body_ref=body_ref
             )
+        except Exception as e:
+            delivery_logger.error("[Delivery] 入队失败，改为本进程投递: log_id=%s, error=%s", log_id, e)
+            asyncio.create_task(process_webhook_retry(
+                log_id, tenant_id, webhook_url, headers, body, secret_key
+            ))
+
+    if log_flushed is None or log_flushed.done():
+        await _enqueue()
+    else:
+        asyncio.create_task(_enqueue())
 
 # ======== 认证 API ========
 
@@ -827,7 +1501,10 @@ async def register(
     vendor_level = 'staff' if email_domain in staff_domains else 'normal'
 
     # 创建用户
-    password_hash = get_password_hash(data.password)
+    try:
+        password_hash = await password_hasher.hash(data.password)
+    except HasherBusy:
+        raise password_busy_exception()
     result = await db.execute(
         text("""
             INSERT INTO users (username, email, password_hash, vendor_level, is_active, is_verified, created_at, updated_at)
@@ -856,6 +1533,7 @@ async def register(
 
 @app.post("/api/v1/auth/login")
 async def login(
+    request: Request,
     response: Response,
     data: UserLogin,
     db: AsyncSession = Depends(get_users_db)
@@ -863,6 +1541,16 @@ async def login(
     """用户登录 - 支持邮箱/用户名/手机号"""
     login_input = data.email  # 字段名还是email但可以是任意登录名
 
+    # 按账号和来源 IP 限流，被拒绝的尝试不做任何 bcrypt 计算
+    client_ip = request.client.host if request.client else "unknown"
+    retry_after = await login_throttle.check(login_input, client_ip)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many login attempts",
+            headers={"Retry-After": str(int(retry_after))},
+        )
+
     # 判断登录类型
     if '@' in login_input:
         # 邮箱登录
@@ -885,8 +1573,18 @@ async def login(
 
     user = result.fetchone()
 
-    if not user or not verify_password(data.password, user.password_hash):
+    try:
+        valid = user is not None and await password_hasher.verify(data.password, user.password_hash)
+    except HasherBusy:
+        raise password_busy_exception()
+    if not valid:
+        await login_throttle.record_failure(login_input)
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    await login_throttle.reset(login_input)
+
+    # cost 已调整或旧系统明文密码，后台重新哈希
+    if password_hasher.needs_rehash(user.password_hash):
+        asyncio.create_task(rehash_password(user.id, data.password, user.password_hash))
 
     # 创建访问令牌
     access_token = create_access_token(data={"sub": str(user.id)})
@@ -985,7 +1683,7 @@ async def list_tenants(
     return tenants
 
 @app.get("/api/v1/tenants/me")
-async def get_tenant_info(tenant: Tenant = Depends(get_tenant)):
+async def get_tenant_info(tenant: TenantSnapshot = Depends(get_tenant)):
     """获取当前租户信息（通过 API Key）"""
     return {
         "id": tenant.id,
@@ -1059,6 +1757,7 @@ async def update_webhook_url(
         {"url": webhook_url, "id": tenant_id}
     )
     await db.commit()
+    await tenant_cache.invalidate(tenant_id=tenant_id)
     return {"message": "Webhook URL updated"}
 
 @app.post("/api/v1/tenants/{tenant_id}/webhook-config")
@@ -1082,6 +1781,7 @@ async def update_webhook_config(
         {"url": config.webhook_url, "id": tenant_id}
     )
     await db.commit()
+    await tenant_cache.invalidate(tenant_id=tenant_id)
     return {"message": "Webhook URL updated"}
 
 @app.delete("/api/v1/tenants/{tenant_id}")
@@ -1103,6 +1803,7 @@ async def delete_tenant(
         {"id": tenant_id}
     )
     await db.commit()
+    await tenant_cache.invalidate(tenant_id=tenant_id)
     return {"message": "Tenant deleted"}
 
 class WeChatConfig(BaseModel):
@@ -1116,7 +1817,7 @@ class WeChatPushConfig(BaseModel):
     corp_secret: str = Field(..., description="企业微信应用密钥")
     push_target: str = Field(..., description="推送目标用户ID")
     agent_id: int = Field(..., description="应用ID")
-    push_devices: Optional[List[str]] = Field(None, description="推送设备列表，如 ['wechat', 'my_claw']")
+    push_devices: Optional[List[str]] = Field(None, description="推送设备列表，如 ['wechat', 'my_claw']，'*' 表示该用户的所有设备")
 
 @app.post("/api/v1/tenants/{tenant_id}/wechat-config")
 async def update_wechat_config(
@@ -1154,6 +1855,7 @@ async def update_wechat_config(
         }
     )
     await db.commit()
+    await tenant_cache.invalidate(tenant_id=tenant_id)
 
     # 构建回调URL
     result = await db.execute(
@@ -1229,6 +1931,7 @@ async def update_wechat_push_config(
         }
     )
     await db.commit()
+    await tenant_cache.invalidate(tenant_id=tenant_id)
 
     logger.info(f"[WeChatPush] 更新租户 {tenant_id} 的企业微信推送配置: target={config.push_target}, agent_id={config.agent_id}, devices={config.push_devices}")
 
@@ -1269,6 +1972,7 @@ async def delete_wechat_push_config(
         {"id": tenant_id}
     )
     await db.commit()
+    await tenant_cache.invalidate(tenant_id=tenant_id)
 
     logger.info(f"[WeChatPush] 删除租户 {tenant_id} 的企业微信推送配置")
 
@@ -1345,8 +2049,7 @@ async def add_openclaw_device(
     current_user: dict = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """添加 OpenClaw 设备并建立 WebSocket 连接"""
-    global openclaw_service
+    """添加 OpenClaw 设备并建立 WebSocket 连接（由持有设备租约的 worker 连接）"""
 
     # 验证租户属于当前用户
     result = await db.execute(
@@ -1363,18 +2066,6 @@ async def add_openclaw_device(
     # 创建设备唯一ID (tenant_id + device_id)
     unique_device_id = f"{tenant_id}:{config.device_id}"
 
-    # 添加到 OpenClaw 服务
-    if openclaw_service:
-        openclaw_service.add_device_with_forwarding(
-            device_id=unique_device_id,
-            name=config.name,
-            api_key=config.api_key,
-            ws_url=config.ws_url,
-            tenant_id=tenant_id,
-            user_id=current_user["id"],
-            webhook_url=forward_url
-        )
-
     # 保存到数据库
     await db.execute(
         text("""
@@ -1385,6 +2076,7 @@ async def add_openclaw_device(
                 ws_url = EXCLUDED.ws_url,
                 api_key = EXCLUDED.api_key,
                 webhook_url = EXCLUDED.webhook_url,
+                is_active = true,
                 updated_at = NOW()
         """),
         {
@@ -1399,6 +2091,13 @@ async def add_openclaw_device(
     )
     await db.commit()
 
+    # 登记到 OpenClaw 服务（持有租约的 worker 从数据库读取配置后连接，因此在提交之后）
+    if openclaw_coordinator:
+        await openclaw_coordinator.add(OpenClawSpec(
+            unique_device_id, config.name, config.api_key, config.ws_url,
+            tenant_id, current_user["id"], forward_url
+        ))
+
     return {
         "message": "OpenClaw 设备已添加",
         "device_id": config.device_id,
@@ -1415,7 +2114,6 @@ async def remove_openclaw_device(
     db: AsyncSession = Depends(get_db)
 ):
     """移除 OpenClaw 设备"""
-    global openclaw_service
 
     # 验证租户属于当前用户
     result = await db.execute(
@@ -1425,11 +2123,6 @@ async def remove_openclaw_device(
     if not result.fetchone():
         raise HTTPException(status_code=404, detail="Tenant not found")
 
-    # 从服务中移除
-    if openclaw_service:
-        unique_device_id = f"{tenant_id}:{device_id}"
-        openclaw_service.remove_device(unique_device_id)
-
     # 从数据库中删除（软删除）
     await db.execute(
         text("""
@@ -1441,6 +2134,10 @@ async def remove_openclaw_device(
     )
     await db.commit()
 
+    # 从服务中移除（持有该设备的 worker 断开连接）
+    if openclaw_coordinator:
+        await openclaw_coordinator.remove(f"{tenant_id}:{device_id}")
+
     return {"message": "OpenClaw 设备已移除", "device_id": device_id}
 
 
@@ -1469,13 +2166,14 @@ async def list_openclaw_devices(
         """),
         {"tenant_id": tenant_id}
     )
+    # 实时状态（所有 worker 共享的状态索引，一次读取）
+    statuses = await openclaw_coordinator.tenant_status(tenant_id) if openclaw_coordinator else {}
     devices = []
     for row in result.fetchall():
         unique_id = f"{tenant_id}:{row.device_id}"
-        # 获取实时状态
         status = {}
-        if openclaw_service:
-            status = openclaw_service.manager.get_device_status(unique_id) or {"connected": False}
+        if openclaw_coordinator:
+            status = statuses.get(unique_id) or {"connected": False}
 
         devices.append({
             "device_id": row.device_id,
@@ -1495,15 +2193,11 @@ async def get_openclaw_status(
     current_user: dict = Depends(get_current_user)
 ):
     """获取 OpenClaw 服务状态"""
-    if not openclaw_service:
+    if not openclaw_coordinator:
         return {"status": "not_initialized", "devices": {}}
 
-    # 获取当前用户的设备状态
-    all_status = openclaw_service.get_status()
-    user_devices = {
-        k: v for k, v in all_status.get("devices", {}).items()
-        if v.get("user_id") == current_user["id"]
-    }
+    # 当前用户的设备状态（按用户索引，不扫描全部设备）
+    user_devices = await openclaw_coordinator.user_status(current_user["id"])
 
     return {
         "status": "running",
@@ -1527,33 +2221,32 @@ async def ws_endpoint(
         1. 客户端连接: wss://webhook.sillymd.com/ws?token=xxx
         2. 服务端返回: {"type": "connected", "message": "..."}
         3. 客户端发送绑定: {"type": "bind", "device_name": "my_claw"}
+           重连时可带上最后收到的游标: {"type": "bind", "device_name": "my_claw", "resume_from": "1700000000000-0"}
         4. 服务端返回: {"type": "bound", "device_id": "user_id:device_name"}
+           带 resume_from 时，离线期间缓冲的推送按顺序补发
         5. 等待接收消息...
 
     消息推送:
         Webhook 接收时会根据目标设备 ID 精准推送:
-        {"type": "webhook", "target_device": "user_id:device_name", "data": {...}}
+        {"type": "webhook", "target_device": "user_id:device_name", "cursor": "...", "data": {...}}
 
     参数:
         token: JWT 认证 token (从登录接口获取)
     """
-    await websocket_endpoint(websocket, token)
+    await ws_hub.serve(websocket, websocket_endpoint, token)
 
 
 @app.get("/api/v1/ws/status")
 async def get_websocket_status(current_user: dict = Depends(get_current_user)):
-    """获取 WebSocket 连接状态"""
-    from ws_server import WebSocketManager
-    stats = WebSocketManager.get_stats()
-    # 过滤当前用户的设备
-    user_devices = {
-        k: v for k, v in stats.get("devices", {}).items()
-        if k.startswith(f"{current_user['id']}:")
-    }
+    """获取 WebSocket 连接状态（本进程持有的连接）"""
+    user_devices = ws_hub.user_devices(current_user["id"])
     return {
         "connected_devices": len(user_devices),
         "total_connections": sum(user_devices.values()),
-        "devices": user_devices
+        "devices": user_devices,
+        "drop_policy": ws_hub.drop_policy,
+        "queue_size": ws_hub.queue_size,
+        "queues": ws_hub.user_queues(current_user["id"])
     }
 
 
@@ -1565,16 +2258,11 @@ async def wechat_verify_url(
     msg_signature: str,
     timestamp: str,
     nonce: str,
-    echostr: str,
-    db: AsyncSession = Depends(get_db)
+    echostr: str
 ):
     """企业微信URL验证 - 解密echostr并返回"""
     # 查询租户
-    result = await db.execute(
-        text("SELECT * FROM tenants WHERE api_key = :key AND is_active = true"),
-        {"key": api_key}
-    )
-    row = result.fetchone()
+    row = await tenant_cache.get(api_key)
 
     if not row:
         raise HTTPException(status_code=404, detail="Tenant not found")
@@ -1588,19 +2276,15 @@ async def wechat_verify_url(
         from urllib.parse import unquote
         echostr_decoded = unquote(echostr.replace(' ', '+'))
 
-        # 调试日志
-        logger.info(f"[WeChat Verify] api_key={api_key}")
-        logger.info(f"[WeChat Verify] token={row.wechat_token}, corp_id={row.wechat_corp_id}")
-        logger.info(f"[WeChat Verify] signature={msg_signature}, timestamp={timestamp}, nonce={nonce}")
-        logger.info(f"[WeChat Verify] echostr_raw={echostr}")
-        logger.info(f"[WeChat Verify] echostr_decoded={echostr_decoded}")
+        # 调试日志（token 等密钥不写入日志）
+        wechat_logger.info("[WeChat Verify] api_key=%s, corp_id=%s", api_key, row.wechat_corp_id)
+        wechat_logger.debug(
+            "[WeChat Verify] signature=%s, timestamp=%s, nonce=%s, echostr_raw=%s, echostr_decoded=%s",
+            msg_signature, timestamp, nonce, echostr, echostr_decoded
+        )
 
         # 使用企业微信加密库验证并解密
-        crypto = WeChatCrypto(
-            token=row.wechat_token,
-            encoding_aes_key=row.wechat_aes_key,
-            corp_id=row.wechat_corp_id
-        )
+        crypto = wechat_crypto_cache.get(row.wechat_token, row.wechat_aes_key, row.wechat_corp_id)
 
         # 手动计算签名对比（企业微信URL验证：token+timestamp+nonce+echostr）
         import hashlib
@@ -1608,32 +2292,31 @@ async def wechat_verify_url(
         data.sort()
         concat_str = ''.join(data)
         expected_sig = hashlib.sha1(concat_str.encode()).hexdigest()
-        logger.info(f"[WeChat Verify] sorted_data={data}")
-        logger.info(f"[WeChat Verify] concat_str={concat_str}")
-        logger.info(f"[WeChat Verify] expected_sig={expected_sig}")
-        logger.info(f"[WeChat Verify] received_sig={msg_signature}")
-        logger.info(f"[WeChat Verify] match={expected_sig == msg_signature}")
+        wechat_logger.debug(
+            "[WeChat Verify] expected_sig=%s, received_sig=%s, match=%s",
+            expected_sig, msg_signature, expected_sig == msg_signature
+        )
 
         # 尝试解密（即使签名不匹配也尝试）
         try:
             decrypted = crypto._decrypt(echostr_decoded)
-            logger.info(f"[WeChat Verify] decrypted success: {decrypted}")
+            wechat_logger.debug("[WeChat Verify] decrypted success: %s", decrypted)
             # 确保返回纯明文，无BOM头，无换行符，无引号
             cleaned_response = decrypted.strip().replace('\n', '').replace('\r', '').replace('"', '')
-            logger.info(f"[WeChat Verify] returning: {cleaned_response}")
+            wechat_logger.debug("[WeChat Verify] returning: %s", cleaned_response)
             return Response(
                 content=cleaned_response,
                 media_type="text/plain; charset=utf-8"
             )
         except Exception as decrypt_err:
-            logger.error(f"[WeChat Verify] decrypt failed: {decrypt_err}")
+            wechat_logger.error("[WeChat Verify] decrypt failed: %s", decrypt_err)
             raise HTTPException(status_code=403, detail="Invalid signature")
 
     except ValueError as e:
-        logger.error(f"WeChat verification failed: {e}")
+        wechat_logger.error("WeChat verification failed: %s", e)
         raise HTTPException(status_code=403, detail="Invalid signature")
     except Exception as e:
-        logger.error(f"WeChat decryption error: {e}")
+        wechat_logger.error("WeChat decryption error: %s", e)
         raise HTTPException(status_code=500, detail="Decryption failed")
 
 
@@ -1644,45 +2327,114 @@ async def receive_wechat_webhook(
     msg_signature: Optional[str] = None,
     signature: Optional[str] = None,  # 兼容不同参数名
     timestamp: Optional[str] = None,
-    nonce: Optional[str] = None,
-    db: AsyncSession = Depends(get_db)
+    nonce: Optional[str] = None
 ):
     """接收企业微信加密消息并解密转发"""
     # 调试日志
     actual_sig = msg_signature or signature
-    logger.info(f"[WeChat POST] api_key={api_key}, msg_signature={msg_signature}, signature={signature}, timestamp={timestamp}, nonce={nonce}")
+    wechat_logger.debug(
+        "[WeChat POST] api_key=%s, msg_signature=%s, signature=%s, timestamp=%s, nonce=%s",
+        api_key, msg_signature, signature, timestamp, nonce
+    )
 
     # 参数校验
     if not actual_sig or not timestamp or not nonce:
-        logger.error(f"[WeChat POST] Missing params: sig={actual_sig}, ts={timestamp}, nonce={nonce}")
+        wechat_logger.error("[WeChat POST] Missing params: sig=%s, ts=%s, nonce=%s", actual_sig, timestamp, nonce)
         raise HTTPException(status_code=422, detail="Missing required parameters")
 
     # 查询租户
-    result = await db.execute(
-        text("SELECT * FROM tenants WHERE api_key = :key AND is_active = true"),
-        {"key": api_key}
-    )
-    row = result.fetchone()
+    tenant = await tenant_cache.get(api_key)
 
-    if not row:
+    if not tenant:
         raise HTTPException(status_code=404, detail="Tenant not found")
 
-    tenant = Tenant(
-        id=row.id, user_id=row.user_id, name=row.name, api_key=row.api_key,
-        webhook_url=row.webhook_url, secret_key=row.secret_key,
-        is_active=row.is_active, created_at=row.created_at,
-        request_count=row.request_count,
-        wechat_token=row.wechat_token,
-        wechat_aes_key=row.wechat_aes_key,
-        wechat_corp_id=row.wechat_corp_id,
-        wechat_corp_secret=row.wechat_corp_secret,
-        wechat_push_target=row.wechat_push_target,
-        wechat_agent_id=row.wechat_agent_id,
-        wechat_push_devices=row.wechat_push_devices
+    # 读取加密的消息体（加密 XML 体积很小，不落盘）
+    wechat_max = INGEST_CONFIG["wechat_max_body_bytes"]
+    try:
+        body = (await read_body(request, wechat_max, wechat_max)).data
+    except BodyTooLarge as e:
+        raise HTTPException(status_code=413, detail={"error": "Payload too large", "max_body_bytes": e.limit})
+
+    # 先同步校验签名（一次 SHA-1），签名不符的回调直接拒绝，不应答也不入队
+    decrypted_xml = None
+    verified = False
+    if tenant.wechat_token and tenant.wechat_aes_key and tenant.wechat_corp_id:
+        # 从XML中提取Encrypt字段
+        encrypted_msg = extract_fields(body, ("Encrypt",)).get("Encrypt")
+        if encrypted_msg is None or not verify_msg_signature(
+            tenant.wechat_token, timestamp, nonce, encrypted_msg, actual_sig
+        ):
+            wechat_logger.warning("[WeChat POST] 签名校验失败，拒绝回调: api_key=%s", api_key)
+            raise HTTPException(status_code=403, detail="Invalid signature")
+        try:
+            crypto = wechat_crypto_cache.get(tenant.wechat_token, tenant.wechat_aes_key, tenant.wechat_corp_id)
+            decrypted_xml = crypto.decrypt_msg(actual_sig, timestamp, nonce, encrypted_msg)
+            verified = True
+            wechat_logger.debug("WeChat message decrypted successfully")
+        except Exception as e:
+            wechat_logger.error("Failed to decrypt WeChat message: %s", e)
+            decrypted_xml = body.decode('utf-8', errors='replace')
+    else:
+        decrypted_xml = body.decode('utf-8', errors='replace')
+
+    try:
+        fields = extract_fields(decrypted_xml or "")
+    except WeChatMessageError as e:
+        wechat_logger.error("[WeChat] XML 解析失败: %s", e)
+        fields = None
+
+    headers = dict(request.headers)
+    source_ip = request.client.host if request.client else "unknown"
+
+    # 企业微信重试的回调直接应答，不再重复处理
+    dedup_corp = tenant.wechat_corp_id or tenant.id
+    dedup_key = message_key(fields) if fields else None
+    if dedup_key and not await wechat_dedup.first_seen(dedup_corp, dedup_key):
+        wechat_logger.info("[WeChat] 重复回调，直接应答: api_key=%s, msg=%s", api_key, dedup_key)
+        return wechat_ack()
+
+    # 快速应答：持久化入队后立即返回，其余处理由入站队列消费者完成；
+    # 只有验签并解密成功的消息入队，其余按同步流程处理
+    if WECHAT_CALLBACK_CONFIG["fast_ack"] and redis_conn is not None and verified:
+        try:
+            await enqueue_wechat_message(redis_conn, api_key, decrypted_xml or "", headers, source_ip, dedup_key)
+            return wechat_ack()
+        except Exception as e:
+            wechat_logger.error("[WeChat] 入站队列写入失败，改为同步处理: %s", e)
+
+    try:
+        await process_wechat_message(tenant, api_key, decrypted_xml, fields, headers, source_ip)
+    except Exception:
+        # 处理失败时撤销去重记录，让企业微信的重试能够重新处理
+        if dedup_key:
+            await wechat_dedup.forget(dedup_corp, dedup_key)
+        raise
+
+    return wechat_ack()
+
+
+def wechat_ack() -> Response:
+    """企业微信要求的响应格式"""
+    return Response(
+        content="<xml><ReturnCode>0</ReturnCode></xml>",
+        media_type="application/xml"
     )
 
-    # 检查用户等级限制
-    allowed, limit_info = await check_rate_limit(tenant.user_id)
+
+async def process_wechat_message(
+    tenant: TenantSnapshot,
+    api_key: str,
+    decrypted_xml: Optional[str],
+    fields: Optional[dict],
+    headers: dict,
+    source_ip: str
+):
+    """处理一条已解密的企微消息：配额计数、记录日志、WebSocket 推送、转发回调地址
+
+    同步模式下在请求内调用（超限抛出 429），快速应答模式下由入站队列消费者调用
+    """
+    # 检查用户等级限制并计入本次请求
+    allowed, limit_info = await consume_quota(tenant.user_id)
     if not allowed:
         raise HTTPException(
             status_code=429,
@@ -1696,35 +2448,6 @@ async def receive_wechat_webhook(
             }
         )
 
-    # 读取加密的消息体
-    body = await request.body()
-
-    # 解密消息
-    decrypted_xml = None
-    if tenant.wechat_token and tenant.wechat_aes_key and tenant.wechat_corp_id:
-        try:
-            crypto = WeChatCrypto(
-                token=tenant.wechat_token,
-                encoding_aes_key=tenant.wechat_aes_key,
-                corp_id=tenant.wechat_corp_id
-            )
-            # 从XML中提取Encrypt字段
-            import xml.etree.ElementTree as ET
-            root = ET.fromstring(body.decode('utf-8', errors='replace'))
-            encrypt_node = root.find('Encrypt')
-            if encrypt_node is not None:
-                encrypted_msg = encrypt_node.text
-                decrypted_xml = crypto.decrypt_msg(actual_sig, timestamp, nonce, encrypted_msg)
-                logger.info(f"WeChat message decrypted successfully")
-        except Exception as e:
-            logger.error(f"Failed to decrypt WeChat message: {e}")
-            decrypted_xml = body.decode('utf-8', errors='replace')
-    else:
-        decrypted_xml = body.decode('utf-8', errors='replace')
-
-    # 增加用户使用量
-    await increment_user_usage(tenant.user_id)
-
     # 异步检查是否需要发送使用量提醒
     if limit_info['limit'] is not None:
         current_used = limit_info['used'] + 1
@@ -1732,138 +2455,108 @@ async def receive_wechat_webhook(
             tenant.user_id, current_used, limit_info['limit'], limit_info['vendor_level']
         ))
 
-    headers = dict(request.headers)
     log_id = str(uuid.uuid4())
 
-    # 记录日志（存储解密后的内容）
-    await db.execute(
-        text("""
-            INSERT INTO webhook_logs
-            (id, tenant_id, user_id, source_ip, method, path, headers, body)
-            VALUES (:id, :tenant_id, :user_id, :ip, :method, :path, :headers, :body)
-        """),
-        {
-            "id": log_id,
-            "tenant_id": tenant.id,
-            "user_id": tenant.user_id,
-            "ip": request.client.host if request.client else "unknown",
-            "method": request.method,
-            "path": "/wechat/" + api_key,
-            "headers": json.dumps({k: v for k, v in headers.items() if k.lower() not in ["authorization", "cookie"]}),
-            "body": decrypted_xml[:10000] if decrypted_xml else None
-        }
-    )
-
-    await db.execute(
-        text("UPDATE tenants SET request_count = request_count + 1 WHERE id = :id"),
-        {"id": tenant.id}
-    )
-    await db.commit()
-
-    # 解析企微 XML 消息并通过 WebSocket 推送
-    try:
-        import xml.etree.ElementTree as ET
-        root = ET.fromstring(decrypted_xml)
-
-        # 提取关键信息
-        msg_type = root.find('MsgType')
-        from_user = root.find('FromUserName')
-        to_user = root.find('ToUserName')
-        content = root.find('Content')
-        create_time = root.find('CreateTime')
-
+    # 记录日志（解密后的内容完整存入负载存储，批量写入并合并租户请求计数）
+    payload = await prepare_payload(decrypted_xml.encode('utf-8')) if decrypted_xml else None
+    log_flushed = await log_writer.write({
+        "id": log_id,
+        "tenant_id": tenant.id,
+        "user_id": tenant.user_id,
+        "source_ip": source_ip,
+        "method": "POST",
+        "path": "/wechat/" + api_key,
+        "headers": json.dumps({k: v for k, v in headers.items() if k.lower() not in ["authorization", "cookie"]}),
+        "body_ref": payload.sha256 if payload else None,
+        "body_size": payload.size if payload else 0,
+        "payload": payload
+    })
+
+    # 通过 WebSocket 推送企微消息
+    if fields is not None:
         msg_data = {
             "type": "wechat_reply",
-            "msg_type": msg_type.text if msg_type is not None else "unknown",
-            "from_user": from_user.text if from_user is not None else "",
-            "to_user": to_user.text if to_user is not None else "",
-            "content": content.text if content is not None else "",
-            "create_time": create_time.text if create_time is not None else "",
+            "msg_type": fields.get("MsgType", "unknown"),
+            "from_user": fields.get("FromUserName", ""),
+            "to_user": fields.get("ToUserName", ""),
+            "content": fields.get("Content", ""),
+            "create_time": fields.get("CreateTime", ""),
+            "msg_id": fields.get("MsgId"),
             "timestamp": datetime.utcnow().isoformat()
         }
 
-        # 通过 WebSocket 推送企微回复消息
-        # 获取推送设备列表
-        push_devices = ["wechat"]  # 默认值
-        logger.info(f"[WeChat] DEBUG: tenant.wechat_push_devices = {tenant.wechat_push_devices}")
-        if tenant.wechat_push_devices:
-            try:
-                push_devices = json.loads(tenant.wechat_push_devices)
-                logger.info(f"[WeChat] DEBUG: parsed push_devices = {push_devices}")
-                if not isinstance(push_devices, list) or len(push_devices) == 0:
-                    push_devices = ["wechat"]
-            except Exception as e:
-                logger.error(f"[WeChat] DEBUG: json.loads failed: {e}")
-                push_devices = ["wechat"]
-        logger.info(f"[WeChat] DEBUG: final push_devices = {push_devices}")
+        # 获取推送设备列表（快照加载时已解析，默认 ["wechat"]）
+        push_devices = tenant.push_devices
+        wechat_logger.debug("[WeChat] push_devices = %s", push_devices)
 
-        # 推送到所有指定设备
-        for device_name in push_devices:
-            try:
-                await notify_by_target(
-                    target_user_id=tenant.user_id,
-                    target_device_name=device_name,
-                    message=msg_data
-                )
-                logger.info(f"[WeChat] 企微回复已推送到设备: user_id={tenant.user_id}, device={device_name}, from_user={msg_data.get('from_user')}, msg_type={msg_data.get('msg_type')}")
-            except Exception as e:
-                logger.error(f"[WeChat] 推送到设备失败: device={device_name}, error={e}")
-    except ET.ParseError as e:
-        logger.error(f"[WeChat] XML 解析失败: {e}")
-    except Exception as e:
-        logger.error(f"[WeChat] WebSocket 推送失败: {e}")
+        # 推送到所有指定设备（消息只序列化一次，各设备并发发送）
+        try:
+            delivered = await ws_hub.fanout(tenant.user_id, push_devices, msg_data, wrap=False)
+            wechat_logger.debug(
+                "[WeChat] 企微回复已推送: user_id=%s, devices=%s, local_connections=%d, from_user=%s, msg_type=%s",
+                tenant.user_id, push_devices, delivered, msg_data["from_user"], msg_data["msg_type"]
+            )
+        except Exception as e:
+            wechat_logger.error("[WeChat] 推送到设备失败: devices=%s, error=%s", push_devices, e)
 
     # 转发解密后的消息到用户回调地址
     if tenant.webhook_url:
-        logger.info(f"[WeChat] Forwarding decrypted message to: {tenant.webhook_url[:50]}...")
+        wechat_logger.debug("[WeChat] Forwarding decrypted message to: %.50s...", tenant.webhook_url)
         body_bytes = decrypted_xml.encode('utf-8') if decrypted_xml else b""
-        asyncio.create_task(process_webhook_retry(
-            log_id, tenant.id, tenant.webhook_url, headers, body_bytes, tenant.secret_key
-        ))
+        await dispatch_delivery(
+            log_id, tenant.id, tenant.webhook_url, headers, body_bytes, tenant.secret_key,
+            log_flushed=log_flushed, body_ref=payload.sha256 if payload else None
+        )
 
-    # 返回企业微信要求的响应格式
-    return Response(
-        content="<xml><ReturnCode>0</ReturnCode></xml>",
-        media_type="application/xml"
-    )
+
+async def handle_wechat_inbound(job: dict):
+    """入站队列消费者：处理快速应答模式下已入队的企微消息"""
+    tenant = await tenant_cache.get(job["api_key"])
+    if not tenant:
+        wechat_logger.warning("[WeChat] 入站消息的租户已不存在，丢弃: api_key=%s", job["api_key"])
+        return
+    try:
+        fields = extract_fields(job["xml"])
+    except WeChatMessageError:
+        fields = None
+    try:
+        await process_wechat_message(
+            tenant, job["api_key"], job["xml"] or None, fields, job["headers"], job["source_ip"]
+        )
+    except HTTPException as e:
+        # 已向企业微信应答，超限消息只记录不再处理
+        wechat_logger.warning("[WeChat] 入站消息未处理: api_key=%s, status=%s", job["api_key"], e.status_code)
 
 
 @app.post("/webhook/{tenant_path:path}", response_model=WebhookResponse)
 async def receive_webhook(
     request: Request,
-    tenant_path: str,
-    db: AsyncSession = Depends(get_db)
+    tenant_path: str
 ):
     """接收 Webhook 请求"""
     parts = tenant_path.split("/", 1)
     api_key = parts[0]
     sub_path = "/" + parts[1] if len(parts) > 1 else "/"
 
-    result = await db.execute(
-        text("SELECT * FROM tenants WHERE api_key = :key AND is_active = true"),
-        {"key": api_key}
-    )
-    row = result.fetchone()
+    tenant = await tenant_cache.get(api_key)
 
-    if not row:
+    if not tenant:
         raise HTTPException(status_code=404, detail="Tenant not found")
 
-    tenant = Tenant(
-        id=row.id, user_id=row.user_id, name=row.name, api_key=row.api_key,
-        webhook_url=row.webhook_url, secret_key=row.secret_key,
-        is_active=row.is_active, created_at=row.created_at,
-        request_count=row.request_count,
-        wechat_token=row.wechat_token,
-        wechat_aes_key=row.wechat_aes_key,
-        wechat_corp_id=row.wechat_corp_id,
-        wechat_corp_secret=row.wechat_corp_secret,
-        wechat_push_target=row.wechat_push_target,
-        wechat_agent_id=row.wechat_agent_id,
-        wechat_push_devices=row.wechat_push_devices
-    )
+    # 流式读取请求体：超过上限尽早返回 413，大请求体落盘
+    max_body_bytes = INGEST_CONFIG["max_body_bytes"]
+    if tenant.max_body_bytes:
+        max_body_bytes = min(max_body_bytes, tenant.max_body_bytes)
+    try:
+        body = await read_body(request, max_body_bytes, INGEST_CONFIG["spool_threshold"])
+    except BodyTooLarge as e:
+        raise HTTPException(
+            status_code=413,
+            detail={"error": "Payload too large", "max_body_bytes": e.limit}
+        )
 
-    # 检查用户等级限制
-    allowed, limit_info = await check_rate_limit(tenant.user_id)
+    # 请求体读取成功后再检查用户等级限制并计入本次请求（413 或读取失败不消耗配额）
+    allowed, limit_info = await consume_quota(tenant.user_id)
     if not allowed:
         raise HTTPException(
             status_code=429,
@@ -1877,11 +2570,9 @@ async def receive_webhook(
             }
         )
 
-    body = await request.body()
     headers = dict(request.headers)
-
-    # 增加用户使用量
-    await increment_user_usage(tenant.user_id)
+    # 请求头序列化、请求体解码/解析都在信封中按需进行且只做一次
+    envelope = WebhookEnvelope(body, headers)
 
     # 异步检查是否需要发送使用量提醒
     if limit_info['limit'] is not None:
@@ -1891,39 +2582,33 @@ async def receive_webhook(
         ))
 
     log_id = str(uuid.uuid4())
-    await db.execute(
-        text("""
-            INSERT INTO webhook_logs
-            (id, tenant_id, user_id, source_ip, method, path, headers, body)
-            VALUES (:id, :tenant_id, :user_id, :ip, :method, :path, :headers, :body)
-        """),
-        {
-            "id": log_id,
-            "tenant_id": tenant.id,
-            "user_id": tenant.user_id,
-            "ip": request.client.host if request.client else "unknown",
-            "method": request.method,
-            "path": sub_path,
-            "headers": json.dumps({k: v for k, v in headers.items() if k.lower() not in ["authorization", "cookie"]}),
-            "body": body.decode('utf-8', errors='replace')[:10000] if body else None
-        }
-    )
-
-    await db.execute(
-        text("UPDATE tenants SET request_count = request_count + 1 WHERE id = :id"),
-        {"id": tenant.id}
+    # 日志、路由、转发共用同一份缓冲区（摘要在读取时已计算）
+    payload = await prepare_payload(body.view(), body.sha256) if body else None
+    log_flushed = await log_writer.write({
+        "id": log_id,
+        "tenant_id": tenant.id,
+        "user_id": tenant.user_id,
+        "source_ip": request.client.host if request.client else "unknown",
+        "method": request.method,
+        "path": sub_path,
+        "headers": envelope.headers_json,
+        "body_ref": payload.sha256 if payload else None,
+        "body_size": payload.size if payload else 0,
+        "payload": payload
+    })
+
+    ingest_logger.info(
+        "[Receive] log_id=%s tenant=%s size=%d", log_id, tenant.id, body.size,
+        extra={"log_id": log_id, "tenant_id": tenant.id, "body_size": body.size, "spooled": body.spooled}
     )
-    await db.commit()
-
-    logger.info(f"[Receive] tenant.webhook_url={tenant.webhook_url is not None}, creating forward task")
 
     # 构建 Webhook 数据
     webhook_data = {
         "log_id": log_id,
         "method": request.method,
         "path": sub_path,
-        "headers": {k: v for k, v in headers.items() if k.lower() not in ["authorization", "cookie"]},
-        "body": body.decode('utf-8', errors='replace')[:10000] if body else None,
+        "headers": envelope.headers,
+        "body": envelope.preview,
         "source_ip": request.client.host if request.client else "unknown",
         "timestamp": datetime.utcnow().isoformat(),
         "tenant_id": tenant.id,
@@ -1943,58 +2628,48 @@ async def receive_webhook(
     path_parts = sub_path.strip('/').split('/')
     if len(path_parts) >= 1 and path_parts[0]:
         target_device = path_parts[0]
-        logger.info(f"[Receive] 从路径解析目标设备: {target_device}")
+        ingest_logger.debug("[Receive] 从路径解析目标设备: %s", target_device)
 
-    # 方式2: 从请求体解析 (JSON 中的 target_device 字段)
-    if body:
-        try:
-            body_json = json.loads(body.decode('utf-8', errors='replace'))
-            if isinstance(body_json, dict) and body_json.get("target_device"):
-                target_device = body_json.get("target_device")
-                logger.info(f"[Receive] 从请求体解析目标设备: {target_device}")
-        except json.JSONDecodeError:
-            pass
+    # 方式3 优先级最高，已指定时无需解析请求体
+    target_from_header = headers.get("x-target-device") or headers.get("X-Target-Device")
+
+    # 方式2: 从请求体解析 (JSON 顶层的 target_device 字段，大请求体只做浅扫描)
+    if body and not target_from_header:
+        routing = await envelope.routing_fields("target_device")
+        if routing.get("target_device"):
+            target_device = routing["target_device"]
+            ingest_logger.debug("[Receive] 从请求体解析目标设备: %s", target_device)
 
     # 方式3: 从 Header 解析
-    target_from_header = headers.get("x-target-device") or headers.get("X-Target-Device")
     if target_from_header:
         target_device = target_from_header
-        logger.info(f"[Receive] 从Header解析目标设备: {target_device}")
+        ingest_logger.debug("[Receive] 从Header解析目标设备: %s", target_device)
 
     # 如果找到了目标设备，进行精准推送
     if target_device:
-        from ws_server import notify_by_target
-        asyncio.create_task(notify_by_target(
-            target_user_id=tenant.user_id,
-            target_device_name=target_device,
-            message=webhook_data
-        ))
-        logger.info(f"[Receive] WebSocket 精准推送: user_id={tenant.user_id}, device={target_device}")
+        asyncio.create_task(ws_hub.notify(tenant.user_id, target_device, webhook_data))
+        ingest_logger.debug("[Receive] WebSocket 精准推送: user_id=%s, device=%s", tenant.user_id, target_device)
     else:
-        logger.info(f"[Receive] 未指定目标设备，跳过 WebSocket 推送")
+        ingest_logger.debug("[Receive] 未指定目标设备，跳过 WebSocket 推送")
 
     # 推送消息：优先使用企业微信自建应用，否则使用 webhook_url 转发
     # 检查是否配置了企业微信自建应用推送
     if (tenant.wechat_corp_id and tenant.wechat_corp_secret and
         tenant.wechat_push_target and tenant.wechat_agent_id):
 
-        logger.info(f"[Receive] 使用企业微信自建应用推送: user_id={tenant.wechat_push_target}")
-        asyncio.create_task(push_to_wechat_app(
-            corp_id=tenant.wechat_corp_id,
-            corp_secret=tenant.wechat_corp_secret,
-            agent_id=tenant.wechat_agent_id,
-            push_target=tenant.wechat_push_target,
-            webhook_data=webhook_data
-        ))
+        ingest_logger.debug("[Receive] 使用企业微信自建应用推送: user_id=%s", tenant.wechat_push_target)
+        # 进入推送队列，由调度器按应用限速并合并发送
+        await wechat_push_scheduler.enqueue(tenant.id, webhook_data)
 
     elif tenant.webhook_url:
         # 回退到 webhook_url 转发
-        logger.info(f"[Receive] Creating forward task to: {tenant.webhook_url[:50]}...")
-        asyncio.create_task(process_webhook_retry(
-            log_id, tenant.id, tenant.webhook_url, headers, body, tenant.secret_key
-        ))
+        ingest_logger.debug("[Receive] Creating forward task to: %.50s...", tenant.webhook_url)
+        await dispatch_delivery(
+            log_id, tenant.id, tenant.webhook_url, headers, body.view(), tenant.secret_key,
+            log_flushed=log_flushed, body_ref=payload.sha256 if payload else None
+        )
     else:
-        logger.warning("[Receive] 未配置企业微信推送或 webhook_url，跳过消息转发")
+        ingest_logger.debug("[Receive] 未配置企业微信推送或 webhook_url，跳过消息转发")
 
     # 构建响应消息
     message = "Webhook received and queued for delivery"
@@ -2087,13 +2762,25 @@ async def get_webhook_detail(
     if not row:
         raise HTTPException(status_code=404, detail="Webhook not found")
 
+    # 新记录的负载在 webhook_payloads 中，较小的文本负载直接内联返回，其余通过 body 接口读取
+    body = row.body
+    if row.body_ref and (row.body_size or 0) <= WEBHOOK_DETAIL_INLINE_BODY:
+        raw = await load_payload(db, row.body_ref)
+        try:
+            body = raw.decode('utf-8') if raw is not None else None
+        except UnicodeDecodeError:
+            body = None
+
     return {
         "id": row.id,
         "source_ip": row.source_ip,
         "method": row.method,
         "path": row.path,
         "headers": json.loads(row.headers) if row.headers else {},
-        "body": row.body,
+        "body": body,
+        "body_size": row.body_size,
+        "body_sha256": row.body_ref,
+        "body_url": f"/api/v1/webhooks/{row.id}/body" if row.body_ref else None,
         "status_code": row.status_code,
         "response_body": row.response_body,
         "retry_count": row.retry_count,
@@ -2102,12 +2789,74 @@ async def get_webhook_detail(
         "error_message": row.error_message
     }
 
+@app.get("/api/v1/webhooks/{webhook_id}/body")
+async def get_webhook_body(
+    webhook_id: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """读取 Webhook 原始负载（原样字节，支持单段 HTTP Range）"""
+    result = await db.execute(
+        text("""
+            SELECT w.body, w.body_ref, w.headers FROM webhook_logs w
+            WHERE w.id = :id AND w.user_id = :user_id
+        """),
+        {"id": webhook_id, "user_id": current_user["id"]}
+    )
+    row = result.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Webhook not found")
+
+    if row.body_ref:
+        # 分段读取时后续 Range 请求命中缓存，不再重新解压整个负载
+        data = await payload_cache.load(db, row.body_ref)
+        if data is None:
+            raise HTTPException(status_code=404, detail="Payload not found")
+    else:
+        data = row.body.encode('utf-8') if row.body else b""
+
+    headers = json.loads(row.headers) if row.headers else {}
+    media_type = headers.get("content-type") or "application/octet-stream"
+    size = len(data)
+
+    # 无法解析的 Range 按 RFC 9110 忽略（返回完整内容），格式正确但不可满足时返回 416
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+
+    start, end = byte_range if byte_range else (0, size - 1)
+    view = memoryview(data)[start:end + 1]
+
+    def iter_chunks(chunk_size: int = 64 * 1024):
+        for offset in range(0, len(view), chunk_size):
+            yield bytes(view[offset:offset + chunk_size])
+
+    response_headers = {"Accept-Ranges": "bytes", "Content-Length": str(len(view))}
+    if byte_range:
+        response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(
+        iter_chunks(),
+        status_code=206 if byte_range else 200,
+        media_type=media_type,
+        headers=response_headers
+    )
+
 @app.get("/api/v1/user/usage")
 async def get_user_usage(current_user: dict = Depends(get_current_user)):
     """获取用户当前使用量和限制信息"""
-    vendor_level = await get_user_vendor_level(current_user["id"])
+    if usage_quota:
+        vendor_level = await usage_quota.get_vendor_level(current_user["id"])
+        used = await usage_quota.get_used(current_user["id"])
+    else:
+        vendor_level = await get_user_vendor_level(current_user["id"])
+        used = await get_user_monthly_usage(current_user["id"])
     limit = VENDOR_LEVEL_LIMITS.get(vendor_level, DEFAULT_LIMIT)
-    used = await get_user_monthly_usage(current_user["id"])
 
     reset_date = (datetime.utcnow().replace(day=1) + timedelta(days=32)).replace(day=1)
 
@@ -2148,11 +2897,28 @@ async def retry_webhook(
         raise HTTPException(status_code=400, detail="No webhook URL configured")
 
     headers = json.loads(row.headers) if row.headers else {}
-    body = row.body.encode() if row.body else b""
+    body = None
+    if row.body_ref:
+        body = await load_payload(db, row.body_ref)
+    body_ref = row.body_ref if body is not None else None
+    if body is None:
+        # 旧记录只有截断后的文本
+        body = row.body.encode() if row.body else b""
+
+    # 手动重试取代已排期的自动重试
+    await db.execute(
+        text("""
+            UPDATE webhook_logs SET delivery_status = :status, next_attempt_at = NULL
+            WHERE id = :id
+        """),
+        {"id": webhook_id, "status": STATUS_PENDING}
+    )
+    await db.commit()
 
-    asyncio.create_task(process_webhook_retry(
-        webhook_id, row.tenant_id, row.webhook_url, headers, body, row.secret_key
-    ))
+    await dispatch_delivery(
+        webhook_id, row.tenant_id, row.webhook_url, headers, body, row.secret_key,
+        body_ref=body_ref
+    )
 
     return {"message": "Retry initiated"}
 
@@ -3770,6 +4536,92 @@ curl -X POST https://webhook.sillymd.com/webhook/{api_key} \
 </html>
     """
 
+@app.get("/api/v1/deliveries/destinations")
+async def get_delivery_destinations(
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """获取当前用户回调地址所在主机的熔断与并发状态（汇总所有投递进程）"""
+    result = await db.execute(
+        text("""
+            SELECT DISTINCT webhook_url FROM tenants
+            WHERE user_id = :user_id AND is_active = true AND webhook_url IS NOT NULL
+        """),
+        {"user_id": current_user["id"]}
+    )
+    hosts = {destination_host(row.webhook_url) for row in result.fetchall()}
+
+    workers = {"local": destination_health.snapshot()}
+    if redis_conn:
+        workers.update(await collect_health(redis_conn))
+
+    destinations = {host: {} for host in hosts}
+    for worker_id, snapshot in workers.items():
+        for host, state in snapshot.items():
+            if host in destinations:
+                destinations[host][worker_id] = state
+
+    return {"destinations": destinations}
+
+# 运行指标
+@app.get("/api/v1/system/stats")
+async def get_system_stats(current_user: dict = Depends(get_current_user)):
+    """获取接收链路各组件的运行指标（缓存命中、日志写入队列等，仅员工账户）"""
+    if await get_user_vendor_level(current_user["id"]) != "staff":
+        raise HTTPException(status_code=403, detail="Permission denied")
+    return {
+        "tenant_cache": tenant_cache.get_stats(),
+        "principal_cache": principal_cache.get_stats(),
+        "password_hasher": password_hasher.get_stats(),
+        "login_throttle": login_throttle.get_stats(),
+        "wechat_crypto_cache": wechat_crypto_cache.get_stats(),
+        "wechat_dedup": wechat_dedup.get_stats(),
+        "wechat_tokens": wechat_tokens.get_stats(),
+        "wechat_push": wechat_push_scheduler.get_stats(),
+        "wechat_inbound": wechat_inbound_consumer.get_stats() if wechat_inbound_consumer else None,
+        "websocket": ws_hub.get_stats(),
+        "openclaw": openclaw_coordinator.get_stats() if openclaw_coordinator else None,
+        "usage_quota": usage_quota.get_stats() if usage_quota else None,
+        "log_writer": log_writer.get_stats(),
+        "payload_cache": payload_cache.get_stats(),
+        "delivery_client": delivery_client.get_stats() if delivery_client else None,
+        "retry_scheduler": retry_scheduler.get_stats() if retry_scheduler else None,
+        "payload_gc": payload_collector.get_stats() if payload_collector else None,
+    }
+
+class LoggingUpdate(BaseModel):
+    levels: Optional[Dict[str, str]] = Field(None, description="logger 名称 -> 级别，root 表示根 logger")
+    sample_every: Optional[int] = Field(None, description="DEBUG 日志每 N 条保留 1 条")
+    max_debug_per_second: Optional[int] = Field(None, description="DEBUG 日志每秒上限，0 不限")
+    json_format: Optional[bool] = None
+
+# 日志配置（运行时调整，仅对当前进程生效）
+@app.get("/api/v1/system/logging")
+async def get_logging_config(current_user: dict = Depends(get_current_user)):
+    """当前日志级别与采样配置（仅员工账户）"""
+    if await get_user_vendor_level(current_user["id"]) != "staff":
+        raise HTTPException(status_code=403, detail="Permission denied")
+    return logging_manager.get_config()
+
+@app.put("/api/v1/system/logging")
+async def update_logging_config(
+    config: LoggingUpdate,
+    current_user: dict = Depends(get_current_user)
+):
+    """调整日志级别与采样（仅员工账户）"""
+    if await get_user_vendor_level(current_user["id"]) != "staff":
+        raise HTTPException(status_code=403, detail="Permission denied")
+    try:
+        for category, level in (config.levels or {}).items():
+            logging_manager.set_level(category, level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logging_manager.set_sampling(config.sample_every, config.max_debug_per_second)
+    if config.json_format is not None:
+        logging_manager.set_json_format(config.json_format)
+    logger.info("[Logging] 日志配置已更新: user_id=%s, %s", current_user["id"], config.dict(exclude_none=True))
+    return logging_manager.get_config()
+
 # 健康检查
 @app.get("/health")
 async def health_check():
@@ -3777,4 +4629,5 @@ async def health_check():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=9001)
+    # 传输层 ping/pong 检测未声明应用层 ping 的 WebSocket 连接
+    uvicorn.run(app, host="0.0.0.0", port=9001, ws_ping_interval=20.0, ws_ping_timeout=20.0)
@@ -0,0 +1,129 @@
+"""
+Webhook 投递 Worker - 独立进程消费 Redis 投递队列
+与 API 进程（webhook_main）分离部署，可按投递量单独扩容
+
+用法:
+    python webhook_worker.py                # 单进程
+    python webhook_worker.py --processes 4  # 4 个进程，每个进程一个消费者
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+
+import redis.asyncio as redis
+
+import webhook_main
+from blob_store import PayloadCollector
+from delivery_client import DeliveryClient
+from delivery_queue import DeliveryConsumer, enqueue_delivery
+from retry_scheduler import RetryScheduler
+
+logger = logging.getLogger("webhook_worker")
+
+# 单个进程内同时进行的投递数
+WORKER_CONCURRENCY = 100
+
+
+async def handle_delivery(job: dict):
+    """执行一次投递（失败重试与结果记录由 process_webhook_retry 负责）"""
+    await webhook_main.process_webhook_retry(
+        job["log_id"],
+        job["tenant_id"],
+        job["webhook_url"],
+        job["headers"],
+        job["body"],
+        job["secret_key"],
+        retry_count=job["retry_count"],
+        body_ref=job["body_ref"]
+    )
+
+
+async def run_worker(consumer_name: str, concurrency: int):
+    redis_conn = redis.from_url(webhook_main.REDIS_URL, **webhook_main.REDIS_CONFIG)
+    await redis_conn.ping()
+
+    # 复用 API 进程的投递实现，进程内共享一个连接池
+    webhook_main.redis_conn = redis_conn
+    webhook_main.delivery_client = DeliveryClient(**webhook_main.DELIVERY_CLIENT_CONFIG)
+    await webhook_main.delivery_client.start()
+
+    consumer = DeliveryConsumer(redis_conn, consumer_name, handle_delivery, concurrency=concurrency)
+
+    # 到期重试重新进入投递队列（多进程通过 SKIP LOCKED 分摊领取）
+    async def dispatch_retry(job: dict):
+        await enqueue_delivery(redis_conn, **job)
+
+    scheduler = RetryScheduler(
+        webhook_main.async_session, dispatch_retry, **webhook_main.RETRY_SCHEDULER_CONFIG
+    )
+    await scheduler.start()
+
+    # 清理不再被 webhook_logs 引用的负载（多进程通过 advisory lock 同一时刻只有一个执行）
+    collector = PayloadCollector(webhook_main.async_session, **webhook_main.PAYLOAD_GC_CONFIG)
+    await collector.start()
+
+    # 上报本进程的目标主机熔断状态
+    await webhook_main.destination_health.start_publishing(redis_conn, consumer_name)
+
+    loop = asyncio.get_running_loop()
+    run_task = asyncio.create_task(consumer.run())
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, run_task.cancel)
+        except NotImplementedError:
+            pass  # Windows
+
+    logger.info(f"[Worker] {consumer_name} 已启动，并发={concurrency}")
+    try:
+        await run_task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await webhook_main.destination_health.stop_publishing()
+        await scheduler.stop()
+        await collector.stop()
+        await consumer.stop()
+        await webhook_main.delivery_client.close()
+        await redis_conn.close()
+        await webhook_main.engine.dispose()
+        logger.info(f"[Worker] {consumer_name} 已停止: {consumer.get_stats()}, {scheduler.get_stats()}")
+
+
+def worker_process(index: int, concurrency: int):
+    consumer_name = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    asyncio.run(run_worker(consumer_name, concurrency))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook Hub 投递 Worker")
+    parser.add_argument("--processes", type=int, default=1, help="worker 进程数")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="每个进程的并发投递数")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        worker_process(0, args.concurrency)
+        return
+
+    processes = [
+        multiprocessing.Process(target=worker_process, args=(i, args.concurrency), daemon=False)
+        for i in range(args.processes)
+    ]
+    for p in processes:
+        p.start()
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        for p in processes:
+            p.terminate()
+        for p in processes:
+            p.join()
+
+
+if __name__ == "__main__":
+    main()
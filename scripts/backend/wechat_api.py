@@ -0,0 +1,289 @@
+"""
+企业微信自建应用 API 客户端
+access_token 按 (corp_id, corp_secret) 管理：
+- 进程内缓存 + Redis 共享，所有 worker 共用同一个 token
+- 距过期不足 refresh_margin 秒时继续返回旧 token，并在后台提前刷新；每个 token 只提前刷新一次
+  （企业微信在有效期内重复 gettoken 返回同一 token 和剩余有效期，之后只在真正过期时刷新）
+- 单飞加载：同一进程内并发请求只触发一次 gettoken，跨进程用 Redis 锁避免同时刷新
+- 接口返回 40014 / 42001（token 不合法 / 已过期）时作废 token 并重试一次
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+WECHAT_API_BASE = "https://qyapi.weixin.qq.com/cgi-bin"
+TOKEN_KEY_PREFIX = "wechat:token:"
+
+# access_token 不合法 / 已过期
+TOKEN_ERRCODES = frozenset((40014, 42001))
+
+# 文本消息内容上限（字节）
+TEXT_CONTENT_MAX_BYTES = 2048
+
+
+class WeChatAPIError(Exception):
+    def __init__(self, errcode: int, errmsg: str):
+        super().__init__(f"errcode={errcode}, errmsg={errmsg}")
+        self.errcode = errcode
+        self.errmsg = errmsg
+
+
+def truncate_utf8(text: str, max_bytes: int) -> str:
+    """按 UTF-8 字节数截断，不截断半个字符"""
+    data = text.encode("utf-8")
+    if len(data) <= max_bytes:
+        return text
+    return data[:max_bytes].decode("utf-8", errors="ignore")
+
+
+class WeChatTokenManager:
+    """企业微信 access_token 管理与 API 调用"""
+
+    def __init__(self, refresh_margin: float = 300.0, lock_ttl: int = 10, request_timeout: float = 10.0):
+        self._refresh_margin = refresh_margin
+        self._lock_ttl = lock_ttl
+        self._request_timeout = request_timeout
+        self._redis = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        # (corp_id, secret 摘要) -> (token, 过期时间戳)
+        self._tokens: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        # 已提前刷新过的 token，不再为其发起提前刷新
+        self._refreshed_ahead: Dict[Tuple[str, str], str] = {}
+        self._refresh_tasks: set = set()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.fetch_errors = 0
+        self.refresh_ahead = 0
+        self.invalidations = 0
+
+    async def start(self, redis_conn=None):
+        self._redis = redis_conn
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self._request_timeout))
+
+    async def close(self):
+        for task in list(self._refresh_tasks):
+            task.cancel()
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("WeChatTokenManager is not started")
+        return self._session
+
+    @staticmethod
+    def _key(corp_id: str, corp_secret: str) -> Tuple[str, str]:
+        # Redis 键中不出现明文 secret
+        return corp_id, hashlib.sha256(corp_secret.encode()).hexdigest()[:16]
+
+    @staticmethod
+    def _redis_key(key: Tuple[str, str]) -> str:
+        return f"{TOKEN_KEY_PREFIX}{key[0]}:{key[1]}"
+
+    # ======== access_token ========
+
+    async def get_token(self, corp_id: str, corp_secret: str) -> str:
+        key = self._key(corp_id, corp_secret)
+        now = time.time()
+
+        cached = self._tokens.get(key)
+        if cached is not None and now < cached[1]:
+            self.local_hits += 1
+            if now >= cached[1] - self._refresh_margin and self._refreshed_ahead.get(key) != cached[0]:
+                self._refresh_in_background(key, cached[0], corp_id, corp_secret)
+            return cached[0]
+
+        self.misses += 1
+        token, _ = await self._load(key, corp_id, corp_secret)
+        return token
+
+    def _refresh_in_background(self, key, token: str, corp_id: str, corp_secret: str):
+        if key in self._inflight:
+            return
+        self._refreshed_ahead[key] = token
+        self.refresh_ahead += 1
+        task = asyncio.create_task(self._load(key, corp_id, corp_secret, refresh=True))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_done)
+
+    def _refresh_done(self, task: asyncio.Task):
+        self._refresh_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"[WeChatToken] 提前刷新 access_token 失败: {task.exception()}")
+
+    async def _load(self, key, corp_id: str, corp_secret: str, refresh: bool = False) -> Tuple[str, float]:
+        """单飞加载：同一 key 的并发调用共享一次加载（refresh 为提前刷新）"""
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            entry = await self._load_shared(key, corp_id, corp_secret, refresh)
+            self._tokens[key] = entry
+            if time.time() >= entry[1] - self._refresh_margin:
+                # 取到的已是刷新窗口内的 token，再提前刷新也只会拿到同一个
+                self._refreshed_ahead[key] = entry[0]
+            future.set_result(entry)
+            return entry
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _load_shared(self, key, corp_id: str, corp_secret: str, refresh: bool) -> Tuple[str, float]:
+        """优先使用其他进程已写入 Redis 的 token，否则持锁调用 gettoken"""
+        if self._redis is None:
+            return await self._fetch(corp_id, corp_secret)
+
+        redis_key = self._redis_key(key)
+        lock_key = redis_key + ":lock"
+        try:
+            entry = await self._read_shared(redis_key, refresh)
+            if entry is not None:
+                self.redis_hits += 1
+                return entry
+            locked = await self._redis.set(lock_key, b"1", nx=True, ex=self._lock_ttl)
+        except Exception as e:
+            logger.warning(f"[WeChatToken] Redis 不可用，直接获取 access_token: {e}")
+            return await self._fetch(corp_id, corp_secret)
+        if not locked:
+            # 其他进程正在刷新，等待其写入结果；超时后自行获取
+            deadline = time.monotonic() + self._lock_ttl
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.2)
+                entry = await self._read_shared(redis_key, refresh)
+                if entry is not None:
+                    self.redis_hits += 1
+                    return entry
+
+        try:
+            token, expires_at = await self._fetch(corp_id, corp_secret)
+        except Exception:
+            if locked:
+                await self._redis.delete(lock_key)
+            raise
+        try:
+            await self._redis.set(
+                redis_key,
+                json.dumps({"token": token, "expires_at": expires_at, "fetched_at": time.time()}),
+                ex=max(1, int(expires_at - time.time()))
+            )
+            if locked:
+                await self._redis.delete(lock_key)
+        except Exception as e:
+            # 锁会自动过期，其他进程稍后自行获取
+            logger.warning(f"[WeChatToken] 写入共享 access_token 失败: {e}")
+        return token, expires_at
+
+    async def _read_shared(self, redis_key: str, refresh: bool) -> Optional[Tuple[str, float]]:
+        """读取 Redis 中未过期的 token
+
+        提前刷新时只接受尚未进入刷新窗口、或已在窗口内重新获取过的 token，
+        避免各进程对同一 token 重复调用 gettoken
+        """
+        raw = await self._redis.get(redis_key)
+        if not raw:
+            return None
+        data = json.loads(raw)
+        now = time.time()
+        expires_at = data["expires_at"]
+        if now >= expires_at:
+            return None
+        if refresh:
+            window_start = expires_at - self._refresh_margin
+            if now >= window_start and data.get("fetched_at", 0) < window_start:
+                return None
+        return data["token"], expires_at
+
+    async def _fetch(self, corp_id: str, corp_secret: str) -> Tuple[str, float]:
+        self.fetches += 1
+        async with self.session.get(
+            f"{WECHAT_API_BASE}/gettoken",
+            params={"corpid": corp_id, "corpsecret": corp_secret}
+        ) as response:
+            data = await response.json(content_type=None)
+        errcode = data.get("errcode", 0)
+        if errcode:
+            self.fetch_errors += 1
+            raise WeChatAPIError(errcode, data.get("errmsg", ""))
+        logger.info(f"[WeChatToken] 已获取 access_token: corp_id={corp_id}, expires_in={data.get('expires_in')}")
+        return data["access_token"], time.time() + int(data.get("expires_in", 7200))
+
+    async def invalidate(self, corp_id: str, corp_secret: str, token: str):
+        """作废指定 token（只在缓存中仍是该 token 时删除，避免误删其他进程刚刷新的 token）"""
+        self.invalidations += 1
+        key = self._key(corp_id, corp_secret)
+        cached = self._tokens.get(key)
+        if cached is not None and cached[0] == token:
+            del self._tokens[key]
+        self._refreshed_ahead.pop(key, None)
+        if self._redis is not None:
+            redis_key = self._redis_key(key)
+            raw = await self._redis.get(redis_key)
+            if raw and json.loads(raw).get("token") == token:
+                await self._redis.delete(redis_key)
+
+    # ======== API 调用 ========
+
+    async def call(self, corp_id: str, corp_secret: str, path: str, payload: dict) -> dict:
+        """POST 调用企业微信接口，token 失效时刷新后重试一次"""
+        for attempt in range(2):
+            token = await self.get_token(corp_id, corp_secret)
+            async with self.session.post(
+                f"{WECHAT_API_BASE}/{path}",
+                params={"access_token": token},
+                json=payload
+            ) as response:
+                data = await response.json(content_type=None)
+            errcode = data.get("errcode", 0)
+            if errcode in TOKEN_ERRCODES and attempt == 0:
+                logger.warning(f"[WeChatToken] access_token 失效 (errcode={errcode})，刷新后重试")
+                await self.invalidate(corp_id, corp_secret, token)
+                continue
+            if errcode:
+                raise WeChatAPIError(errcode, data.get("errmsg", ""))
+            return data
+
+    async def send_text(self, corp_id: str, corp_secret: str, agent_id: int, touser: str, content: str) -> dict:
+        """发送应用文本消息"""
+        return await self.call(corp_id, corp_secret, "message/send", {
+            "touser": touser,
+            "msgtype": "text",
+            "agentid": agent_id,
+            "text": {"content": truncate_utf8(content, TEXT_CONTENT_MAX_BYTES)},
+        })
+
+    def get_stats(self) -> dict:
+        total = self.local_hits + self.misses
+        return {
+            "tokens": len(self._tokens),
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.local_hits / total, 4) if total else None,
+            "fetches": self.fetches,
+            "fetch_errors": self.fetch_errors,
+            "refresh_ahead": self.refresh_ahead,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,93 @@
+"""
+企业微信消息处理辅助
+- CryptoCache: 按 (token, aes_key, corp_id) 缓存已初始化的 WeChatCrypto，避免每条消息重复解码 AES 密钥
+- extract_fields: 单次扫描提取企业微信 XML 中的扁平字段（Encrypt / MsgType / FromUserName ...），
+  替代 ElementTree 构建整棵树再逐个 find
+- verify_msg_signature: 只校验 msg_signature（一次 SHA-1），不解密
+"""
+
+import hashlib
+import hmac
+import re
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Tuple, Union
+from xml.sax.saxutils import unescape
+
+# 接收消息时需要的字段
+MESSAGE_FIELDS = ("Encrypt", "MsgType", "FromUserName", "ToUserName", "Content", "CreateTime", "MsgId")
+
+# 企业微信消息是扁平结构: <Tag><![CDATA[...]]></Tag> 或 <Tag>123</Tag>
+# CDATA 内容按 "非 ] 字符 + 不构成 ]]> 的 ]" 展开匹配，避免惰性匹配逐字符回溯
+_FIELD_RE = re.compile(r"<(\w+)>(?:<!\[CDATA\[([^\]]*(?:\](?!\]>)[^\]]*)*)\]\]>|([^<]*))</\1>")
+
+
+class WeChatMessageError(ValueError):
+    """消息不是可识别的企业微信 XML"""
+
+
+def extract_fields(xml: Union[str, bytes], fields: Iterable[str] = MESSAGE_FIELDS) -> Dict[str, str]:
+    """单次扫描提取 XML 中的叶子字段，重复字段取首次出现的值
+
+    只处理企业微信的扁平消息格式；既没有找到字段也不是 <xml> 文档时抛出 WeChatMessageError
+    """
+    if isinstance(xml, (bytes, bytearray, memoryview)):
+        xml = bytes(xml).decode("utf-8", errors="replace")
+    wanted = set(fields)
+    found: Dict[str, str] = {}
+    for m in _FIELD_RE.finditer(xml):
+        tag, cdata, value = m.groups()
+        if tag not in wanted or tag in found:
+            continue
+        if cdata is None:
+            value = value.strip()
+            cdata = unescape(value) if "&" in value else value
+        found[tag] = cdata
+        if len(found) == len(wanted):
+            break
+    if not found and "<xml" not in xml:
+        raise WeChatMessageError("Not a WeChat XML message")
+    return found
+
+
+def verify_msg_signature(token: str, timestamp: str, nonce: str, encrypt: str, signature: str) -> bool:
+    """校验企业微信回调签名：sha1(token、timestamp、nonce、Encrypt 排序后拼接)"""
+    expected = hashlib.sha1("".join(sorted([token, timestamp, nonce, encrypt])).encode("utf-8")).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+class CryptoCache:
+    """WeChatCrypto 实例缓存（LRU）
+
+    配置变更后键随之变化，旧实例自然被淘汰，不需要显式失效
+    """
+
+    def __init__(self, factory: Callable[..., object], max_size: int = 1024):
+        self._factory = factory
+        self._max_size = max_size
+        self._entries: "OrderedDict[Tuple[str, str, str], object]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str, aes_key: str, corp_id: str):
+        key = (token, aes_key, corp_id)
+        crypto = self._entries.get(key)
+        if crypto is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return crypto
+        self.misses += 1
+        crypto = self._factory(token=token, encoding_aes_key=aes_key, corp_id=corp_id)
+        self._entries[key] = crypto
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+        return crypto
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self._max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
@@ -0,0 +1,406 @@
+"""
+企业微信应用推送调度
+Webhook 通知先进入按租户（推送目标）分组的待发队列，由调度器统一发送：
+- 合并窗口内同一推送目标的多条通知合并为一条摘要消息
+- 每个应用（corp_id + agent_id）一个令牌桶，按企业微信的发送频率限制平滑发送
+- 企业微信返回频率超限时暂停该应用一段时间（指数退避），消息留在队列中稍后发送
+- 有 Redis 时队列持久化在 Redis 中（多进程共享，重启不丢）；无 Redis 时使用进程内队列
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import aiohttp
+
+from wechat_api import WeChatAPIError, WeChatTokenManager
+
+logger = logging.getLogger(__name__)
+
+ITEMS_KEY_PREFIX = "wechat:push:items:"
+DUE_KEY = "wechat:push:due"
+BUCKET_KEY_PREFIX = "wechat:push:bucket:"
+
+# 企业微信频率/并发超限
+BACKPRESSURE_ERRCODES = frozenset((45009, 45033))
+
+# 单条通知在摘要中保留的正文长度（字符）
+ITEM_BODY_CHARS = 500
+
+# 追加通知；超出上限时丢弃最旧的一条。返回是否发生丢弃
+ENQUEUE_SCRIPT = """
+local n = redis.call('RPUSH', KEYS[1], ARGV[1])
+local dropped = 0
+if n > tonumber(ARGV[4]) then
+    redis.call('LPOP', KEYS[1])
+    dropped = 1
+end
+redis.call('ZADD', KEYS[2], 'NX', ARGV[3], ARGV[2])
+return dropped
+"""
+
+# 领取到期的推送目标，并把到期时间推后作为租约（进程崩溃后租约到期可被重新领取）
+CLAIM_SCRIPT = """
+local dests = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[3]))
+for _, dest in ipairs(dests) do
+    redis.call('ZADD', KEYS[1], 'XX', ARGV[2], dest)
+end
+return dests
+"""
+
+# 删除已发送的前 N 条；队列清空则移出调度，否则在 ARGV[3] 时刻再次到期
+ACK_SCRIPT = """
+redis.call('LTRIM', KEYS[1], tonumber(ARGV[1]), -1)
+if redis.call('LLEN', KEYS[1]) == 0 then
+    redis.call('ZREM', KEYS[2], ARGV[2])
+else
+    redis.call('ZADD', KEYS[2], ARGV[3], ARGV[2])
+end
+return 0
+"""
+
+# 令牌桶：返回需要等待的秒数（"0" 表示已取得令牌）
+BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'paused_until')
+local paused_until = tonumber(state[3]) or 0
+if paused_until > now then
+    return tostring(paused_until - now)
+end
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(wait)
+"""
+
+
+class PushTarget(NamedTuple):
+    """推送目标的企业微信应用配置"""
+    corp_id: str
+    corp_secret: str
+    agent_id: int
+    push_target: str
+
+
+def push_item(webhook_data: dict) -> dict:
+    """队列中保存的通知摘要（只保留展示需要的字段）"""
+    body = webhook_data.get("body")
+    return {
+        "method": webhook_data.get("method"),
+        "path": webhook_data.get("path"),
+        "source_ip": webhook_data.get("source_ip"),
+        "timestamp": webhook_data.get("timestamp"),
+        "body": body[:ITEM_BODY_CHARS] if body else None,
+    }
+
+
+def format_push_message(items: List[dict]) -> str:
+    """单条通知完整展示；多条合并为摘要（超长部分由 send_text 按字节截断）"""
+    if len(items) == 1:
+        item = items[0]
+        lines = [
+            "收到 Webhook 请求",
+            f"{item['method']} {item['path']}",
+            f"来源: {item['source_ip']}",
+            f"时间: {item['timestamp']}",
+        ]
+        if item.get("body"):
+            lines += ["", item["body"]]
+        return "\n".join(lines)
+
+    lines = [f"收到 {len(items)} 条 Webhook 请求", ""]
+    for i, item in enumerate(items, 1):
+        lines.append(f"[{i}] {item['method']} {item['path']}  {item['timestamp']}  来源: {item['source_ip']}")
+        if item.get("body"):
+            lines.append(item["body"][:120])
+    return "\n".join(lines)
+
+
+class WeChatPushScheduler:
+    """企业微信应用推送调度器（每个 API 进程一个，有 Redis 时多进程共享同一队列）"""
+
+    def __init__(
+        self,
+        tokens: WeChatTokenManager,
+        resolve: Callable[[str], Awaitable[Optional[PushTarget]]],
+        merge_window: float = 3.0,
+        max_batch: int = 10,
+        max_pending: int = 1000,
+        rate: float = 0.5,
+        burst: int = 10,
+        backoff_base: float = 30.0,
+        backoff_max: float = 600.0,
+        max_attempts: int = 5,
+        concurrency: int = 20,
+        poll_interval: float = 0.5,
+        lease: float = 60.0,
+    ):
+        self._tokens = tokens
+        self._resolve = resolve
+        self._merge_window = merge_window
+        self._max_batch = max_batch
+        self._max_pending = max_pending
+        self._rate = rate
+        self._burst = burst
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._max_attempts = max_attempts
+        self._poll_interval = poll_interval
+        self._lease = lease
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._redis = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+        # 无 Redis 时的进程内队列
+        self._local_items: Dict[str, deque] = {}
+        self._local_due: Dict[str, float] = {}
+        self._local_buckets: Dict[str, dict] = {}
+        # 应用退避时长 / 推送目标连续失败次数（进程内）
+        self._backoff: Dict[str, float] = {}
+        self._attempts: Dict[str, int] = {}
+        self.enqueued = 0
+        self.dropped = 0
+        self.messages_sent = 0
+        self.items_sent = 0
+        self.throttled = 0
+        self.backpressure = 0
+        self.failures = 0
+
+    async def start(self, redis_conn=None):
+        self._redis = redis_conn
+        if redis_conn is not None:
+            self._enqueue_script = redis_conn.register_script(ENQUEUE_SCRIPT)
+            self._claim_script = redis_conn.register_script(CLAIM_SCRIPT)
+            self._ack_script = redis_conn.register_script(ACK_SCRIPT)
+            self._bucket_script = redis_conn.register_script(BUCKET_SCRIPT)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight:
+            await asyncio.wait(self._inflight, timeout=timeout)
+
+    # ======== 入队 ========
+
+    async def enqueue(self, dest: str, webhook_data: dict):
+        """加入推送目标的待发队列；合并窗口从该目标第一条待发通知开始计算"""
+        item = push_item(webhook_data)
+        due_at = time.time() + self._merge_window
+        self.enqueued += 1
+        if self._redis is not None:
+            try:
+                dropped = await self._enqueue_script(
+                    keys=[ITEMS_KEY_PREFIX + dest, DUE_KEY],
+                    args=[json.dumps(item), dest, due_at, self._max_pending]
+                )
+                if dropped:
+                    self.dropped += 1
+                return
+            except Exception as e:
+                logger.warning(f"[WeChatPushQueue] Redis 入队失败，使用进程内队列: {e}")
+
+        items = self._local_items.setdefault(dest, deque())
+        items.append(item)
+        if len(items) > self._max_pending:
+            items.popleft()
+            self.dropped += 1
+        self._local_due.setdefault(dest, due_at)
+
+    # ======== 调度 ========
+
+    async def _run(self):
+        while True:
+            try:
+                dests = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[WeChatPushQueue] 领取待发队列失败: {e}")
+                dests = []
+            for dest in dests:
+                await self._semaphore.acquire()
+                task = asyncio.create_task(self._process(dest))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+            if not dests:
+                await asyncio.sleep(self._poll_interval)
+
+    async def _claim(self) -> List[str]:
+        now = time.time()
+        limit = 100
+        dests = []
+        if self._redis is not None:
+            result = await self._claim_script(keys=[DUE_KEY], args=[now, now + self._lease, limit])
+            dests = [d.decode() if isinstance(d, bytes) else d for d in result]
+        for dest, due_at in list(self._local_due.items()):
+            if len(dests) >= limit:
+                break
+            if due_at <= now:
+                self._local_due[dest] = now + self._lease
+                dests.append(dest)
+        return dests
+
+    async def _process(self, dest: str):
+        try:
+            await self._send_batch(dest)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 租约到期后重新领取
+            logger.error(f"[WeChatPushQueue] 处理推送目标失败: dest={dest}, error={e}")
+        finally:
+            self._semaphore.release()
+
+    async def _send_batch(self, dest: str):
+        items = await self._peek(dest)
+        if not items:
+            await self._ack(dest, 0)
+            return
+
+        target = await self._resolve(dest)
+        if target is None:
+            # 租户已删除或关闭了企业微信推送
+            logger.info(f"[WeChatPushQueue] 推送配置已不存在，丢弃 {len(items)} 条: dest={dest}")
+            await self._ack(dest, len(items))
+            return
+
+        app_key = f"{target.corp_id}:{target.agent_id}"
+        wait = await self._take_token(app_key)
+        if wait > 0:
+            self.throttled += 1
+            await self._reschedule(dest, time.time() + wait)
+            return
+
+        try:
+            await self._tokens.send_text(
+                target.corp_id, target.corp_secret, target.agent_id, target.push_target,
+                format_push_message(items)
+            )
+        except WeChatAPIError as e:
+            if e.errcode in BACKPRESSURE_ERRCODES:
+                self.backpressure += 1
+                pause = min(self._backoff.get(app_key, self._backoff_base / 2) * 2, self._backoff_max)
+                self._backoff[app_key] = pause
+                await self._pause_app(app_key, pause)
+                await self._reschedule(dest, time.time() + pause)
+                logger.warning(f"[WeChatPushQueue] 企业微信限流 (errcode={e.errcode})，应用 {app_key} 暂停 {pause:.0f} 秒")
+                return
+            # 其他业务错误（如推送目标无效）重试无意义
+            self.failures += 1
+            logger.error(f"[WeChatPushQueue] 推送失败，丢弃 {len(items)} 条: dest={dest}, error={e}")
+            await self._ack(dest, len(items))
+            return
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.failures += 1
+            attempts = self._attempts.get(dest, 0) + 1
+            if attempts >= self._max_attempts:
+                self._attempts.pop(dest, None)
+                logger.error(f"[WeChatPushQueue] 推送连续失败 {attempts} 次，丢弃 {len(items)} 条: dest={dest}, error={e}")
+                await self._ack(dest, len(items))
+                return
+            self._attempts[dest] = attempts
+            await self._reschedule(dest, time.time() + min(self._backoff_base * 2 ** (attempts - 1), self._backoff_max))
+            logger.warning(f"[WeChatPushQueue] 推送失败，稍后重试: dest={dest}, attempts={attempts}, error={e}")
+            return
+
+        self._attempts.pop(dest, None)
+        self._backoff.pop(app_key, None)
+        self.messages_sent += 1
+        self.items_sent += len(items)
+        # 剩余的通知（发送期间新到达的或超出单批上限的）按令牌桶继续发送
+        await self._ack(dest, len(items))
+        logger.info(f"[WeChatPushQueue] 推送成功: dest={dest}, touser={target.push_target}, 合并 {len(items)} 条")
+
+    # ======== 队列存储 ========
+
+    async def _peek(self, dest: str) -> List[dict]:
+        if self._redis is not None and dest not in self._local_items:
+            raw = await self._redis.lrange(ITEMS_KEY_PREFIX + dest, 0, self._max_batch - 1)
+            return [json.loads(r) for r in raw]
+        return list(self._local_items.get(dest, ()))[:self._max_batch]
+
+    async def _ack(self, dest: str, count: int):
+        if self._redis is not None and dest not in self._local_items:
+            await self._ack_script(keys=[ITEMS_KEY_PREFIX + dest, DUE_KEY], args=[count, dest, time.time()])
+            return
+        items = self._local_items.get(dest)
+        for _ in range(min(count, len(items or ()))):
+            items.popleft()
+        if items:
+            self._local_due[dest] = time.time()
+        else:
+            self._local_items.pop(dest, None)
+            self._local_due.pop(dest, None)
+
+    async def _reschedule(self, dest: str, due_at: float):
+        if self._redis is not None and dest not in self._local_items:
+            await self._redis.zadd(DUE_KEY, {dest: due_at}, xx=True)
+        elif dest in self._local_due:
+            self._local_due[dest] = due_at
+
+    # ======== 令牌桶 ========
+
+    async def _take_token(self, app_key: str) -> float:
+        now = time.time()
+        if self._redis is not None:
+            try:
+                wait = await self._bucket_script(
+                    keys=[BUCKET_KEY_PREFIX + app_key], args=[self._rate, self._burst, now]
+                )
+                return float(wait)
+            except Exception as e:
+                logger.warning(f"[WeChatPushQueue] Redis 令牌桶不可用，使用进程内令牌桶: {e}")
+
+        bucket = self._local_buckets.setdefault(app_key, {"tokens": float(self._burst), "ts": now, "paused_until": 0.0})
+        if bucket["paused_until"] > now:
+            return bucket["paused_until"] - now
+        bucket["tokens"] = min(self._burst, bucket["tokens"] + (now - bucket["ts"]) * self._rate)
+        bucket["ts"] = now
+        if bucket["tokens"] >= 1:
+            bucket["tokens"] -= 1
+            return 0.0
+        return (1 - bucket["tokens"]) / self._rate
+
+    async def _pause_app(self, app_key: str, seconds: float):
+        paused_until = time.time() + seconds
+        if self._redis is not None:
+            try:
+                await self._redis.hset(BUCKET_KEY_PREFIX + app_key, "paused_until", paused_until)
+                return
+            except Exception as e:
+                logger.warning(f"[WeChatPushQueue] 写入应用暂停状态失败: {e}")
+        bucket = self._local_buckets.setdefault(app_key, {"tokens": 0.0, "ts": time.time(), "paused_until": 0.0})
+        bucket["paused_until"] = paused_until
+
+    def get_stats(self) -> dict:
+        return {
+            "backend": "redis" if self._redis is not None else "local",
+            "local_pending_targets": len(self._local_due),
+            "in_flight": len(self._inflight),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "messages_sent": self.messages_sent,
+            "items_sent": self.items_sent,
+            "throttled": self.throttled,
+            "backpressure": self.backpressure,
+            "failures": self.failures,
+        }
@@ -0,0 +1,711 @@
+"""
+WebSocket 设备推送中枢
+/ws 连接交给 ws_server.websocket_endpoint 处理握手、认证和绑定协议，这里以包装后的 WebSocket 运行它，
+出站帧经连接的发送队列由写协程通过 WebSocket 公开接口发出；从服务端发出的 {"type": "bound", "device_id": "user_id:device_name"} 中登记设备连接，推送直接写入已登记的连接：
+- 多设备推送只序列化一次消息，本地连接并发发送
+- 设备名 "*" 表示该用户的所有设备
+- 跨进程推送按设备归属登记（ws_registry）只发往持有目标设备的 worker，同一 worker 的目标合并为一条消息，
+  所有 worker 的消息在一次 pipeline 中发布；目标设备不在线时只写入离线缓冲；归属查询失败时退回广播
+- 每个连接一个有界发送队列和独立写协程，慢设备只影响自己；队列满时按丢弃策略处理
+- 指定设备名的推送先追加到离线缓冲（ws_offline，只缓冲绑定过的设备），推送帧携带游标；
+  设备绑定时发送 {"type": "bind", "device_name": "...", "resume_from": "<游标>"} 可补发游标之后的推送
+- 连接存活由定时轮跟踪（ws_liveness）：仅对绑定时声明 {"type": "bind", ..., "ping": true} 的连接启用，
+  空闲连接先收到 {"type": "ping"}，仍无入站帧则关闭；未声明的连接（只收推送的旧客户端）依赖传输层的 ping/pong
+"""
+
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from starlette.websockets import WebSocket
+
+from payload_envelope import dumps, loads
+from ws_liveness import LivenessMonitor
+from ws_offline import OfflineBuffer, cursor_key
+from ws_registry import DeviceRegistry
+
+logger = logging.getLogger(__name__)
+
+# 跨进程推送频道：广播频道，以及按 worker 的定向频道 "ws:push:<worker_id>"
+PUSH_CHANNEL = "ws:push"
+
+# 匹配用户所有设备的设备名
+ALL_DEVICES = "*"
+
+# 发送队列满时的处理策略
+DROP_OLDEST = "drop_oldest"      # 丢弃最旧的推送
+DROP_NEWEST = "drop_newest"      # 丢弃新到的推送
+COLLAPSE = "collapse"            # 同一 collapse_key 只保留最新一条，仍满时丢弃最旧的推送
+DISCONNECT = "disconnect"        # 断开连接，由设备重连
+DROP_POLICIES = frozenset((DROP_OLDEST, DROP_NEWEST, COLLAPSE, DISCONNECT))
+
+# 1013 Try Again Later：因拥塞由服务端关闭
+CLOSE_CODE_OVERLOADED = 1013
+# 1001 Going Away：空闲超时
+CLOSE_CODE_IDLE = 1001
+
+CURSOR_RE = re.compile(r"^\d+(-\d+)?$")
+
+
+def push_frame(device_id: str, payload: str, wrap: bool = True, cursor: Optional[str] = None) -> str:
+    """由已序列化的消息拼接推送帧，不再重复序列化消息体
+    不包装时 payload 本身即为帧（JSON 对象），游标插入为其第一个字段
+    """
+    if not wrap:
+        if cursor is None:
+            return payload
+        return f'{{"cursor":"{cursor}"' + ("}" if payload == "{}" else "," + payload[1:])
+    if cursor is None:
+        return f'{{"type":"webhook","target_device":{dumps(device_id)},"data":{payload}}}'
+    return f'{{"type":"webhook","target_device":{dumps(device_id)},"cursor":"{cursor}","data":{payload}}}'
+
+
+class DeviceConnection:
+    """一个已接入的 /ws 连接，绑定设备后登记到中枢
+    所有出站帧经有界队列由写协程按顺序发送；队列项为 [collapse_key, ASGI 消息, 是否控制帧]，
+    服务端自身的控制帧（accept/bound/close 等）不计入上限也不会被丢弃
+    """
+
+    __slots__ = (
+        "user_id", "device_name", "device_id", "connected_at", "resume_from", "held",
+        "max_queue", "policy", "send_timeout",
+        "closed", "disconnected", "sent", "dropped", "collapsed", "high_water", "overloaded",
+        "_websocket", "_queue", "_pending", "_keyed", "_ready", "_idle", "_writer",
+    )
+
+    def __init__(self, websocket: WebSocket, max_queue: int, policy: str, send_timeout: float):
+        self._websocket = websocket
+        self.user_id: Optional[str] = None
+        self.device_name: Optional[str] = None
+        self.device_id: Optional[str] = None
+        self.connected_at = time.time()
+        self.resume_from: Optional[str] = None
+        # 补发离线推送期间到达的实时推送 [(游标, 帧, collapse_key)]，补发完成后按游标去重入队
+        self.held: Optional[list] = None
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.closed = False          # 不再接收新的出站帧
+        self.disconnected = False    # 客户端已断开
+        self.sent = 0
+        self.dropped = 0
+        self.collapsed = 0
+        self.high_water = 0
+        self.overloaded = False
+        self._queue: Deque[list] = deque()
+        self._pending = 0            # 队列中的推送帧数（不含控制帧）
+        self._keyed: Dict[str, list] = {}
+        self._ready = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._writer: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def wait_idle(self):
+        await self._idle.wait()
+
+    def control(self, message: dict):
+        """服务端控制帧，保持与推送帧的先后顺序"""
+        if self.closed:
+            return
+        self._append([None, message, True])
+
+    def shutdown(self, code: int):
+        """发完已入队的帧后关闭连接，之后不再接收新帧"""
+        self.control({"type": "websocket.close", "code": code})
+        self.closed = True
+
+    def push(self, text: str, collapse_key: Optional[str] = None) -> bool:
+        """推送帧入队，按丢弃策略处理队列已满的情况，返回是否入队"""
+        if self.closed:
+            return False
+        message = {"type": "websocket.send", "text": text}
+        collapsing = collapse_key is not None and self.policy == COLLAPSE
+        if collapsing:
+            entry = self._keyed.get(collapse_key)
+            if entry is not None:
+                entry[1] = message
+                self.collapsed += 1
+                return True
+        if self._pending >= self.max_queue:
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return False
+            if self.policy == DISCONNECT:
+                self._overload()
+                return False
+            self._drop_oldest()
+        entry = [collapse_key if collapsing else None, message, False]
+        if collapsing:
+            self._keyed[collapse_key] = entry
+        self._pending += 1
+        self._append(entry)
+        return True
+
+    def _append(self, entry: list):
+        self._queue.append(entry)
+        if len(self._queue) > self.high_water:
+            self.high_water = len(self._queue)
+        self._idle.clear()
+        self._ready.set()
+
+    def _drop_oldest(self):
+        for i, entry in enumerate(self._queue):
+            if not entry[2]:
+                del self._queue[i]
+                self._forget(entry)
+                self.dropped += 1
+                return
+
+    def _forget(self, entry: list):
+        if not entry[2]:
+            self._pending -= 1
+        if entry[0] is not None and self._keyed.get(entry[0]) is entry:
+            del self._keyed[entry[0]]
+
+    def _overload(self):
+        """丢弃积压的推送并关闭连接"""
+        self.overloaded = True
+        self.dropped += self._pending + 1
+        self._queue = deque(entry for entry in self._queue if entry[2])
+        self._pending = 0
+        self._keyed.clear()
+        self._append([None, {"type": "websocket.close", "code": CLOSE_CODE_OVERLOADED}, True])
+        self.closed = True
+        logger.warning("[WSHub] 发送队列已满，断开连接: device=%s", self.device_id)
+
+    async def _send(self, message: dict):
+        """经 WebSocket 的公开接口发送一条出站消息"""
+        if message["type"] == "websocket.close":
+            await self._websocket.close(message.get("code", 1000), message.get("reason"))
+        elif message.get("text") is not None:
+            await self._websocket.send_text(message["text"])
+        elif message.get("bytes") is not None:
+            await self._websocket.send_bytes(message["bytes"])
+        else:
+            await self._websocket.send(message)
+
+    async def _write_loop(self):
+        while True:
+            if not self._queue:
+                self._ready.clear()
+                self._idle.set()
+                await self._ready.wait()
+                continue
+            entry = self._queue.popleft()
+            self._forget(entry)
+            message = entry[1]
+            try:
+                await asyncio.wait_for(self._send(message), timeout=self.send_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("[WSHub] 发送超时，断开连接: device=%s", self.device_id)
+                self._abort()
+                try:
+                    await asyncio.wait_for(
+                        self._send({"type": "websocket.close", "code": CLOSE_CODE_OVERLOADED}),
+                        timeout=1.0
+                    )
+                except Exception:
+                    pass
+                return
+            except Exception as e:
+                logger.debug("[WSHub] 发送失败: device=%s, error=%s", self.device_id, e)
+                self._abort()
+                return
+            if message["type"] == "websocket.close":
+                self._abort()
+                return
+            if not entry[2]:
+                self.sent += 1
+
+    def _abort(self):
+        self.closed = True
+        self.dropped += self._pending
+        self._queue.clear()
+        self._pending = 0
+        self._keyed.clear()
+        self._idle.set()
+
+    async def close(self, drain_timeout: float):
+        """连接结束：客户端仍在线时等待队列发完，然后停止写协程"""
+        self.closed = True
+        if self._queue and not self.disconnected:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self._writer:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+        self._abort()
+
+    def get_stats(self) -> dict:
+        return {
+            "depth": len(self._queue),
+            "high_water": self.high_water,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "collapsed": self.collapsed,
+        }
+
+
+class WebSocketHub:
+    """本进程持有的设备连接索引：user_id -> device_name -> 连接集合"""
+
+    def __init__(
+        self,
+        worker_id: str,
+        queue_size: int = 256,
+        drop_policy: str = DROP_OLDEST,
+        send_timeout: float = 10.0,
+        drain_timeout: float = 2.0,
+        offline: Optional[OfflineBuffer] = None,
+        replay_page: int = 100,
+        registry: Optional[DeviceRegistry] = None,
+        ping_interval: float = 60.0,
+        idle_timeout: float = 180.0,
+    ):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.worker_id = worker_id
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.send_timeout = send_timeout
+        self.drain_timeout = drain_timeout
+        self.offline = offline
+        self.replay_page = replay_page
+        self.registry = registry
+        self.liveness = LivenessMonitor(
+            self._ping, self._reap, ping_interval=ping_interval, idle_timeout=idle_timeout
+        )
+        self._replay_tasks: Set[asyncio.Task] = set()
+        self._offline_tasks: Set[asyncio.Task] = set()
+        # (user_id, device_name) -> 该设备正在执行的登记写入；写入期间状态又变化的设备记入 dirty
+        self._registry_pending: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._registry_dirty: Set[Tuple[str, str]] = set()
+        self._redis = None
+        self._devices: Dict[str, Dict[str, Set[DeviceConnection]]] = {}
+        self._connections: Set[DeviceConnection] = set()
+        self._listener_task: Optional[asyncio.Task] = None
+        self.fanouts = 0
+        self.frames_queued = 0
+        self.frames_rejected = 0
+        # 已关闭连接的累计值
+        self.closed_sent = 0
+        self.closed_dropped = 0
+        self.overload_disconnects = 0
+        self.replays = 0
+        self.remote_published = 0
+        self.remote_skipped = 0
+        self.remote_broadcasts = 0
+        self.remote_received = 0
+
+    @property
+    def channel(self) -> str:
+        return f"{PUSH_CHANNEL}:{self.worker_id}"
+
+    async def start(self, redis_conn=None):
+        self._redis = redis_conn
+        self.liveness.start()
+        if self.registry is not None:
+            await self.registry.start(redis_conn, self._local_device_ids)
+        if redis_conn is not None:
+            self._listener_task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        for task in list(self._replay_tasks) + list(self._offline_tasks):
+            task.cancel()
+        if self._listener_task:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        if self.registry is not None:
+            # 未完成的登记写入不能晚于 stop 中的整体注销
+            for task in list(self._registry_pending.values()):
+                task.cancel()
+            await self.registry.stop()
+        await self.liveness.stop()
+
+    def _local_device_ids(self):
+        for user_id, devices in self._devices.items():
+            for device_name in devices:
+                yield user_id, device_name
+
+    def _sync_registry(self, user_id: str, device_name: str):
+        """把设备的本地绑定状态写入归属登记
+
+        同一设备的写入串行执行，且每次写入的是执行时的本地状态：
+        快速重连时旧连接的注销不会在新连接的登记之后生效
+        """
+        if self.registry is None or not self.registry.enabled:
+            return
+        key = (user_id, device_name)
+        if key in self._registry_pending:
+            self._registry_dirty.add(key)
+            return
+        self._registry_pending[key] = asyncio.create_task(self._registry_sync_loop(key))
+
+    async def _registry_sync_loop(self, key: Tuple[str, str]):
+        user_id, device_name = key
+        try:
+            while True:
+                self._registry_dirty.discard(key)
+                if device_name in self._devices.get(user_id, ()):
+                    await self.registry.register(user_id, device_name)
+                else:
+                    await self.registry.unregister(user_id, device_name)
+                if key not in self._registry_dirty:
+                    return
+        finally:
+            self._registry_pending.pop(key, None)
+
+    # ======== 连接登记 ========
+
+    async def serve(self, websocket: WebSocket, endpoint, *args):
+        """以包装后的连接运行 endpoint，连接结束时注销
+        endpoint 的出站帧也经连接的发送队列，与推送帧保持顺序
+        """
+        conn = DeviceConnection(websocket, self.queue_size, self.drop_policy, self.send_timeout)
+
+        async def receive():
+            message = await websocket.receive()
+            if message["type"] == "websocket.receive":
+                self.liveness.touch(conn)
+                if message.get("text"):
+                    self._observe_bind(conn, message["text"])
+            elif message["type"] == "websocket.disconnect":
+                conn.disconnected = True
+            return message
+
+        async def send(message):
+            if message["type"] == "websocket.accept":
+                await websocket.send(message)
+                return
+            if message["type"] == "websocket.send" and message.get("text"):
+                self._observe_bound(conn, message["text"])
+            conn.control(message)
+
+        self._connections.add(conn)
+        conn.start()
+        try:
+            await endpoint(WebSocket(websocket.scope, receive=receive, send=send), *args)
+        finally:
+            self._connections.discard(conn)
+            self.liveness.untrack(conn)
+            self._unbind(conn)
+            await conn.close(self.drain_timeout)
+            self.closed_sent += conn.sent
+            self.closed_dropped += conn.dropped
+            if conn.overloaded:
+                self.overload_disconnects += 1
+
+    def _ping(self, conn: DeviceConnection):
+        conn.control({"type": "websocket.send", "text": f'{{"type":"ping","ts":{int(time.time())}}}'})
+
+    def _reap(self, conn: DeviceConnection):
+        logger.debug("[WSHub] 连接空闲超时，关闭: device=%s", conn.device_id)
+        conn.shutdown(CLOSE_CODE_IDLE)
+
+    def _observe_bind(self, conn: DeviceConnection, text: str):
+        """记录客户端绑定请求中的补发游标；声明支持应用层 ping 的连接开始空闲检测"""
+        try:
+            data = loads(text)
+        except ValueError:
+            return
+        if not isinstance(data, dict) or data.get("type") != "bind":
+            return
+        cursor = data.get("resume_from")
+        conn.resume_from = str(cursor) if cursor is not None and CURSOR_RE.match(str(cursor)) else None
+        if data.get("ping") is True:
+            self.liveness.track(conn)
+
+    def _observe_bound(self, conn: DeviceConnection, text: str):
+        try:
+            data = loads(text)
+        except ValueError:
+            return
+        if not isinstance(data, dict) or data.get("type") != "bound":
+            return
+        user_id, sep, device_name = str(data.get("device_id") or "").partition(":")
+        if not sep or not device_name:
+            return
+        self._unbind(conn)
+        conn.user_id, conn.device_name, conn.device_id = user_id, device_name, f"{user_id}:{device_name}"
+        conns = self._devices.setdefault(user_id, {}).setdefault(device_name, set())
+        conns.add(conn)
+        if len(conns) == 1:
+            self._sync_registry(user_id, device_name)
+            if self.offline is not None:
+                # 绑定过的设备才有离线缓冲
+                task = asyncio.create_task(self.offline.remember(user_id, device_name))
+                self._offline_tasks.add(task)
+                task.add_done_callback(self._offline_tasks.discard)
+        logger.debug("[WSHub] 设备已登记: %s", conn.device_id)
+        if self.offline is not None and conn.resume_from is not None:
+            conn.held = []
+            task = asyncio.create_task(self._replay(conn, conn.resume_from))
+            self._replay_tasks.add(task)
+            task.add_done_callback(self._replay_tasks.discard)
+            conn.resume_from = None
+
+    async def _replay(self, conn: DeviceConnection, after: str):
+        """按顺序补发游标之后的缓冲推送，每页发完再读下一页，最后放行补发期间到达的实时推送"""
+        self.replays += 1
+        user_id, device_name, device_id = conn.user_id, conn.device_name, conn.device_id
+        last = after
+        replayed = 0
+        try:
+            while not conn.closed:
+                pushes = await self.offline.read(user_id, device_name, last, self.replay_page)
+                for push in pushes:
+                    conn.push(push_frame(device_id, push.payload, push.wrap, push.cursor))
+                if pushes:
+                    last = pushes[-1].cursor
+                    replayed += len(pushes)
+                if len(pushes) < self.replay_page:
+                    break
+                await conn.wait_idle()
+        except Exception as e:
+            logger.warning("[WSHub] 离线推送补发失败: device=%s, error=%s", device_id, e)
+        finally:
+            held, conn.held = conn.held, None
+            last_key = cursor_key(last)
+            for cursor, frame, collapse_key in held or ():
+                if cursor is None or cursor_key(cursor) > last_key:
+                    conn.push(frame, collapse_key)
+        logger.debug("[WSHub] 离线推送已补发: device=%s, count=%d", device_id, replayed)
+
+    def _unbind(self, conn: DeviceConnection):
+        if conn.device_id is None:
+            return
+        devices = self._devices.get(conn.user_id)
+        if devices is not None:
+            conns = devices.get(conn.device_name)
+            if conns is not None:
+                conns.discard(conn)
+                if not conns:
+                    del devices[conn.device_name]
+                    self._sync_registry(conn.user_id, conn.device_name)
+            if not devices:
+                del self._devices[conn.user_id]
+        conn.user_id = conn.device_name = conn.device_id = None
+
+    def _resolve(self, user_id: str, device_names: Iterable[str]) -> List[DeviceConnection]:
+        devices = self._devices.get(user_id)
+        if not devices:
+            return []
+        conns: Set[DeviceConnection] = set()
+        for name in device_names:
+            if name == ALL_DEVICES:
+                for device_conns in devices.values():
+                    conns.update(device_conns)
+            else:
+                conns.update(devices.get(name, ()))
+        return list(conns)
+
+    # ======== 推送 ========
+
+    async def fanout(
+        self,
+        user_id,
+        device_names: Iterable[str],
+        message: dict,
+        wrap: bool = True,
+        collapse_key: Optional[str] = None,
+    ) -> int:
+        """推送到用户的多个设备（消息只序列化一次），返回本进程入队的连接数
+        collapse_key：丢弃策略为 collapse 时，队列中同 key 的未发送推送被新消息替换；离线缓冲中同 key 只保留最新一条
+        通配设备名 "*" 不写入离线缓冲
+        """
+        user_id = str(user_id)
+        device_names = list(dict.fromkeys(device_names))
+        self.fanouts += 1
+        payload = dumps(message)
+        # 写离线缓冲与查询设备归属并发进行
+        cursors, owners = await asyncio.gather(
+            self._append_offline(user_id, device_names, payload, wrap, collapse_key),
+            self._lookup_owners(user_id)
+        )
+        delivered = self._deliver_local(user_id, device_names, payload, wrap, collapse_key, cursors)
+        if self._redis is not None:
+            await self._publish(user_id, device_names, payload, wrap, collapse_key, cursors, owners)
+        return delivered
+
+    async def _append_offline(self, user_id: str, device_names: List[str], payload: str, wrap: bool,
+                              collapse_key: Optional[str]) -> Dict[str, str]:
+        if self.offline is None:
+            return {}
+        return await self.offline.append(
+            user_id, [name for name in device_names if name != ALL_DEVICES], payload, wrap, collapse_key
+        )
+
+    async def _lookup_owners(self, user_id: str) -> Optional[Dict[str, Set[str]]]:
+        """用户在线设备的归属；未启用登记或查询失败时返回 None（退回广播）"""
+        if self.registry is None or not self.registry.enabled:
+            return None
+        try:
+            return await self.registry.owners(user_id)
+        except Exception as e:
+            self.registry.redis_errors += 1
+            logger.warning("[WSHub] 设备归属查询失败，改为广播: %s", e)
+            return None
+
+    def _route(self, device_names: List[str], owners: Dict[str, Set[str]]) -> Dict[str, List[str]]:
+        """按归属分组目标设备：worker_id -> 设备名列表（不含本进程）"""
+        routes: Dict[str, List[str]] = {}
+        for name in device_names:
+            if name == ALL_DEVICES:
+                workers = set().union(*owners.values()) if owners else set()
+            else:
+                workers = owners.get(name, ())
+            for worker_id in workers:
+                if worker_id != self.worker_id:
+                    routes.setdefault(worker_id, []).append(name)
+        return routes
+
+    async def notify(self, user_id, device_name: str, message: dict, wrap: bool = True,
+                     collapse_key: Optional[str] = None) -> int:
+        return await self.fanout(user_id, (device_name,), message, wrap=wrap, collapse_key=collapse_key)
+
+    def _deliver_local(self, user_id: str, device_names: List[str], payload: str, wrap: bool,
+                       collapse_key: Optional[str], cursors: Dict[str, str]) -> int:
+        """放入各连接的发送队列，由各自的写协程并发发送"""
+        conns = self._resolve(user_id, device_names)
+        if not conns:
+            return 0
+        # 同一设备的多个连接共用同一帧
+        frames: Dict[str, str] = {}
+        delivered = 0
+        for conn in conns:
+            cursor = cursors.get(conn.device_name)
+            frame = frames.get(conn.device_id)
+            if frame is None:
+                frame = frames[conn.device_id] = push_frame(conn.device_id, payload, wrap, cursor)
+            if conn.held is not None:
+                conn.held.append((cursor, frame, collapse_key))
+                delivered += 1
+            elif conn.push(frame, collapse_key):
+                delivered += 1
+        self.frames_queued += delivered
+        self.frames_rejected += len(conns) - delivered
+        return delivered
+
+    async def _publish(self, user_id: str, device_names: List[str], payload: str, wrap: bool,
+                       collapse_key: Optional[str], cursors: Dict[str, str],
+                       owners: Optional[Dict[str, Set[str]]]):
+        """发布给其他 worker：头部一行 JSON，之后是已序列化的消息
+        owners 为 None 时发往广播频道，否则只发往持有目标设备的 worker
+        """
+        if owners is None:
+            routes = {None: device_names}
+            self.remote_broadcasts += 1
+        else:
+            routes = self._route(device_names, owners)
+            if not routes:
+                self.remote_skipped += 1
+                return
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for worker_id, names in routes.items():
+                header = dumps([self.worker_id, user_id, names, wrap, collapse_key, cursors])
+                channel = PUSH_CHANNEL if worker_id is None else f"{PUSH_CHANNEL}:{worker_id}"
+                pipe.publish(channel, f"{header}\n{payload}")
+            await pipe.execute()
+            self.remote_published += len(routes)
+        except Exception as e:
+            logger.warning("[WSHub] 跨进程推送发布失败: %s", e)
+
+    async def _listen(self):
+        """订阅推送频道，投递到本进程持有的连接；断线后重连"""
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(PUSH_CHANNEL, self.channel)
+                logger.info("[WSHub] 已订阅跨进程推送")
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    await self._on_remote(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("[WSHub] 跨进程推送订阅中断，5秒后重连: %s", e)
+                await asyncio.sleep(5)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    async def _on_remote(self, data):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        header, sep, payload = data.partition("\n")
+        try:
+            origin, user_id, device_names, wrap, collapse_key, cursors = loads(header)
+        except (ValueError, TypeError):
+            return
+        if not sep or origin == self.worker_id:
+            return
+        self.remote_received += 1
+        self._deliver_local(user_id, device_names, payload, wrap, collapse_key, cursors)
+
+    # ======== 状态 ========
+
+    def user_devices(self, user_id) -> Dict[str, int]:
+        """用户在本进程已绑定的设备及连接数"""
+        user_id = str(user_id)
+        return {
+            f"{user_id}:{name}": len(conns)
+            for name, conns in self._devices.get(user_id, {}).items()
+        }
+
+    def user_queues(self, user_id) -> Dict[str, List[dict]]:
+        """用户各设备连接的发送队列状态"""
+        user_id = str(user_id)
+        return {
+            f"{user_id}:{name}": [conn.get_stats() for conn in conns]
+            for name, conns in self._devices.get(user_id, {}).items()
+        }
+
+    def get_stats(self) -> dict:
+        depths = [conn.depth for conn in self._connections]
+        return {
+            "worker_id": self.worker_id,
+            "connections": len(self._connections),
+            "bound_users": len(self._devices),
+            "bound_devices": sum(len(devices) for devices in self._devices.values()),
+            "queue_size": self.queue_size,
+            "drop_policy": self.drop_policy,
+            "queued": sum(depths),
+            "max_depth": max(depths, default=0),
+            "fanouts": self.fanouts,
+            "frames_queued": self.frames_queued,
+            "frames_rejected": self.frames_rejected,
+            "frames_sent": self.closed_sent + sum(conn.sent for conn in self._connections),
+            "frames_dropped": self.closed_dropped + sum(conn.dropped for conn in self._connections),
+            "overload_disconnects": self.overload_disconnects,
+            "replays": self.replays,
+            "offline": self.offline.get_stats() if self.offline is not None else None,
+            "remote_published": self.remote_published,
+            "remote_skipped": self.remote_skipped,
+            "remote_broadcasts": self.remote_broadcasts,
+            "remote_received": self.remote_received,
+            "registry": self.registry.get_stats() if self.registry is not None else None,
+            "liveness": self.liveness.get_stats(),
+        }
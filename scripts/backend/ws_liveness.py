@@ -0,0 +1,154 @@
+"""
+WebSocket 连接存活检测 - 定时轮代替周期性全量扫描
+- 收到任何入站帧只更新连接的 last_seen（O(1)，不移动定时轮条目）
+- 每个 tick 只检查到期槽位中的连接：仍活跃的按新的期限重新入轮，
+  空闲超过 ping_interval 的发送 {"type": "ping"}，超过 idle_timeout 的关闭
+- 每个 tick 的开销与到期连接数成正比，与连接总数无关
+"""
+
+import asyncio
+import logging
+import math
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class TimingWheel:
+    """单层定时轮；超出轮长的期限按轮长入槽，到期时由调用方重新入轮"""
+
+    def __init__(self, tick: float, slots: int):
+        self.tick = tick
+        self._slots: List[Set] = [set() for _ in range(slots)]
+        self._where: Dict[object, int] = {}
+        self._pos = 0
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def schedule(self, item, delay: float):
+        self.remove(item)
+        ticks = min(max(1, math.ceil(delay / self.tick)), len(self._slots) - 1)
+        index = (self._pos + ticks) % len(self._slots)
+        self._slots[index].add(item)
+        self._where[item] = index
+
+    def remove(self, item):
+        index = self._where.pop(item, None)
+        if index is not None:
+            self._slots[index].discard(item)
+
+    def advance(self) -> Set:
+        """前进一格，返回该槽位的全部条目"""
+        self._pos = (self._pos + 1) % len(self._slots)
+        due = self._slots[self._pos]
+        self._slots[self._pos] = set()
+        for item in due:
+            del self._where[item]
+        return due
+
+
+class LivenessMonitor:
+    """连接空闲检测：ping(conn) 发送心跳帧，reap(conn) 关闭连接"""
+
+    def __init__(
+        self,
+        ping: Callable[[object], None],
+        reap: Callable[[object], None],
+        ping_interval: float = 60.0,
+        idle_timeout: float = 180.0,
+        tick: float = 1.0,
+    ):
+        self._ping = ping
+        self._reap = reap
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self._wheel = TimingWheel(tick, int(max(ping_interval, idle_timeout) / tick) + 2)
+        self._task: Optional[asyncio.Task] = None
+        # conn -> (last_seen, last_ping)
+        self._seen: Dict[object, List[float]] = {}
+        self.ticks = 0
+        self.checked = 0
+        self.pings = 0
+        self.reaped = 0
+        self.last_tick_ms = 0.0
+        self.max_tick_ms = 0.0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def track(self, conn):
+        self._seen[conn] = [time.monotonic(), 0.0]
+        self._wheel.schedule(conn, self.ping_interval)
+
+    def untrack(self, conn):
+        self._seen.pop(conn, None)
+        self._wheel.remove(conn)
+
+    def touch(self, conn):
+        entry = self._seen.get(conn)
+        if entry is not None:
+            entry[0] = time.monotonic()
+
+    async def _run(self):
+        tick = self._wheel.tick
+        next_at = time.monotonic()
+        while True:
+            next_at += tick
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+            try:
+                self._tick()
+            except Exception as e:
+                logger.error("[WSLiveness] 存活检测失败: %s", e)
+
+    def _tick(self):
+        started = time.perf_counter()
+        now = time.monotonic()
+        due = self._wheel.advance()
+        for conn in due:
+            entry = self._seen.get(conn)
+            if entry is None:
+                continue
+            last_seen, last_ping = entry
+            idle = now - last_seen
+            if idle >= self.idle_timeout:
+                self.reaped += 1
+                self.untrack(conn)
+                self._reap(conn)
+                continue
+            if idle >= self.ping_interval:
+                if last_ping <= last_seen:
+                    entry[1] = now
+                    self.pings += 1
+                    self._ping(conn)
+                self._wheel.schedule(conn, self.idle_timeout - idle)
+            else:
+                self._wheel.schedule(conn, self.ping_interval - idle)
+        self.ticks += 1
+        self.checked += len(due)
+        self.last_tick_ms = (time.perf_counter() - started) * 1000
+        if self.last_tick_ms > self.max_tick_ms:
+            self.max_tick_ms = self.last_tick_ms
+
+    def get_stats(self) -> dict:
+        return {
+            "tracked": len(self._seen),
+            "ping_interval": self.ping_interval,
+            "idle_timeout": self.idle_timeout,
+            "ticks": self.ticks,
+            "checked": self.checked,
+            "pings": self.pings,
+            "reaped": self.reaped,
+            "last_tick_ms": round(self.last_tick_ms, 3),
+            "max_tick_ms": round(self.max_tick_ms, 3),
+        }
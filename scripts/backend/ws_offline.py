@@ -0,0 +1,278 @@
+"""
+WebSocket 设备离线缓冲 - 每个设备一条只追加的推送流
+- 推送按设备追加到缓冲，游标（流 ID，形如 "毫秒-序号"）随推送帧下发
+- 设备重连绑定时携带 resume_from 游标，缓冲中该游标之后的推送按顺序补发
+- 带 collapse_key 的推送只保留每个 key 最新的一条
+- 按条数和时间裁剪，内存占用有上限
+- 只为绑定过的设备缓冲：设备绑定时记入该用户的已知设备（每个用户保留最近绑定的 max_devices 个），
+  推送到未知设备名时不缓冲，避免任意设备名各生成一条缓冲流
+- 有 Redis 时使用 Redis Stream（多进程共享，一次 pipeline 写入所有设备）；无 Redis 时使用进程内缓冲
+"""
+
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY_PREFIX = "ws:offline:"
+KNOWN_KEY_PREFIX = "ws:devices:"
+
+# 追加推送：按条数和时间裁剪，同一 collapse_key 删除之前的条目
+# KEYS: 流, collapse 索引; ARGV: payload, wrap, collapse_key, max_len, min_id, ttl
+APPEND_SCRIPT = """
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[4], '*', 'p', ARGV[1], 'w', ARGV[2])
+redis.call('XTRIM', KEYS[1], 'MINID', '~', ARGV[5])
+if ARGV[3] ~= '' then
+    local old = redis.call('HGET', KEYS[2], ARGV[3])
+    if old then
+        redis.call('XDEL', KEYS[1], old)
+    end
+    redis.call('HSET', KEYS[2], ARGV[3], id)
+    redis.call('EXPIRE', KEYS[2], ARGV[6])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+return id
+"""
+
+# 记录设备绑定，只保留最近绑定的若干个设备
+# KEYS: 已知设备集合; ARGV: device_name, 绑定时间, max_devices, ttl
+REMEMBER_SCRIPT = """
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[3]) - 1)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+"""
+
+
+class BufferedPush(NamedTuple):
+    cursor: str
+    payload: str
+    wrap: bool
+
+
+def cursor_key(cursor: str) -> Tuple[int, int]:
+    """游标排序键；格式错误的游标视为最早"""
+    ms, _, seq = cursor.partition("-")
+    try:
+        return int(ms), int(seq or 0)
+    except ValueError:
+        return 0, 0
+
+
+class _LocalStream:
+    __slots__ = ("entries", "keyed")
+
+    def __init__(self):
+        # [cursor, 追加时间, payload, wrap, collapse_key]；collapse 替换后的条目 payload 置为 None
+        self.entries: Deque[list] = deque()
+        self.keyed: Dict[str, list] = {}
+
+
+class OfflineBuffer:
+    """设备推送缓冲"""
+
+    def __init__(
+        self,
+        max_len: int = 500,
+        max_age: int = 86400,
+        local_max_devices: int = 10_000,
+        max_devices: int = 32,
+        known_ttl: int = 30 * 86400,
+    ):
+        self._redis = None
+        self._script = None
+        self._remember_script = None
+        self._max_len = max_len
+        self._max_age = max_age
+        self._local_max_devices = local_max_devices
+        self._max_devices = max_devices
+        self._known_ttl = known_ttl
+        self._local: "OrderedDict[str, _LocalStream]" = OrderedDict()
+        # user_id -> 已知设备名（按绑定先后排序）
+        self._local_known: "OrderedDict[str, OrderedDict[str, None]]" = OrderedDict()
+        self._last_id = (0, 0)
+        self.appended = 0
+        self.unknown_skipped = 0
+        self.replayed = 0
+        self.redis_errors = 0
+
+    def start(self, redis_conn):
+        self._redis = redis_conn
+        if redis_conn is not None:
+            self._script = redis_conn.register_script(APPEND_SCRIPT)
+            self._remember_script = redis_conn.register_script(REMEMBER_SCRIPT)
+
+    @staticmethod
+    def _keys(user_id: str, device_name: str) -> Tuple[str, str]:
+        # 哈希标签保证流和索引在同一 slot
+        stream = f"{STREAM_KEY_PREFIX}{{{user_id}:{device_name}}}"
+        return stream, stream + ":keys"
+
+    # ======== 已知设备 ========
+
+    async def remember(self, user_id: str, device_name: str):
+        """设备绑定时调用，之后发往该设备的推送才会缓冲"""
+        self._local_remember(user_id, device_name)
+        if self._redis is not None:
+            try:
+                await self._remember_script(
+                    keys=[KNOWN_KEY_PREFIX + user_id],
+                    args=[device_name, time.time(), self._max_devices, self._known_ttl]
+                )
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning("[WSOffline] 记录已知设备失败: %s", e)
+
+    def _local_remember(self, user_id: str, device_name: str):
+        known = self._local_known.get(user_id)
+        if known is None:
+            known = self._local_known[user_id] = OrderedDict()
+            while len(self._local_known) > self._local_max_devices:
+                self._local_known.popitem(last=False)
+        else:
+            self._local_known.move_to_end(user_id)
+        known[device_name] = None
+        known.move_to_end(device_name)
+        while len(known) > self._max_devices:
+            known.popitem(last=False)
+
+    async def _known(self, user_id: str, device_names: List[str]) -> List[str]:
+        pipe = self._redis.pipeline(transaction=False)
+        key = KNOWN_KEY_PREFIX + user_id
+        for name in device_names:
+            pipe.zscore(key, name)
+        scores = await pipe.execute()
+        return [name for name, score in zip(device_names, scores) if score is not None]
+
+    def _local_known_names(self, user_id: str, device_names: List[str]) -> List[str]:
+        known = self._local_known.get(user_id, ())
+        return [name for name in device_names if name in known]
+
+    # ======== 追加 ========
+
+    async def append(
+        self,
+        user_id: str,
+        device_names: Iterable[str],
+        payload: str,
+        wrap: bool,
+        collapse_key: Optional[str] = None,
+    ) -> Dict[str, str]:
+        """追加到各设备的缓冲，返回 device_name -> 游标（未绑定过的设备不缓冲，也不返回游标）"""
+        device_names = list(device_names)
+        if not device_names:
+            return {}
+        known = None
+        if self._redis is not None:
+            min_id = f"{int((time.time() - self._max_age) * 1000)}-0"
+            try:
+                known = await self._known(user_id, device_names)
+                if not known:
+                    self.unknown_skipped += len(device_names)
+                    return {}
+                pipe = self._redis.pipeline(transaction=False)
+                for name in known:
+                    self._script(
+                        keys=self._keys(user_id, name),
+                        args=[payload, int(wrap), collapse_key or "", self._max_len, min_id, self._max_age],
+                        client=pipe
+                    )
+                ids = await pipe.execute()
+                self.appended += len(known)
+                self.unknown_skipped += len(device_names) - len(known)
+                return {
+                    name: cursor.decode() if isinstance(cursor, bytes) else cursor
+                    for name, cursor in zip(known, ids)
+                }
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning("[WSOffline] Redis 缓冲写入失败，使用本地缓冲: %s", e)
+        if known is None:
+            known = self._local_known_names(user_id, device_names)
+        self.appended += len(known)
+        self.unknown_skipped += len(device_names) - len(known)
+        return {name: self._local_append(f"{user_id}:{name}", payload, wrap, collapse_key) for name in known}
+
+    def _next_id(self) -> str:
+        ms = int(time.time() * 1000)
+        last_ms, last_seq = self._last_id
+        self._last_id = (ms, 0) if ms > last_ms else (last_ms, last_seq + 1)
+        return f"{self._last_id[0]}-{self._last_id[1]}"
+
+    def _local_append(self, device_id: str, payload: str, wrap: bool, collapse_key: Optional[str]) -> str:
+        stream = self._local.get(device_id)
+        if stream is None:
+            stream = self._local[device_id] = _LocalStream()
+            while len(self._local) > self._local_max_devices:
+                self._local.popitem(last=False)
+        else:
+            self._local.move_to_end(device_id)
+
+        cursor = self._next_id()
+        now = time.monotonic()
+        entry = [cursor, now, payload, wrap, collapse_key]
+        if collapse_key:
+            old = stream.keyed.get(collapse_key)
+            if old is not None:
+                old[2] = None
+            stream.keyed[collapse_key] = entry
+        stream.entries.append(entry)
+        self._local_trim(stream, now)
+        return cursor
+
+    def _local_trim(self, stream: _LocalStream, now: float):
+        entries = stream.entries
+        while entries and (
+            len(entries) > self._max_len or entries[0][1] < now - self._max_age or entries[0][2] is None
+        ):
+            entry = entries.popleft()
+            if entry[4] and stream.keyed.get(entry[4]) is entry:
+                del stream.keyed[entry[4]]
+
+    # ======== 补发 ========
+
+    async def read(self, user_id: str, device_name: str, after: str, limit: int) -> List[BufferedPush]:
+        """读取游标之后（不含）的推送，按追加顺序"""
+        if self._redis is not None:
+            try:
+                rows = await self._redis.xrange(self._keys(user_id, device_name)[0], min=f"({after}", count=limit)
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning("[WSOffline] 读取缓冲失败: %s", e)
+                return []
+            pushes = []
+            for cursor, fields in rows:
+                if isinstance(cursor, bytes):
+                    cursor = cursor.decode()
+                pushes.append(BufferedPush(cursor, fields[b"p"].decode("utf-8"), fields[b"w"] == b"1"))
+            self.replayed += len(pushes)
+            return pushes
+
+        stream = self._local.get(f"{user_id}:{device_name}")
+        if stream is None:
+            return []
+        self._local_trim(stream, time.monotonic())
+        after_key = cursor_key(after)
+        pushes = []
+        for entry in stream.entries:
+            if entry[2] is None or cursor_key(entry[0]) <= after_key:
+                continue
+            pushes.append(BufferedPush(entry[0], entry[2], entry[3]))
+            if len(pushes) >= limit:
+                break
+        self.replayed += len(pushes)
+        return pushes
+
+    def get_stats(self) -> dict:
+        return {
+            "backend": "redis" if self._redis is not None else "local",
+            "max_len": self._max_len,
+            "max_age": self._max_age,
+            "max_devices": self._max_devices,
+            "local_devices": len(self._local),
+            "appended": self.appended,
+            "unknown_skipped": self.unknown_skipped,
+            "replayed": self.replayed,
+            "redis_errors": self.redis_errors,
+        }
@@ -0,0 +1,136 @@
+"""
+WebSocket 设备归属登记 - user_id:device_name -> 持有连接的 worker
+- 每个用户一个 Redis 有序集合，成员为 "device_name worker_id"，分值为过期时间戳
+- 设备绑定时立即登记，断开时注销；各 worker 定期心跳续期本进程持有的设备
+- worker 异常退出后其登记在 TTL 后自然过期
+- 查询一个用户的所有在线设备只需一次 ZRANGEBYSCORE，通配设备名也由同一次查询解析
+"""
+
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+OWNER_KEY_PREFIX = "ws:owners:"
+
+
+class DeviceRegistry:
+    """设备归属登记"""
+
+    def __init__(self, worker_id: str, ttl: int = 90, heartbeat_interval: float = 30.0):
+        self.worker_id = worker_id
+        self._ttl = ttl
+        self._heartbeat_interval = heartbeat_interval
+        self._redis = None
+        self._local_devices: Optional[Callable[[], Iterable[Tuple[str, str]]]] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self.lookups = 0
+        self.heartbeats = 0
+        self.redis_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._redis is not None
+
+    async def start(self, redis_conn, local_devices: Callable[[], Iterable[Tuple[str, str]]]):
+        """local_devices 返回本进程持有的 (user_id, device_name)，心跳时续期"""
+        self._redis = redis_conn
+        self._local_devices = local_devices
+        if redis_conn is not None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+        # 主动注销本进程的登记，不必等待过期
+        if self._redis is not None and self._local_devices is not None:
+            try:
+                await self._write(self._local_devices(), remove=True)
+            except Exception as e:
+                logger.warning("[WSRegistry] 注销设备登记失败: %s", e)
+
+    def _member(self, device_name: str) -> str:
+        return f"{device_name} {self.worker_id}"
+
+    async def _write(self, devices: Iterable[Tuple[str, str]], remove: bool = False):
+        pipe = self._redis.pipeline(transaction=False)
+        expires_at = time.time() + self._ttl
+        users = set()
+        count = 0
+        for user_id, device_name in devices:
+            key = OWNER_KEY_PREFIX + user_id
+            if remove:
+                pipe.zrem(key, self._member(device_name))
+            else:
+                pipe.zadd(key, {self._member(device_name): expires_at})
+                users.add(key)
+            count += 1
+        for key in users:
+            pipe.expire(key, self._ttl)
+        if count:
+            await pipe.execute()
+
+    async def register(self, user_id: str, device_name: str):
+        if self._redis is None:
+            return
+        try:
+            await self._write(((user_id, device_name),))
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning("[WSRegistry] 登记设备失败，等待下次心跳: %s", e)
+
+    async def unregister(self, user_id: str, device_name: str):
+        if self._redis is None:
+            return
+        try:
+            await self._write(((user_id, device_name),), remove=True)
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning("[WSRegistry] 注销设备失败，等待登记过期: %s", e)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self._heartbeat_interval)
+            try:
+                await self._write(list(self._local_devices()))
+                self.heartbeats += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.redis_errors += 1
+                logger.warning("[WSRegistry] 设备登记心跳失败: %s", e)
+
+    async def owners(self, user_id: str) -> Dict[str, Set[str]]:
+        """用户在线设备 -> 持有连接的 worker 集合（已过期的登记顺带清理）"""
+        self.lookups += 1
+        key = OWNER_KEY_PREFIX + user_id
+        now = time.time()
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.zremrangebyscore(key, "-inf", now)
+        pipe.zrangebyscore(key, now, "+inf")
+        _, members = await pipe.execute()
+        result: Dict[str, Set[str]] = {}
+        for member in members:
+            if isinstance(member, bytes):
+                member = member.decode("utf-8")
+            device_name, _, worker_id = member.rpartition(" ")
+            result.setdefault(device_name, set()).add(worker_id)
+        return result
+
+    def get_stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "backend": "redis" if self._redis is not None else "none",
+            "ttl": self._ttl,
+            "heartbeat_interval": self._heartbeat_interval,
+            "lookups": self.lookups,
+            "heartbeats": self.heartbeats,
+            "redis_errors": self.redis_errors,
+        }